@@ -0,0 +1,196 @@
+"""Crawl a synthetic Drive2 profile end to end with the project settings.
+
+    python benchmarks/bench_crawl.py [--posts N] [--photos N] [--latency S]
+
+The profile (see `mockserver.Drive2Site`) is served by the mock server in
+a child process. `D2ExperimentalSpider` crawls it with the settings of
+the project, except that delays, the throttle and the HTTP cache are
+off: requests to `www.drive2.ru` and `a.d-cd.net` are sent to the mock
+server by `MockDownloadHandler`, the rest of the crawl doesn't know.
+
+Reports pages/sec, items/sec, CPU time per callback and per pipeline
+stage (from the telemetry of `ScrapmetalSpiderMiddleware`) and peak RSS
+of the crawler process. A very large profile, e.g. `--posts 50000
+--photos 200000`, shows how a crawl scales. `--no-priorities` crawls
+every kind of page with the same priority and doesn't hold photos back,
+to compare the time to the first complete logbook.
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from mockserver import Drive2Site, SiteServer, mock_url
+from scrapy.crawler import CrawlerProcess
+from scrapy.settings import Settings
+from twisted.python.failure import Failure
+
+from r2d2.scrapmetal.downloads import StreamingDownloadHandler
+from r2d2.scrapmetal.spiders.d2_spider import D2ExperimentalSpider
+
+
+class MockDownloadHandler(StreamingDownloadHandler):
+    """HTTPS handler which downloads Drive2 pages from the mock server.
+
+    Responses keep the URLs of the requests, so the spider, throttle and
+    files pipeline see real hostnames.
+    """
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler=crawler)
+        self.port = settings.getint("BENCH_MOCK_PORT")
+
+    def download_request(self, request, spider):
+        mocked = request.replace(url=mock_url(request.url, self.port))
+        deferred = super().download_request(mocked, spider)
+        deferred.addBoth(self.restore_request, request, mocked)
+        return deferred
+
+    def restore_request(self, result, request, mocked):
+        # Latency and results of streamed downloads are in the meta.
+        request.meta.update(mocked.meta)
+        if isinstance(result, Failure):
+            return result
+        return result.replace(url=request.url, request=request)
+
+
+def bench_settings(args, port, workdir):
+    settings = Settings()
+    settings.setmodule("r2d2.scrapmetal.settings", priority="project")
+    settings.setdict(
+        {
+            "LOG_LEVEL": "WARNING",
+            "TELNETCONSOLE_ENABLED": False,
+            "DOWNLOAD_DELAY": 0,
+            "CONCURRENT_REQUESTS": args.concurrency,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+            "SCRAPMETAL_THROTTLE_ENABLED": False,
+            "SCRAPMETAL_HTTPCACHE_ENABLED": False,
+            "SCRAPMETAL_SEARCH_PATH": os.path.join(workdir, "search.sqlite"),
+            "DOWNLOAD_HANDLERS": {"https": "__main__.MockDownloadHandler"},
+            "BENCH_MOCK_PORT": port,
+            "FILES_STORE": os.path.join(workdir, "d2images"),
+            "SCRAPMETAL_TELEMETRY_ENABLED": True,
+            "SCRAPMETAL_TELEMETRY_PATH": os.path.join(workdir, "telemetry.jsonl"),
+            "SCRAPMETAL_TELEMETRY_INTERVAL": 3600,
+        },
+        priority="cmdline",
+    )
+    if args.no_priorities:
+        settings.set("SCRAPMETAL_KIND_PRIORITIES", {}, priority="cmdline")
+        settings.set("SCRAPMETAL_FILES_MAX_ACTIVE", None, priority="cmdline")
+    return settings
+
+
+def peak_rss_mib():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def report(crawler, snapshot, elapsed, cpu_seconds):
+    stats = crawler.stats.get_stats()
+    pages = snapshot["responses"]
+    items = stats.get("item_scraped_count", 0)
+    downloads = stats.get("file_status_count/downloaded", 0)
+    print(
+        f"{pages} pages, {items} items, {downloads} images in {elapsed:.1f}s, "
+        f"{cpu_seconds:.1f}s CPU"
+    )
+    print(f"  pages/sec: {pages / elapsed:9.1f}")
+    print(f"  items/sec: {items / elapsed:9.1f}")
+    print(f"  peak RSS:  {peak_rss_mib():9.1f} MiB")
+    print("  callbacks, CPU ms per call:")
+    for name, timing in sorted(snapshot["callbacks"].items()):
+        per_call = 1000 * timing["cpu_seconds"] / timing["count"]
+        print(f"    {name:>20}: {timing['count']:7} calls, {per_call:7.2f} ms")
+    # Time of a stage includes waiting, e.g. for image downloads.
+    print("  pipelines, ms per item:")
+    for name, timing in sorted(snapshot["pipelines"].items()):
+        per_item = 1000 * timing["seconds"] / timing["count"]
+        print(f"    {name:>20}: {timing['count']:7} items, {per_item:7.2f} ms")
+    print(
+        f"  storage: {stats.get('scrapmetal/storage/stalls', 0)} stalls, "
+        f"{stats.get('scrapmetal/storage/stall_seconds', 0.0):.2f}s, "
+        f"at most {stats.get('scrapmetal/storage/max_queued_items', 0)} items queued"
+    )
+    print(
+        f"  albums: {stats.get('scrapmetal/album/fetches_avoided', 0)} photo pages "
+        f"taken from listings, {stats.get('scrapmetal/album/fetched', 0)} fetched"
+    )
+    print(
+        f"  downloads: {stats.get('scrapmetal/downloads/resumed', 0)} resumed, "
+        f"{stats.get('scrapmetal/downloads/bytes_resumed', 0) / (1 << 20):.1f} MiB "
+        "not downloaded again, at most "
+        f"{stats.get('scrapmetal/downloads/max_bytes_in_flight', 0) / (1 << 20):.1f} "
+        "MiB in flight"
+    )
+    print(
+        f"  logbooks: {stats.get('scrapmetal/logbooks/complete', 0)} complete, "
+        f"the first after {stats.get('scrapmetal/logbooks/first_complete_seconds')}s, "
+        f"the last after {stats.get('scrapmetal/logbooks/last_complete_seconds')}s, "
+        f"{stats.get('scrapmetal/files/gate_waits', 0)} photos held back"
+    )
+    errors = stats.get("log_count/ERROR", 0)
+    if errors:
+        print(f"  {errors} errors in the log")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cars", type=int, default=2)
+    parser.add_argument("--posts", type=int, default=200, help="logbook posts")
+    parser.add_argument("--blog-posts", type=int, default=40)
+    parser.add_argument("--albums", type=int, default=4)
+    parser.add_argument("--photos", type=int, default=400, help="album photos")
+    parser.add_argument("--image-size", type=int, default=20_000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument(
+        "--cut", type=float, default=0.0, help="share of images cut off halfway"
+    )
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--full-fidelity", action="store_true", help="fetch every photo page"
+    )
+    parser.add_argument(
+        "--no-priorities", action="store_true", help="crawl kinds in any order"
+    )
+    args = parser.parse_args()
+
+    site = Drive2Site(
+        cars=args.cars,
+        posts=args.posts,
+        blog_posts=args.blog_posts,
+        albums=args.albums,
+        photos=args.photos,
+        image_size=args.image_size,
+    )
+    print(f"Profile of {site.pages} pages")
+    with SiteServer(
+        site, latency=args.latency, cut=args.cut
+    ) as server, tempfile.TemporaryDirectory() as workdir:
+        # The archive is written to the current directory.
+        os.chdir(workdir)
+        process = CrawlerProcess(bench_settings(args, server.port, workdir))
+        crawler = process.create_crawler(D2ExperimentalSpider)
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        process.crawl(
+            crawler,
+            username=site.username,
+            full_fidelity="1" if args.full_fidelity else "",
+        )
+        process.start()
+        elapsed = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+        with open(os.path.join(workdir, "telemetry.jsonl")) as f:
+            snapshot = json.loads(f.readlines()[-1])
+    report(crawler, snapshot, elapsed, cpu_seconds)
+
+
+if __name__ == "__main__":
+    main()
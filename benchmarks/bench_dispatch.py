@@ -0,0 +1,125 @@
+"""Measure link dispatch speed of the spider over recorded listing pages.
+
+    python benchmarks/bench_dispatch.py [--rounds N] [FIXTURES_DIR]
+
+Compares `follow_known_links` with the former loop, which tried every
+pattern on every link and logged each of them. Links are extracted from
+the pages once, only dispatching is measured. Logging goes to /dev/null
+at DEBUG level, as in a crawl with default settings.
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import time
+
+import scrapy
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.spiders import d2_spider
+from r2d2.scrapmetal.spiders.d2_spider import D2ExperimentalSpider
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures" / "pages"
+
+# fixture name -> (page url, links selector, patterns), as in the callbacks.
+LISTINGS = {
+    "logbook": (
+        "https://www.drive2.ru/r/toyota/corolla/288230376151750000/logbook/",
+        "div.c-post-preview__title a.c-link::attr('href')",
+        (d2_spider.PATTERN_CAR_POST,),
+    ),
+    "album": (
+        "https://www.drive2.ru/s/a/CbcAAgLGNiA/",
+        "div.c-snaps-preview a::attr('href')",
+        (d2_spider.PATTERN_PHOTO_POST,),
+    ),
+    "profile": (
+        "https://www.drive2.ru/users/r2d2/",
+        "a.u-link-area::attr(href)",
+        (d2_spider.PATTERN_CAR, d2_spider.PATTERN_PHOTO_ALBUM),
+    ),
+}
+
+
+def legacy_follow_known_links(spider, links, patterns, response, meta=None):
+    meta = meta or {}
+    for next_link in links:
+        if next_link:
+            link_parsed = False
+            for pattern in patterns:
+                if pattern.match(next_link):
+                    link_parsed = True
+                    parser_name = spider.PARSER_MAP[pattern]
+                    callback = getattr(spider, parser_name)
+                    spider.log(
+                        f"Found next link {next_link} -- parser is {parser_name}."
+                    )
+                    next_url = response.urljoin(next_link)
+                    yield scrapy.Request(next_url, callback=callback, meta=meta)
+            if not link_parsed:
+                spider.log(
+                    f"Found a link {next_link} from the page "
+                    f" ({response.url}) but don't know what to do with it"
+                )
+
+
+def load_listings(fixtures):
+    listings = []
+    for name, (url, selector, patterns) in LISTINGS.items():
+        body = (fixtures / f"{name}.html").read_bytes()
+        response = HtmlResponse(url, body=body, encoding="utf-8")
+        listings.append((response, response.css(selector).getall(), patterns))
+    return listings
+
+
+def measure(dispatch, listings, rounds):
+    requests = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for response, links, patterns in listings:
+            requests += sum(1 for _ in dispatch(links, patterns, response))
+    return time.perf_counter() - started, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", nargs="?", type=pathlib.Path, default=FIXTURES)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    crawler = get_crawler(D2ExperimentalSpider)
+    spider = D2ExperimentalSpider.from_crawler(crawler)
+    crawler.stats.open_spider(spider)
+    listings = load_listings(args.fixtures)
+    links = sum(len(links) for _, links, _ in listings) * args.rounds
+
+    def legacy(links, patterns, response):
+        return legacy_follow_known_links(spider, links, patterns, response)
+
+    def fresh(links, patterns, response):
+        # Every round dispatches "new" pages, nothing is a duplicate.
+        spider.seen_urls.clear()
+        return spider.follow_known_links(links, patterns, response)
+
+    def revisited(links, patterns, response):
+        # Every link was requested before: the seen-URL set drops them all.
+        return spider.follow_known_links(links, patterns, response)
+
+    with open(os.devnull, "w") as devnull:
+        logging.basicConfig(level=logging.DEBUG, stream=devnull, force=True)
+        for name, dispatch in (
+            ("legacy", legacy),
+            ("dispatcher", fresh),
+            ("dispatcher, duplicates", revisited),
+        ):
+            elapsed, requests = measure(dispatch, listings, args.rounds)
+            print(
+                f"{name:>24}: {links} links in {elapsed:.2f}s, "
+                f"{links / elapsed:.0f} links/sec, {requests} requests"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Measure field extraction of the spider over recorded listing pages.
+
+    python benchmarks/bench_extract.py [--rounds N] [--repeat N] [FIXTURES_DIR]
+
+Compares the compiled `Spec`s of the spider with the former per-field
+`response.css(...)`/`response.xpath(...)` queries of the callbacks. Every
+round extracts the fields of fresh responses, so neither approach reuses
+selectors of a previous round; the tree is parsed before the clock starts.
+`--repeat` repeats the cards of every page to make large listings, e.g.
+an album of a thousand photos.
+"""
+
+import argparse
+import pathlib
+import re
+import time
+
+from scrapy.http import HtmlResponse
+
+from r2d2.scrapmetal.spiders import d2_spider
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures" / "pages"
+PATTERN_CARDS = re.compile(
+    r"(<div class=\"c-(?:snaps|post)-preview.*</div>)", re.DOTALL
+)
+
+
+def legacy_profile(response):
+    return (
+        response.css("a.u-link-area::attr(href)").getall(),
+        response.css("div.c-post-preview__title a.c-link::attr('href')").getall(),
+        response.xpath("//a[has-class('c-pager__link')][@rel='next']/@href").get(),
+    )
+
+
+def legacy_logbook(response):
+    return (
+        response.css("div.c-post-preview__title a.c-link::attr('href')").getall(),
+        response.xpath("//a[has-class('c-pager__link')][@rel='next']/@href").get(),
+    )
+
+
+def legacy_album(response):
+    snaps = []
+    for card in response.css("div.c-snaps-preview"):
+        snaps.append(
+            {
+                "links": card.css("a::attr(href)").getall(),
+                "username": card.css("a.c-username")
+                .xpath("./span[@itemprop='name']/text()")
+                .get(),
+                "description": card.xpath(".//div[@itemprop='description']/*").get(),
+                "photo_url": card.css("a.c-lightbox-anchor::attr('href')").get(),
+                "datetime": card.css("time::attr(datetime)").get(),
+                "date": card.css(".c-snaps-preview__date::text").get(),
+            }
+        )
+    return (
+        response.css("h1.x-title::text").get(),
+        response.css("div.c-snaps-preview a::attr('href')").getall(),
+        snaps,
+        response.xpath("//a[has-class('c-pager__link')][@rel='next']/@href").get(),
+    )
+
+
+def spec_extractor(spec):
+    def extract(response):
+        fields = tuple(spec.extract(response).values())
+        return fields + (d2_spider.NEXT_PAGE.extract(response.selector.root),)
+
+    return extract
+
+
+# fixture name -> (page url, legacy queries, spec), as in the callbacks.
+PAGES = {
+    "profile": (
+        "https://www.drive2.ru/users/r2d2/",
+        legacy_profile,
+        d2_spider.SPEC_USER_PROFILE,
+    ),
+    "logbook": (
+        "https://www.drive2.ru/r/toyota/corolla/288230376151750000/logbook/",
+        legacy_logbook,
+        d2_spider.SPEC_LOGBOOK,
+    ),
+    "album": (
+        "https://www.drive2.ru/s/a/CbcAAgLGNiA/",
+        legacy_album,
+        d2_spider.SPEC_PHOTO_ALBUM,
+    ),
+}
+
+
+def load_page(fixtures, name, repeat):
+    html = (fixtures / f"{name}.html").read_text(encoding="utf-8")
+    if repeat > 1:
+        html = PATTERN_CARDS.sub(lambda match: match.group(1) * repeat, html, count=1)
+    return html.encode("utf-8")
+
+
+def measure(extract, url, body, rounds):
+    responses = []
+    for _ in range(rounds):
+        response = HtmlResponse(url, body=body, encoding="utf-8")
+        _ = response.selector  # Parse the tree before the clock starts.
+        responses.append(response)
+    started = time.process_time()
+    for response in responses:
+        extract(response)
+    return time.process_time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", nargs="?", type=pathlib.Path, default=FIXTURES)
+    parser.add_argument("--rounds", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20, help="copies of cards")
+    args = parser.parse_args()
+
+    for name, (url, legacy, spec) in PAGES.items():
+        body = load_page(args.fixtures, name, args.repeat)
+        extract = spec_extractor(spec)
+        response = HtmlResponse(url, body=body, encoding="utf-8")
+        assert legacy(response) == extract(response), f"Fields of {name} differ"
+        legacy_cpu = measure(legacy, url, body, args.rounds)
+        spec_cpu = measure(extract, url, body, args.rounds)
+        legacy_ms = 1000 * legacy_cpu / args.rounds
+        spec_ms = 1000 * spec_cpu / args.rounds
+        print(
+            f"{name:>8} ({len(body) // 1024:5} KiB): legacy {legacy_ms:6.3f} ms, "
+            f"spec {spec_ms:6.3f} ms per response, "
+            f"{legacy_ms - spec_ms:6.3f} ms ({1 - spec_ms / legacy_ms:4.0%}) saved"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Compare typed slotted items with the dicts the spider used to yield.
+
+    python benchmarks/bench_items.py [--items N]
+
+Measures memory of N items held at once, building them, and encoding and
+decoding them the way the storage backends did (pickle for shelve, a JSON
+object for SQLite) against the compact `encode_item` codec.
+"""
+
+import argparse
+import json
+import pickle
+import time
+import tracemalloc
+
+from bench_storage import make_items
+
+from r2d2.scrapmetal.items import as_item, decode_item, encode_item
+
+
+def timed(function, values):
+    started = time.perf_counter()
+    results = [function(value) for value in values]
+    return time.perf_counter() - started, results
+
+
+def traced_size(build):
+    tracemalloc.start()
+    values = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, values
+
+
+def report(name, count, elapsed, size=None):
+    line = f"{name:>22}: {count / elapsed:10.0f} items/sec"
+    if size is not None:
+        line += f", {size / count:6.0f} bytes/item"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=100_000)
+    args = parser.parse_args()
+    count = args.items
+
+    # Post contents are shared strings here, so memory is what the
+    # containers themselves cost.
+    dict_memory, dicts = traced_size(lambda: list(make_items(count)))
+    item_memory, items = traced_size(lambda: [as_item(item) for item in dicts])
+    print(f"{'dicts in memory':>22}: {dict_memory / count:6.0f} bytes/item")
+    print(f"{'items in memory':>22}: {item_memory / count:6.0f} bytes/item")
+
+    elapsed, pickled = timed(pickle.dumps, dicts)
+    report("pickle dicts", count, elapsed, sum(map(len, pickled)))
+    elapsed, objects = timed(lambda item: json.dumps(item, ensure_ascii=False), dicts)
+    report("JSON object dicts", count, elapsed, sum(map(len, objects)))
+    elapsed, encoded = timed(encode_item, items)
+    report("encode_item", count, elapsed, sum(map(len, encoded)))
+
+    elapsed, _ = timed(pickle.loads, pickled)
+    report("unpickle dicts", count, elapsed)
+    elapsed, _ = timed(json.loads, objects)
+    report("JSON object loads", count, elapsed)
+    elapsed, _ = timed(decode_item, encoded)
+    report("decode_item", count, elapsed)
+
+
+if __name__ == "__main__":
+    main()
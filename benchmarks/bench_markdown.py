@@ -0,0 +1,51 @@
+"""Measure HTML to Markdown conversion speed over saved post bodies.
+
+    python benchmarks/bench_markdown.py [--posts N] [FIXTURES_DIR]
+
+Fixtures are HTML of `//div[@itemprop='articleBody']` saved from posts.
+"""
+
+import argparse
+import itertools
+import pathlib
+import time
+import tracemalloc
+
+from r2d2.markdown import MarkdownConverter
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures" / "posts"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("fixtures", nargs="?", type=pathlib.Path, default=FIXTURES)
+    parser.add_argument("--posts", type=int, default=5000)
+    args = parser.parse_args()
+
+    corpus = [path.read_text("utf-8") for path in sorted(args.fixtures.glob("*.html"))]
+    if not corpus:
+        parser.error(f"No *.html fixtures in {args.fixtures}")
+    converter = MarkdownConverter(resolve_image=lambda url: "d2images/" + url[-12:])
+    posts = list(itertools.islice(itertools.cycle(corpus), args.posts))
+    size = sum(len(post.encode("utf-8")) for post in posts)
+
+    started = time.perf_counter()
+    for post in posts:
+        converter.convert(post)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    for post in corpus:
+        converter.convert(post)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{args.posts} posts ({size / 1e6:.1f} MB) in {elapsed:.2f}s: "
+        f"{args.posts / elapsed:.0f} posts/sec, {size / elapsed / 1e6:.1f} MB/sec, "
+        f"peak traced memory {peak / 1024:.0f} KiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measure indexing and queries of the full-text search index.
+
+    python benchmarks/bench_search.py [--posts N] [--queries N]
+
+Indexes N synthetic Russian-like posts, with words in different forms and
+Zipf-distributed like in real texts, into a
+fresh `SearchIndex`, indexes them again as a re-crawl would, and times
+queries of one to three words picked from the vocabulary at random,
+reporting the median, the 95th percentile and the slowest.
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from r2d2.scrapmetal import items
+from r2d2.search import SearchIndex
+
+SYLLABLES = """
+    ма за дви ко ре по тор фи све ку кра са ру си фа сте бам ка две ак ге
+    ста ра ан сце гл вы да про пре на фо кар ле ви то ни
+""".split()  # noqa: SIM905
+ENDINGS = ("а", "ы", "у", "ой", "ом", "е", "ами", "ах", "")
+TAGS = ("Ремонт", "Плановое ТО", "Колёса и шины", "Тюнинг", "Покупка запчастей")
+
+
+def make_vocabulary(size, rng):
+    """Word forms and their cumulative weights: stems follow Zipf's law."""
+    stems = sorted(
+        {
+            "".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) + "л"
+            for _ in range(size)
+        }
+    )
+    rng.shuffle(stems)
+    forms = [stem + ending for stem in stems for ending in ENDINGS]
+    weights = [1 / rank for rank in range(1, len(stems) + 1) for _ in ENDINGS]
+    return forms, list(itertools.accumulate(weights))
+
+
+def words(rng, vocabulary, count):
+    forms, cum_weights = vocabulary
+    return " ".join(rng.choices(forms, cum_weights=cum_weights, k=count))
+
+
+def make_posts(count, vocabulary, seed=1):
+    rng = random.Random(seed)
+    for n in range(count):
+        body = words(rng, vocabulary, rng.randint(50, 400))
+        yield items.BlogPost(
+            f"https://www.drive2.ru/l/{n}/",
+            title=words(rng, vocabulary, rng.randint(2, 6)).capitalize(),
+            content=f"<div itemprop='articleBody'><p>{body}</p></div>",
+            tag=rng.choice(TAGS),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--words", type=int, default=20_000, help="vocabulary")
+    args = parser.parse_args()
+    vocabulary = make_vocabulary(args.words, random.Random(0))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "search.sqlite")
+        with SearchIndex(path) as index:
+            started = time.perf_counter()
+            index.update(make_posts(args.posts, vocabulary))
+            index.optimize()
+            elapsed = time.perf_counter() - started
+            size = os.path.getsize(path) / (1 << 20)
+            print(
+                f"indexed {args.posts} posts in {elapsed:.1f}s, "
+                f"{args.posts / elapsed:.0f} posts/sec, {size:.0f} MiB"
+            )
+
+            started = time.perf_counter()
+            _, changed = index.update(make_posts(args.posts, vocabulary))
+            elapsed = time.perf_counter() - started
+            print(f"re-indexed unchanged posts in {elapsed:.1f}s, {changed} changed")
+
+            rng = random.Random(2)
+            timings = []
+            for _ in range(args.queries):
+                query = " ".join(rng.sample(vocabulary[0], rng.randint(1, 3)))
+                started = time.perf_counter()
+                index.search(query, limit=20)
+                timings.append(1000 * (time.perf_counter() - started))
+            print(
+                f"{args.queries} queries: median {statistics.median(timings):.1f} ms, "
+                f"95% {statistics.quantiles(timings, n=20)[-1]:.1f} ms, "
+                f"slowest {max(timings):.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
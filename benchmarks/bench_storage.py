@@ -0,0 +1,76 @@
+"""Compare item write throughput of the storage backends.
+
+    python benchmarks/bench_storage.py [--items N]
+
+`shelve+sync` is the original pipeline behaviour: one `sync()` per item.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from r2d2.scrapmetal.items import as_item
+from r2d2.scrapmetal.storage import ShelveStorage, SQLiteStorage, WriteBehindBuffer
+
+
+def make_items(count):
+    for i in range(count):
+        if i % 3:
+            yield {
+                "kind": "Photo",
+                "url": f"https://a.d-cd.net/photo{i}.jpg",
+                "parent": "https://www.drive2.ru/r/lada/2107/1/",
+                "origin": f"https://www.drive2.ru/l/{i // 3}/",
+                "file_urls": [f"https://a.d-cd.net/photo{i}.jpg"],
+            }
+        else:
+            yield {
+                "kind": "BlogPost",
+                "url": f"https://www.drive2.ru/l/{i // 3}/",
+                "title": f"Post {i}",
+                "published": "2023-01-01T10:00:00+03:00",
+                "parent": "https://www.drive2.ru/r/lada/2107/1/",
+                "origin": "https://www.drive2.ru/r/lada/2107/1/logbook/",
+                "content": "<div itemprop='articleBody'>" + "text " * 400 + "</div>",
+                "tag": "Repair",
+            }
+
+
+def bench_shelve_sync(directory, items):
+    storage = ShelveStorage(os.path.join(directory, "sync.db"))
+    for item in items:
+        storage.put_many([item])
+    storage.close()
+
+
+def bench_buffered(storage_cls, directory, items):
+    path = os.path.join(directory, "buffered" + storage_cls.extension)
+    buffer = WriteBehindBuffer(storage_cls(path))
+    for item in items:
+        buffer.add(item)
+    buffer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=20000)
+    args = parser.parse_args()
+
+    cases = {
+        "shelve+sync": bench_shelve_sync,
+        "shelve+buffer": lambda d, i: bench_buffered(ShelveStorage, d, i),
+        "sqlite+buffer": lambda d, i: bench_buffered(SQLiteStorage, d, i),
+    }
+    for name, case in cases.items():
+        with tempfile.TemporaryDirectory() as directory:
+            # Spider callbacks yield typed items.
+            items = [as_item(item) for item in make_items(args.items)]
+            started = time.perf_counter()
+            case(directory, items)
+            elapsed = time.perf_counter() - started
+        print(f"{name:>14}: {args.items / elapsed:10.0f} items/sec")
+
+
+if __name__ == "__main__":
+    main()
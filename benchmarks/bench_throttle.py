@@ -0,0 +1,99 @@
+"""Compare a fixed download delay with the adaptive per-host throttle.
+
+    python benchmarks/bench_throttle.py [--pages N] [--images N] [--delay S]
+
+Pages and images are served by the local mock server from two hostnames.
+The fixed mode is the old configuration: the same delay and concurrency
+of one for every host. The adaptive mode keeps that delay for pages only.
+"""
+
+import argparse
+import time
+
+import scrapy
+from mockserver import CDN_HOST, PAGE_HOST, MockServer
+from scrapy.crawler import CrawlerRunner
+from twisted.internet import defer, reactor
+
+
+class ThrottleBenchSpider(scrapy.Spider):
+    name = "throttle_bench"
+
+    def start_requests(self):
+        for i in range(self.pages):
+            yield scrapy.Request(self.server.url(f"/page/{i}/", host=PAGE_HOST))
+        for i in range(self.images):
+            yield scrapy.Request(self.server.url(f"/img/{i}.jpg", host=CDN_HOST))
+
+    def parse(self, response):
+        return None
+
+
+def settings(mode, delay):
+    common = {
+        "LOG_LEVEL": "WARNING",
+        "ROBOTSTXT_OBEY": False,
+        "TELNETCONSOLE_ENABLED": False,
+        "REQUEST_FINGERPRINTER_IMPLEMENTATION": "2.7",
+        "RANDOMIZE_DOWNLOAD_DELAY": False,
+        "DOWNLOAD_DELAY": delay,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
+    }
+    if mode == "fixed":
+        return common
+    return {
+        **common,
+        "EXTENSIONS": {"r2d2.scrapmetal.throttle.AdaptiveThrottle": 500},
+        "SCRAPMETAL_THROTTLE_ENABLED": True,
+        "SCRAPMETAL_THROTTLE_SLOTS": {
+            PAGE_HOST: {
+                "delay": delay,
+                "min_delay": delay,
+                "max_delay": delay * 10,
+                "concurrency": 1,
+                "max_concurrency": 1,
+            },
+            CDN_HOST: {
+                "delay": 0,
+                "min_delay": 0,
+                "max_delay": delay * 10,
+                "concurrency": 4,
+                "max_concurrency": 16,
+            },
+        },
+    }
+
+
+@defer.inlineCallbacks
+def run(args, server):
+    for mode in ("fixed", "adaptive"):
+        runner = CrawlerRunner(settings(mode, args.delay))
+        crawler = runner.create_crawler(ThrottleBenchSpider)
+        started = time.perf_counter()
+        yield runner.crawl(crawler, server=server, pages=args.pages, images=args.images)
+        elapsed = time.perf_counter() - started
+        responses = crawler.stats.get_value("response_received_count", 0)
+        print(
+            f"{mode:>9}: {elapsed:7.2f}s, {responses} responses, "
+            f"{responses / elapsed:7.2f} responses/sec"
+        )
+        for key, value in sorted(crawler.stats.get_stats().items()):
+            if key.startswith("scrapmetal/throttle/"):
+                print(f"           {key}: {value}")
+    reactor.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--delay", type=float, default=0.5)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+    with MockServer(latency=args.latency) as server:
+        reactor.callWhenRunning(run, args, server)
+        reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""Local HTTP server which pretends to be Drive2 and its photo CDN.
+
+The same server answers on every local hostname, so `127.0.0.1` can play
+the page host and `localhost` the CDN host: Scrapy puts them into
+different downloader slots.
+
+`Drive2Site` is a synthetic Drive2 profile with cars, logbooks, a journal,
+photo albums and CDN images. Pages are made on request from the listings
+and posts in `fixtures`, so a profile of any size costs no memory.
+"""
+
+import hashlib
+import http.server
+import math
+import multiprocessing
+import pathlib
+import re
+import threading
+import time
+import urllib.parse
+
+PAGE_HOST = "127.0.0.1"
+CDN_HOST = "localhost"
+
+PATTERN_PAGE = re.compile(r"^/page/(\d+)/$")
+PATTERN_IMAGE = re.compile(r"^/img/([\w-]+)\.jpg$")
+
+FIXTURES = pathlib.Path(__file__).parent / "fixtures"
+# Hosts of `Drive2Site` -> path prefix of the host on the mock server.
+SITE_HOSTS = {"www.drive2.ru": "", "a.d-cd.net": "/cdn"}
+
+
+class MockHandler(http.server.BaseHTTPRequestHandler):
+    server_version = "MockDrive2/0.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path = self.path.split("?")[0]
+        if PATTERN_PAGE.match(path):
+            body = f"<html><body><h1 class='x-title'>{path}</h1></body></html>"
+            self.send_body(body.encode(), "text/html; charset=utf-8")
+        elif PATTERN_IMAGE.match(path):
+            self.send_body(b"\xff\xd8" + b"\0" * self.server.image_size, "image/jpeg")
+        else:
+            self.send_body(b"Not found", "text/plain", status=404)
+
+
+class MockServer:
+    """Run the mock server in a background thread.
+
+    with MockServer(latency=0.05) as server:
+        server.url("/page/1/")
+    """
+
+    handler_class = MockHandler
+
+    def __init__(self, latency=0.05, image_size=20_000):
+        self.httpd = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), self.handler_class
+        )
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.image_size = image_size
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def url(self, path, host=PAGE_HOST):
+        return f"http://{host}:{self.port}{path}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def mock_url(url, port):
+    """URL of a Drive2 or CDN page on the mock server at `port`."""
+    parts = urllib.parse.urlsplit(url)
+    prefix = SITE_HOSTS[parts.hostname]
+    path = prefix + parts.path + (f"?{parts.query}" if parts.query else "")
+    return f"http://127.0.0.1:{port}{path}"
+
+
+TITLES = ("Замена масла", "Новые колодки", "Поездка на Байкал", "Зимняя резина")
+PATTERN_FIXTURE_IMAGE = re.compile(r"https://a\.d-cd\.net/(\w+)")
+
+
+def load_templates():
+    """Page templates of `Drive2Site`, `fixtures/site/<name>.html`."""
+    return {
+        path.stem: path.read_text(encoding="utf-8").rstrip("\n")
+        for path in (FIXTURES / "site").glob("*.html")
+    }
+
+
+class Drive2Site:
+    """Synthetic Drive2 profile of one user.
+
+    The user has `cars` cars, `posts` logbook posts spread over the cars,
+    `blog_posts` posts in the journal and `albums` photo albums (linked
+    from the cars) with `photos` photos in total. Every post has the
+    pictures of a fixture post, every car `car_photos` photos. Listings
+    have `page_size` entries per page, newest first.
+
+    `/cdn/` serves an image of `image_size` bytes for any name, different
+    for every name.
+    """
+
+    def __init__(
+        self,
+        username="r2d2",
+        cars=2,
+        posts=200,
+        blog_posts=40,
+        albums=4,
+        photos=400,
+        car_photos=3,
+        page_size=20,
+        image_size=20_000,
+    ):
+        self.username = username
+        self.cars = cars
+        self.posts = posts
+        self.blog_posts = blog_posts
+        self.albums = albums
+        self.photos = photos
+        self.car_photos = car_photos
+        self.page_size = page_size
+        self.image_size = image_size
+        self.templates = load_templates()
+        self.post_bodies = [
+            path.read_text(encoding="utf-8")
+            for path in sorted((FIXTURES / "posts").glob("*.html"))
+        ]
+        self.routes = [
+            (re.compile(r"^/users/[\w-]+/$"), self.profile),
+            (re.compile(r"^/r/toyota/m(\d+)/\d+/$"), self.car),
+            (re.compile(r"^/r/toyota/m(\d+)/\d+/logbook/$"), self.logbook),
+            (re.compile(r"^/([lb])/(\d+)/$"), self.post),
+            (re.compile(r"^/s/a/A(\d+)/$"), self.album),
+            (re.compile(r"^/s/P(\d+)/$"), self.photo),
+            (re.compile(r"^/cdn/([\w-]+)\.jpg$"), self.image),
+        ]
+
+    def render(self, template, **values):
+        return self.templates[template].format(**values)
+
+    @property
+    def pages(self):
+        """Number of pages of the whole profile, without images."""
+        listings = self.listing_pages(range(self.blog_posts))
+        for car in range(self.cars):
+            listings += self.listing_pages(self.car_posts(car))
+        for album in range(self.albums):
+            listings += self.listing_pages(self.album_photos(album))
+        return listings + self.cars + self.posts + self.blog_posts + self.photos
+
+    def listing_pages(self, entries):
+        return max(math.ceil(len(entries) / self.page_size), 1)
+
+    def car_url(self, car):
+        return f"/r/toyota/m{car}/{288230376151750000 + car}/"
+
+    def car_posts(self, car):
+        return range(car, self.posts, self.cars)
+
+    def album_photos(self, album):
+        return range(album, self.photos, self.albums)
+
+    def date(self, index):
+        # Newer entries have smaller indexes, an entry a day.
+        timestamp = time.gmtime(1_700_000_000 - index * 86400)
+        return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", timestamp)
+
+    def listing(self, entries, query, url, render):
+        page = int(query.get("page", ["1"])[0])
+        start = (page - 1) * self.page_size
+        parts = [render(entry) for entry in entries[start : start + self.page_size]]
+        if start + self.page_size < len(entries):
+            parts.append(self.render("pager", url=url, page=page + 1))
+        return "\n".join(parts)
+
+    def post_preview(self, letter, index):
+        return self.render(
+            "post_preview",
+            url=f"/{letter}/{index}/",
+            image=f"{letter}{index}",
+            title=TITLES[index % len(TITLES)],
+            date=self.date(index)[:10],
+        )
+
+    def page(self, title, body, head=""):
+        return self.render("page", title=title, head=head, body=body)
+
+    def profile(self, path, query):
+        parts = []
+        if "page" not in query:
+            parts.extend(
+                self.render("card", card="c-car-card", url=self.car_url(car))
+                for car in range(self.cars)
+            )
+            if self.albums:
+                parts.append(self.render("card", card="c-album-card", url="/s/a/A0/"))
+        parts.append(
+            self.listing(
+                range(self.blog_posts),
+                query,
+                path,
+                lambda index: self.post_preview("b", index),
+            )
+        )
+        return self.page(f"Пользователь {self.username}", "\n".join(parts))
+
+    def car(self, path, query, car):
+        car = int(car)
+        body = self.render(
+            "car",
+            url=path,
+            car=car,
+            posts=len(self.car_posts(car)),
+            date=self.date(self.posts + car),
+            photos="\n".join(
+                self.render("car_photo", photo=f"car{car}x{n}")
+                for n in range(self.car_photos)
+            ),
+            albums="\n".join(
+                self.render("car_album", album=album)
+                for album in range(car, self.albums, self.cars)
+            ),
+        )
+        return self.page(f"Toyota M{car}", body)
+
+    def logbook(self, path, query, car):
+        body = self.listing(
+            self.car_posts(int(car)),
+            query,
+            path,
+            lambda index: self.post_preview("l", index),
+        )
+        return self.page("Бортжурнал", body)
+
+    def post(self, path, query, letter, index):
+        index = int(index)
+        # Pictures of the fixture get names of their own in every post.
+        content = PATTERN_FIXTURE_IMAGE.sub(
+            lambda match: f"https://a.d-cd.net/{letter}{index}{match.group(1)}",
+            self.post_bodies[index % len(self.post_bodies)],
+        )
+        return self.page(
+            TITLES[index % len(TITLES)],
+            self.render("post", tag="Своими руками", content=content),
+            head=self.render("published", date=self.date(index)),
+        )
+
+    def album(self, path, query, album):
+        body = self.listing(
+            self.album_photos(int(album)),
+            query,
+            path,
+            lambda index: self.render(
+                "snap_preview",
+                username=self.username,
+                photo=f"P{index}",
+                date=self.date(index),
+            ),
+        )
+        return self.page(f"Фотоальбом {album}", body)
+
+    def photo(self, path, query, index):
+        return self.page(
+            f"Фото {index}",
+            self.render("photo", username=self.username, photo=f"P{index}"),
+            head=self.render("published", date=self.date(int(index))),
+        )
+
+    def image(self, path, query, name):
+        # Different names have different content, see DedupFilesPipeline.
+        digest = hashlib.sha1(name.encode()).digest()
+        return b"\xff\xd8" + digest + b"\0" * self.image_size
+
+    def get(self, path):
+        """Return the body of a page or an image, None if there is none."""
+        parts = urllib.parse.urlsplit(path)
+        query = urllib.parse.parse_qs(parts.query)
+        for pattern, render in self.routes:
+            match = pattern.match(parts.path)
+            if match:
+                return render(parts.path, query, *match.groups())
+        return None
+
+
+PATTERN_RANGE = re.compile(r"bytes=(\d+)-")
+
+
+class SiteHandler(MockHandler):
+    """Serve `server.site`, with keep-alive connections.
+
+    Images are served like a CDN does, with an ETag and `Range` requests.
+    A `server.cut` share of images is cut off halfway when requested
+    whole, as if the connection broke.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def send_image(self, body):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        match = PATTERN_RANGE.fullmatch(self.headers.get("Range", ""))
+        start = int(match.group(1)) if match else 0
+        if self.headers.get("If-Range", etag) != etag or start >= len(body):
+            start = 0
+        self.send_response(206 if start else 200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        if start:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}"
+            )
+        self.end_headers()
+        if not start and body[2] < 256 * self.server.cut:
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        body = self.server.site.get(self.path)
+        if body is None:
+            self.send_body(b"Not found", "text/plain", status=404)
+        elif isinstance(body, bytes):
+            self.send_image(body)
+        else:
+            self.send_body(body.encode("utf-8"), "text/html; charset=utf-8")
+
+
+def serve_site(site, latency, cut, ports):
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SiteHandler)
+    httpd.daemon_threads = True
+    httpd.latency = latency
+    httpd.cut = cut
+    httpd.site = site
+    ports.put(httpd.server_address[1])
+    httpd.serve_forever()
+
+
+class SiteServer:
+    """Serve a `Drive2Site` from a child process.
+
+    The server doesn't share the GIL with the crawler, so CPU time of the
+    crawl isn't mixed with page rendering.
+
+    with SiteServer(Drive2Site(posts=1000)) as server:
+        mock_url("https://www.drive2.ru/users/r2d2/", server.port)
+    """
+
+    def __init__(self, site, latency=0.0, cut=0.0):
+        self.ports = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve_site, args=(site, latency, cut, self.ports), daemon=True
+        )
+        self.port = None
+
+    def __enter__(self):
+        self.process.start()
+        self.port = self.ports.get(timeout=30)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
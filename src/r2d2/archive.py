@@ -0,0 +1,196 @@
+"""Read-side API of crawl archives.
+
+`Archive` answers questions like "all posts of this car" or "all photos
+of this album" without reading the whole archive:
+
+    with Archive.open("d2_export_1700000000.sqlite") as archive:
+        for photo in archive.items(kinds=["Photo"], origin=post_url):
+            ...
+
+Lookups by kind, parent, origin and publish date use indexes of
+`SQLiteStorage`, and items are decoded one at a time while the caller
+iterates. `records` doesn't decode items at all, it's enough to list or
+count them. Legacy `shelve` archives are supported with full scans.
+"""
+
+import datetime
+
+from r2d2.scrapmetal.items import as_item, decode_item
+from r2d2.scrapmetal.storage import (
+    ShelveStorage,
+    SQLiteStorage,
+    open_storage,
+    published_key,
+)
+
+ORDER_ROWID = "rowid"
+ORDER_PUBLISHED = "published"
+ORDERS = (ORDER_ROWID, ORDER_PUBLISHED)
+
+
+class Record:
+    """Indexed fields of an archived item; the item is decoded on access."""
+
+    __slots__ = ("_data", "_item", "kind", "origin", "parent", "published", "url")
+
+    def __init__(self, kind, url, parent, origin, published, data=None, item=None):
+        self.kind = kind
+        self.url = url
+        self.parent = parent
+        self.origin = origin
+        self.published = published
+        self._data = data
+        self._item = item
+
+    @property
+    def item(self):
+        if self._item is None:
+            self._item = decode_item(self._data)
+        return self._item
+
+    def __repr__(self):
+        return f"Record({self.kind!r}, {self.url!r})"
+
+
+def as_date_key(value):
+    """`published_key` of a date or an ISO 8601 string, None stays None."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    elif not isinstance(value, datetime.datetime):
+        value = datetime.datetime.combine(value, datetime.time())
+    return published_key(value)
+
+
+def in_range(published, since, until):
+    if since is None and until is None:
+        return True
+    if published is None:
+        return False
+    return (since is None or published >= since) and (
+        until is None or published < until
+    )
+
+
+class Archive:
+    """Indexed, lazy queries over a storage of `r2d2.scrapmetal.storage`.
+
+    Filters of `records`/`items`/`count` are combined with AND:
+
+    - `kinds`: item kinds, e.g. `["BlogPost", "PhotoPost"]`;
+    - `parent`, `origin`: URL of the parent or origin page;
+    - `since`, `until`: publish date range, `since <= published < until`.
+      Items without a publish date don't match a date range.
+
+    Records come in the order they were first written, or by publish date
+    with `order="published"`.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    @classmethod
+    def open(cls, path, backend=None):
+        return cls(open_storage(path, backend))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.storage.close()
+
+    def records(
+        self,
+        kinds=None,
+        parent=None,
+        origin=None,
+        since=None,
+        until=None,
+        order=ORDER_ROWID,
+    ):
+        if order not in ORDERS:
+            raise ValueError(
+                f"Unknown order {order!r}, expected one of: {', '.join(ORDERS)}"
+            )
+        since, until = as_date_key(since), as_date_key(until)
+        if isinstance(self.storage, SQLiteStorage):
+            return self.select(kinds, parent, origin, since, until, order)
+        if isinstance(self.storage, ShelveStorage):
+            return self.scan(kinds, parent, origin, since, until, order)
+        raise TypeError(f"Can't query {type(self.storage).__name__}")
+
+    def items(self, *args, **kwargs):
+        return (record.item for record in self.records(*args, **kwargs))
+
+    def count(self, kinds=None, parent=None, origin=None, since=None, until=None):
+        return sum(1 for _ in self.records(kinds, parent, origin, since, until))
+
+    def get(self, url):
+        """Return the item of `url`, None if it's not in the archive."""
+        if isinstance(self.storage, SQLiteStorage):
+            row = self.storage.connection.execute(
+                "SELECT data FROM items WHERE url = ? ORDER BY rowid DESC LIMIT 1",
+                (url,),
+            ).fetchone()
+            return decode_item(row[0]) if row is not None else None
+        for item in self.storage.iter_items():
+            if item.url == url:
+                return item
+        return None
+
+    def select(self, kinds, parent, origin, since, until, order):
+        conditions = []
+        params = []
+        if kinds is not None:
+            kinds = list(kinds)
+            conditions.append("kind IN ({})".format(", ".join("?" * len(kinds))))
+            params.extend(kinds)
+        for column, value in (("parent", parent), ("origin", origin)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("published >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("published < ?")
+            params.append(until)
+        query = "SELECT kind, url, parent, origin, published, data FROM items"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if order == ORDER_PUBLISHED:
+            query += " ORDER BY published, rowid"
+        else:
+            query += " ORDER BY rowid"
+        cursor = self.storage.connection.execute(query, params)
+        for *fields, data in cursor:
+            yield Record(*fields, data=data)
+
+    def scan(self, kinds, parent, origin, since, until, order):
+        # shelve has neither indexes nor an order, every query decodes all
+        # items and sorting by date keeps the matching ones in memory.
+        records = (
+            Record(
+                item.kind,
+                item.url,
+                item.parent,
+                item.origin,
+                published_key(getattr(item, "published", None)),
+                item=item,
+            )
+            for item in map(as_item, self.storage.iter_items(kinds))
+        )
+        records = (
+            record
+            for record in records
+            if (parent is None or record.parent == parent)
+            and (origin is None or record.origin == origin)
+            and in_range(record.published, since, until)
+        )
+        if order == ORDER_PUBLISHED:
+            records = sorted(records, key=lambda record: record.published or "")
+        yield from records
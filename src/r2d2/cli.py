@@ -0,0 +1,255 @@
+"""Command line tools to work with crawl archives."""
+
+import argparse
+import dataclasses
+import json
+import os
+import sys
+import time
+
+from r2d2.archive import ORDERS, Archive
+from r2d2.exporters.columnar import ColumnarExporter
+from r2d2.exporters.dayone import DayOneExporter, local_photos
+from r2d2.exporters.ndjson import COMPRESSIONS, NdjsonExporter
+from r2d2.markdown import MarkdownConverter
+from r2d2.scrapmetal.pages import PageArchive
+from r2d2.scrapmetal.reparse import reparse
+from r2d2.scrapmetal.storage import WriteBehindBuffer, open_storage
+from r2d2.search import KINDS, SearchIndex
+
+
+def export_dayone(args):
+    with Archive.open(args.archive) as archive:
+        exporter = DayOneExporter(archive, files_store=args.files_store)
+        exporter.export(args.output)
+    print(
+        f"Exported {exporter.entries} entries with {exporter.photos} photos "
+        f"to {args.output}, skipped {exporter.skipped}."
+    )
+
+
+def convert_markdown(args):
+    """Fill `markdown_text` of blog posts in an archive."""
+    reader = Archive.open(args.archive)
+    writer = WriteBehindBuffer(open_storage(args.archive))
+    converted = 0
+    try:
+        for item in reader.items(kinds=["BlogPost"]):
+            images = dict(local_photos(reader, item.url, args.files_store))
+            converter = MarkdownConverter(resolve_image=images.get)
+            item.markdown_text = converter.convert(item.content)
+            writer.add(item)
+            converted += 1
+    finally:
+        writer.close()
+        reader.close()
+    print(f"Converted {converted} posts in {args.archive}.")
+
+
+def query_archive(args):
+    """Print items of an archive which match the filters."""
+    with Archive.open(args.archive) as archive:
+        if args.count:
+            print(
+                archive.count(
+                    args.kind, args.parent, args.origin, args.since, args.until
+                )
+            )
+            return
+        records = archive.records(
+            args.kind, args.parent, args.origin, args.since, args.until, args.order
+        )
+        for record in records:
+            if args.json:
+                data = dataclasses.asdict(record.item)
+                print(json.dumps(data, ensure_ascii=False, default=str))
+            else:
+                print(record.kind, record.published or "-", record.url, sep="\t")
+
+
+EXPORT_FORMATS = ("ndjson", "parquet")
+
+
+def export_stream(args):
+    """Stream an archive into NDJSON files or Parquet metadata."""
+    filters = {
+        "kinds": args.kind,
+        "parent": args.parent,
+        "origin": args.origin,
+        "since": args.since,
+        "until": args.until,
+        "order": args.order,
+    }
+    with Archive.open(args.archive) as archive:
+        try:
+            if args.format == "parquet":
+                exporter = ColumnarExporter(archive)
+            else:
+                exporter = NdjsonExporter(
+                    archive,
+                    compression=args.compression,
+                    max_bytes=args.max_size << 20,
+                )
+            exporter.export(args.output, **filters)
+        except ImportError as error:
+            sys.exit(f"r2d2 export: {error}")
+    if args.format == "parquet":
+        print(
+            f"Exported {exporter.items} items to {args.output}, "
+            f"{exporter.content_bytes / (1 << 20):.1f} MiB of HTML."
+        )
+    else:
+        print(
+            f"Exported {exporter.items} items to {len(exporter.paths)} files "
+            f"in {args.output}, {exporter.bytes_in / (1 << 20):.1f} MiB "
+            f"compressed to {exporter.bytes_out / (1 << 20):.1f} MiB."
+        )
+
+
+def index_archive(args):
+    """Add items of archives to a full-text index."""
+    started = time.perf_counter()
+    count = changed = 0
+    with SearchIndex(args.output) as index:
+        for path in args.archives:
+            with Archive.open(path) as archive:
+                seen, added = index.update(archive.items(kinds=KINDS))
+            count += seen
+            changed += added
+        index.optimize()
+        total = len(index)
+    print(
+        f"Indexed {changed} new or changed of {count} items in "
+        f"{time.perf_counter() - started:.1f}s, {total} in {args.output}."
+    )
+
+
+def search_index(args):
+    """Print URLs of indexed items which match a query, best first."""
+    if not os.path.exists(args.index):
+        sys.exit(f"r2d2 search: no index at {args.index}, see r2d2 index")
+    with SearchIndex(args.index) as index:
+        hits = index.search(args.query, kinds=args.kind, limit=args.limit)
+    for hit in hits:
+        if args.json:
+            print(json.dumps(dataclasses.asdict(hit), ensure_ascii=False))
+        else:
+            print(f"{hit.score:.2f}", hit.kind, hit.url, hit.title, sep="\t")
+
+
+def reparse_pages(args):
+    pages = PageArchive(args.pages)
+    buffer = WriteBehindBuffer(open_storage(args.output))
+    started = time.perf_counter()
+    try:
+        stats = reparse(pages, buffer, workers=args.workers)
+    finally:
+        buffer.close()
+        pages.close()
+    elapsed = time.perf_counter() - started
+    total = sum(worker.pages for worker in stats.values())
+    for pid, worker in sorted(stats.items()):
+        print(
+            f"worker {pid}: {worker.pages} pages, {worker.failed} failed, "
+            f"{worker.pages_per_second:.1f} pages/sec"
+        )
+    print(f"Parsed {total} pages in {elapsed:.1f}s into {args.output}.")
+
+
+def add_filter_arguments(parser):
+    """Arguments of `Archive.records` filters."""
+    parser.add_argument(
+        "-k", "--kind", action="append", help="e.g. BlogPost, may be repeated"
+    )
+    parser.add_argument("--parent", help="URL of the parent page")
+    parser.add_argument("--origin", help="URL of the origin page")
+    parser.add_argument("--since", help="published at or after, e.g. 2023-01-01")
+    parser.add_argument("--until", help="published before, e.g. 2024-01-01")
+    parser.add_argument("--order", choices=ORDERS, default=ORDERS[0])
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="r2d2", description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    dayone = commands.add_parser("dayone", help="export archive as Day One ZIP")
+    dayone.add_argument("archive", help="crawl archive, e.g. d2_export_1.sqlite")
+    dayone.add_argument("-o", "--output", default="dayone.zip")
+    dayone.add_argument(
+        "--files-store", default="d2images", help="FILES_STORE of the crawl"
+    )
+    dayone.set_defaults(handler=export_dayone)
+
+    markdown = commands.add_parser(
+        "markdown", help="convert HTML of archived posts to Markdown"
+    )
+    markdown.add_argument("archive")
+    markdown.add_argument(
+        "--files-store", default="d2images", help="FILES_STORE of the crawl"
+    )
+    markdown.set_defaults(handler=convert_markdown)
+
+    query = commands.add_parser(
+        "query", help="list archived items by kind, parent, origin or date"
+    )
+    query.add_argument("archive")
+    add_filter_arguments(query)
+    output = query.add_mutually_exclusive_group()
+    output.add_argument("--json", action="store_true", help="print items as JSON")
+    output.add_argument("--count", action="store_true", help="print the count")
+    query.set_defaults(handler=query_archive)
+
+    export = commands.add_parser(
+        "export", help="export archive as chunked NDJSON or Parquet metadata"
+    )
+    export.add_argument("archive")
+    export.add_argument("-o", "--output", default="d2_export", help="directory")
+    export.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="ndjson")
+    export.add_argument(
+        "--compression", choices=COMPRESSIONS, default="gzip", help="of NDJSON"
+    )
+    export.add_argument(
+        "--max-size",
+        type=int,
+        default=128,
+        help="MiB of JSON per file, before compression",
+    )
+    add_filter_arguments(export)
+    export.set_defaults(handler=export_stream)
+
+    index = commands.add_parser(
+        "index", help="add archived items to a full-text search index"
+    )
+    index.add_argument("archives", nargs="+")
+    index.add_argument("-o", "--output", default="d2search.sqlite")
+    index.set_defaults(handler=index_archive)
+
+    search = commands.add_parser("search", help="find items in a search index")
+    search.add_argument("query", help="words to find, e.g. \"замена масла\"")
+    search.add_argument("-i", "--index", default="d2search.sqlite")
+    search.add_argument(
+        "-k", "--kind", action="append", help="e.g. BlogPost, may be repeated"
+    )
+    search.add_argument("-n", "--limit", type=int, default=20)
+    search.add_argument("--json", action="store_true", help="print hits as JSON")
+    search.set_defaults(handler=search_index)
+
+    reparse = commands.add_parser(
+        "reparse", help="parse pages saved with SCRAPMETAL_PAGES_PATH again"
+    )
+    reparse.add_argument("pages", help="saved pages, e.g. d2pages.sqlite")
+    reparse.add_argument("-o", "--output", default="d2_reparsed.sqlite")
+    reparse.add_argument(
+        "-j", "--workers", type=int, default=None, help="default: number of CPUs"
+    )
+    reparse.set_defaults(handler=reparse_pages)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""Export metadata of a crawl archive as a columnar Parquet file.
+
+Analytics over a large archive rarely need post bodies, so they are kept
+out of the table: `metadata.parquet` has a row per item with its kind,
+URLs, publish date, title and tag, and `content.bin` has the HTML of
+posts (`content`) and of cars and photo posts (`description`), one after
+another. A row refers to its HTML by `content_offset`/`content_length` in
+bytes of UTF-8, e.g.:
+
+    with open("content.bin", "rb") as blob:
+        blob.seek(row["content_offset"])
+        html = blob.read(row["content_length"]).decode("utf-8")
+
+Rows are written in groups of `batch_size`, the archive is never read
+into memory as a whole. Requires the optional `pyarrow` package.
+"""
+
+import datetime
+import os
+
+METADATA_FILENAME = "metadata.parquet"
+CONTENT_FILENAME = "content.bin"
+TEXT_COLUMNS = ("kind", "url", "parent", "origin", "user", "title", "tag")
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow") from None
+    return pyarrow, pyarrow.parquet
+
+
+def item_html(item):
+    return getattr(item, "content", None) or getattr(item, "description", None)
+
+
+class ColumnarExporter:
+    """Write items of an `r2d2.archive.Archive` as Parquet and a blob."""
+
+    def __init__(self, archive, batch_size=10_000, compression="zstd"):
+        self.pa, self.pq = import_pyarrow()
+        self.archive = archive
+        self.batch_size = batch_size
+        self.compression = compression
+        self.items = 0
+        self.content_bytes = 0
+        fields = [(name, self.pa.string()) for name in TEXT_COLUMNS]
+        fields.insert(4, ("published", self.pa.timestamp("us", tz="UTC")))
+        fields.extend(
+            [("content_offset", self.pa.int64()), ("content_length", self.pa.int64())]
+        )
+        self.schema = self.pa.schema(fields)
+
+    def empty_batch(self):
+        return {name: [] for name in self.schema.names}
+
+    def export(self, directory, **filters):
+        """Write items matching `Archive.records` filters to `directory`.
+
+        Return the number of exported items.
+        """
+        os.makedirs(directory, exist_ok=True)
+        metadata_path = os.path.join(directory, METADATA_FILENAME)
+        content_path = os.path.join(directory, CONTENT_FILENAME)
+        with open(content_path, "wb") as blob, self.pq.ParquetWriter(
+            metadata_path, self.schema, compression=self.compression
+        ) as writer:
+            batch = self.empty_batch()
+            for record in self.archive.records(**filters):
+                self.add_row(batch, record, blob)
+                if len(batch["url"]) >= self.batch_size:
+                    self.write_batch(writer, batch)
+                    batch = self.empty_batch()
+            if batch["url"] or not self.items:
+                self.write_batch(writer, batch)
+        return self.items
+
+    def add_row(self, batch, record, blob):
+        item = record.item
+        for name in TEXT_COLUMNS:
+            batch[name].append(getattr(item, name, None))
+        # The archive keeps publish dates in UTC already, the spider gives
+        # dates of pages and cards a timezone.
+        published = record.published
+        batch["published"].append(
+            datetime.datetime.fromisoformat(published).replace(
+                tzinfo=datetime.timezone.utc
+            )
+            if published
+            else None
+        )
+        html = item_html(item)
+        if html is None:
+            batch["content_offset"].append(None)
+            batch["content_length"].append(None)
+        else:
+            data = html.encode("utf-8")
+            batch["content_offset"].append(self.content_bytes)
+            batch["content_length"].append(len(data))
+            blob.write(data)
+            self.content_bytes += len(data)
+        self.items += 1
+
+    def write_batch(self, writer, batch):
+        writer.write_table(self.pa.Table.from_pydict(batch, schema=self.schema))
@@ -0,0 +1,188 @@
+"""Export a crawl archive as a Day One journal ZIP.
+
+The archive is streamed one post at a time: photos of the post are copied
+into the ZIP right away and the entry is appended to a spooled JSON file,
+which becomes `Journal.json` at the end. Neither the list of entries nor
+image data is kept in memory.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import uuid
+import zipfile
+
+from r2d2.archive import ORDER_PUBLISHED
+from r2d2.markdown import MarkdownConverter
+from r2d2.models import dayone
+
+logger = logging.getLogger(__name__)
+
+KIND_PHOTO = "Photo"
+KIND_BLOG_POST = "BlogPost"
+KIND_PHOTO_POST = "PhotoPost"
+
+JOURNAL_NAME = "Journal.json"
+PHOTOS_DIR = "photos"
+CHUNK_SIZE = 1 << 16
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def entry_uuid(url):
+    """Stable entry id, so a re-export doesn't duplicate entries on import."""
+    return uuid.uuid5(uuid.NAMESPACE_URL, url).hex.upper()
+
+
+def local_photos(archive, post_url, files_store):
+    """Yield `(url, path)` of downloaded photos attached to a post.
+
+    A resized copy made by `ThumbnailPipeline` is preferred to the original.
+    """
+    for item in archive.items(kinds=[KIND_PHOTO], origin=post_url):
+        for downloaded in item.files:
+            for key in ("thumbnail", "path"):
+                if downloaded.get(key) is None:
+                    continue
+                path = os.path.join(files_store, downloaded[key])
+                if os.path.exists(path):
+                    yield item.url, path
+                    break
+
+
+def moment_url(identifier):
+    return f"dayone-moment://{identifier}"
+
+
+def image_resolver(refs):
+    """Resolve pictures inside a post to the attached photos in `refs`."""
+
+    def resolve_image(url):
+        if url in refs:
+            return moment_url(refs[url][0])
+
+    return resolve_image
+
+
+def item_to_entry(item, converter, photos):
+    """Convert a `BlogPost`/`PhotoPost` archive item to `dayone.Entry`."""
+    if item.published is None:
+        return None
+    if item.kind == KIND_BLOG_POST:
+        body, tag, title = item.content, item.tag, item.title
+    else:
+        body, tag, title = item.description, None, None
+    return dayone.Entry(
+        created_at=item.published,
+        tags=[tag] if tag else [],
+        title=title or "",
+        text=converter.convert(body),
+        attached_photos=photos,
+    )
+
+
+def entry_to_json(entry, url, photos):
+    """Day One JSON of an entry, `photos` are `(identifier, md5)` pairs.
+
+    Photos which aren't placed inside the text are put after it.
+    """
+    created_at = entry.created_at
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(datetime.timezone.utc)
+    text_parts = []
+    if entry.title:
+        text_parts.append(f"# {entry.title}")
+    if entry.text:
+        text_parts.append(entry.text)
+    text_parts.extend(
+        f"![]({moment_url(identifier)})"
+        for identifier, _ in photos
+        if moment_url(identifier) not in entry.text
+    )
+    text_parts.append(url)
+    return {
+        "uuid": entry_uuid(url),
+        "creationDate": created_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "text": "\n\n".join(text_parts),
+        "tags": entry.tags,
+        "photos": [
+            {
+                "identifier": identifier,
+                "md5": md5,
+                "type": "jpeg",
+                "orderInEntry": order,
+            }
+            for order, (identifier, md5) in enumerate(photos)
+        ],
+    }
+
+
+class DayOneExporter:
+    """Write items of an `r2d2.archive.Archive` into a Day One ZIP archive.
+
+    Entries are written in the order of publish dates.
+    """
+
+    def __init__(self, archive, files_store):
+        self.archive = archive
+        self.files_store = files_store
+        self.entries = 0
+        self.photos = 0
+        self.skipped = 0
+
+    def add_photo(self, archive, photo):
+        md5 = file_md5(photo.path)
+        arcname = f"{PHOTOS_DIR}/{md5}.jpeg"
+        # The same photo may be attached to a few posts.
+        if arcname not in archive.NameToInfo:
+            # JPEGs are compressed already.
+            archive.write(photo.path, arcname, compress_type=zipfile.ZIP_STORED)
+            self.photos += 1
+        return md5.upper(), md5
+
+    def write_entries(self, archive, spool):
+        items = self.archive.items(
+            kinds=[KIND_BLOG_POST, KIND_PHOTO_POST], order=ORDER_PUBLISHED
+        )
+        for item in items:
+            if item.published is None:
+                logger.warning(f"Skip {item.url}: publish date is missing.")
+                self.skipped += 1
+                continue
+            photos = {}
+            for url, path in local_photos(self.archive, item.url, self.files_store):
+                photos[url] = dayone.Photo(path=path)
+            refs = {
+                url: self.add_photo(archive, photo) for url, photo in photos.items()
+            }
+            converter = MarkdownConverter(resolve_image=image_resolver(refs))
+            entry = item_to_entry(item, converter, list(photos.values()))
+            if self.entries:
+                spool.write(",\n")
+            json.dump(entry_to_json(entry, item.url, list(refs.values())), spool)
+            self.entries += 1
+
+    def export(self, path):
+        """Write the ZIP to `path`, return the number of exported entries."""
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as spool, zipfile.ZipFile(
+            path, "w", compression=zipfile.ZIP_DEFLATED
+        ) as archive:
+            self.write_entries(archive, spool)
+            # ZipFile allows only one member open for writing, so the
+            # entries are spooled and copied when all photos are written.
+            spool.seek(0)
+            with archive.open(JOURNAL_NAME, "w", force_zip64=True) as journal:
+                journal.write(b'{"metadata": {"version": "1.0"}, "entries": [\n')
+                while chunk := spool.read(CHUNK_SIZE):
+                    journal.write(chunk.encode("utf-8"))
+                journal.write(b"\n]}\n")
+        return self.entries
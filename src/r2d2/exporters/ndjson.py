@@ -0,0 +1,153 @@
+"""Export a crawl archive as chunked, compressed NDJSON.
+
+Items are streamed from an `r2d2.archive.Archive` and written one JSON
+object per line into numbered files, `items-00000.ndjson.gz`,
+`items-00001.ndjson.gz`... A new file is started when the current one
+holds `max_bytes` of JSON, so every file can be processed, uploaded or
+retried on its own, in bounded memory. Compression is gzip, zstd (with the
+optional `zstandard` package) or none.
+"""
+
+import dataclasses
+import datetime
+import gzip
+import json
+import os
+
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+DEFAULT_MAX_BYTES = 128 << 20
+
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def item_to_json(item):
+    return json.dumps(
+        dataclasses.asdict(item), ensure_ascii=False, default=json_default
+    )
+
+
+def open_compressed(path, compression):
+    """Return `(raw file, stream to write to)` of a new compressed file."""
+    if compression not in COMPRESSIONS:
+        raise ValueError(
+            f"Unknown compression {compression!r}, "
+            f"expected one of: {', '.join(COMPRESSIONS)}"
+        )
+    if compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("zstd compression requires zstandard") from None
+    # Closed by the caller, see ChunkedWriter.close_file().
+    raw = open(path, "wb")  # noqa: SIM115
+    if compression == "gzip":
+        return raw, gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6)
+    if compression == "zstd":
+        return raw, zstandard.ZstdCompressor(level=3).stream_writer(raw)
+    return raw, raw
+
+
+class ChunkedWriter:
+    """Write lines into numbered files of at most `max_bytes` each.
+
+    The limit is on the data before compression: compressors buffer their
+    output, so the size on disk is only known when a file is closed. A
+    line longer than the limit gets a file of its own.
+    """
+
+    def __init__(
+        self,
+        directory,
+        prefix="items",
+        suffix=".ndjson",
+        compression="gzip",
+        max_bytes=DEFAULT_MAX_BYTES,
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.suffix = suffix + COMPRESSIONS.get(compression, "")
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.paths = []
+        self.raw = self.stream = None
+        self.file_bytes = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def next_file(self):
+        self.close_file()
+        path = os.path.join(
+            self.directory, f"{self.prefix}-{len(self.paths):05d}{self.suffix}"
+        )
+        self.raw, self.stream = open_compressed(path, self.compression)
+        self.paths.append(path)
+        self.file_bytes = 0
+
+    def write(self, line):
+        data = line.encode("utf-8") + b"\n"
+        if self.stream is None or (
+            self.file_bytes and self.file_bytes + len(data) > self.max_bytes
+        ):
+            self.next_file()
+        self.stream.write(data)
+        self.file_bytes += len(data)
+        self.bytes_in += len(data)
+
+    def close_file(self):
+        if self.stream is None:
+            return
+        if self.stream is not self.raw:
+            # zstandard closes the raw file with its stream, gzip doesn't.
+            self.stream.close()
+        if not self.raw.closed:
+            self.raw.close()
+        self.bytes_out += os.path.getsize(self.paths[-1])
+        self.raw = self.stream = None
+
+    def close(self):
+        self.close_file()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class NdjsonExporter:
+    """Write items of an `r2d2.archive.Archive` as chunked NDJSON."""
+
+    def __init__(
+        self, archive, compression="gzip", max_bytes=DEFAULT_MAX_BYTES, prefix="items"
+    ):
+        self.archive = archive
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self.items = 0
+        self.paths = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def export(self, directory, **filters):
+        """Write items matching `Archive.records` filters to `directory`.
+
+        Return the number of exported items.
+        """
+        with ChunkedWriter(
+            directory,
+            prefix=self.prefix,
+            compression=self.compression,
+            max_bytes=self.max_bytes,
+        ) as writer:
+            for item in self.archive.items(**filters):
+                writer.write(item_to_json(item))
+                self.items += 1
+        self.paths = writer.paths
+        self.bytes_in, self.bytes_out = writer.bytes_in, writer.bytes_out
+        return self.items
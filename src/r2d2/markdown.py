@@ -0,0 +1,165 @@
+"""Convert HTML of Drive2 posts to Markdown.
+
+The converter walks the lxml tree of a post once and writes Markdown as it
+goes. Only markup which Drive2 puts into post bodies is supported:
+paragraphs, headers, links, lists, emphasis and `c-post__pic` images.
+Everything else is rendered as its text.
+"""
+
+import lxml.html
+
+BLOCK_TAGS = frozenset(
+    {"p", "div", "section", "article", "blockquote", "figure", "table", "tr"}
+)
+HEADER_TAGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+EMPHASIS_TAGS = {"b": "**", "strong": "**", "i": "_", "em": "_"}
+SKIP_TAGS = frozenset({"script", "style", "noscript", "iframe"})
+ESCAPE = str.maketrans({char: "\\" + char for char in "\\`*_[]"})
+
+
+class MarkdownWriter:
+    """Accumulate Markdown and keep track of whitespace between the pieces."""
+
+    def __init__(self):
+        self.parts = []
+        # Newlines at the end of the output, -1 for nothing written yet.
+        self.newlines = -1
+        self.space = False
+
+    def write(self, text):
+        if not text:
+            return
+        if self.space and self.newlines == 0 and not self.parts[-1].endswith(" "):
+            self.parts.append(" ")
+        self.space = False
+        self.parts.append(text)
+        self.newlines = 0
+
+    def text(self, text):
+        """Write text of an HTML node: collapse whitespace, escape markup."""
+        words = text.split()
+        if not words:
+            self.space = self.space or bool(text)
+            return
+        if text[0].isspace():
+            self.space = True
+        self.write(" ".join(words).translate(ESCAPE))
+        self.space = text[-1].isspace()
+
+    def newline(self, count=1):
+        """Make sure the output ends with at least `count` newlines."""
+        self.space = False
+        if self.newlines < 0:
+            return
+        if self.newlines < count:
+            self.parts.append("\n" * (count - self.newlines))
+            self.newlines = count
+
+    def getvalue(self):
+        return "".join(self.parts).strip()
+
+
+class MarkdownConverter:
+    """HTML to Markdown converter.
+
+    `resolve_image` maps an image URL to the reference which is put into
+    Markdown, e.g. a path of the downloaded photo. It may return None to
+    keep the original URL.
+    """
+
+    def __init__(self, resolve_image=None):
+        self.resolve_image = resolve_image
+
+    def convert(self, html):
+        """Convert an HTML fragment (string or lxml element) to Markdown."""
+        if html is None or (isinstance(html, str) and not html.strip()):
+            return ""
+        if isinstance(html, str):
+            root = lxml.html.fragment_fromstring(html, create_parent="div")
+        else:
+            root = html
+        writer = MarkdownWriter()
+        self.visit_children(root, writer, lists=())
+        return writer.getvalue()
+
+    def image_ref(self, url):
+        if self.resolve_image is not None:
+            return self.resolve_image(url) or url
+        return url
+
+    def visit_children(self, element, writer, lists):
+        if element.text:
+            writer.text(element.text)
+        for child in element:
+            self.visit(child, writer, lists)
+            if child.tail:
+                writer.text(child.tail)
+
+    def visit(self, element, writer, lists):
+        tag = element.tag
+        if not isinstance(tag, str) or tag in SKIP_TAGS:
+            # Comments and processing instructions.
+            return
+        if tag == "br":
+            writer.newline()
+        elif tag == "img":
+            self.visit_image(element, writer)
+        elif tag == "a":
+            self.visit_link(element, writer, lists)
+        elif tag in EMPHASIS_TAGS:
+            marker = EMPHASIS_TAGS[tag]
+            text = element.text_content().strip()
+            if text and len(element) == 0:
+                writer.write(f"{marker}{text.translate(ESCAPE)}{marker}")
+            else:
+                self.visit_children(element, writer, lists)
+        elif tag in HEADER_TAGS:
+            writer.newline(2)
+            writer.write("#" * HEADER_TAGS[tag] + " ")
+            self.visit_children(element, writer, lists)
+            writer.newline(2)
+        elif tag in ("ul", "ol"):
+            writer.newline(2 if not lists else 1)
+            self.visit_children(element, writer, lists + ([tag == "ol", 0],))
+            writer.newline(2 if not lists else 1)
+        elif tag == "li":
+            self.visit_list_item(element, writer, lists)
+        elif tag in BLOCK_TAGS:
+            writer.newline(2)
+            self.visit_children(element, writer, lists)
+            writer.newline(2)
+        else:
+            self.visit_children(element, writer, lists)
+
+    def visit_image(self, element, writer):
+        url = element.get("src") or element.get("data-src")
+        if not url:
+            return
+        alt = (element.get("alt") or "").translate(ESCAPE)
+        writer.write(f"![{alt}]({self.image_ref(url)})")
+
+    def visit_link(self, element, writer, lists):
+        href = element.get("href")
+        text = element.text_content().strip()
+        if not href or not text:
+            # Links around pictures open the lightbox; keep the picture only.
+            self.visit_children(element, writer, lists)
+            return
+        writer.write(f"[{text.translate(ESCAPE)}]({href})")
+
+    def visit_list_item(self, element, writer, lists):
+        writer.newline()
+        if lists:
+            state = lists[-1]
+            state[1] += 1
+            marker = f"{state[1]}." if state[0] else "-"
+            indent = "   " * (len(lists) - 1)
+        else:
+            marker, indent = "-", ""
+        writer.write(f"{indent}{marker} ")
+        self.visit_children(element, writer, lists)
+        writer.newline()
+
+
+def html_to_markdown(html, resolve_image=None):
+    return MarkdownConverter(resolve_image=resolve_image).convert(html)
@@ -42,7 +42,7 @@ class BlogPost:
 @dataclasses.dataclass
 class Blog:
     url: str
-    List[BlogPost]
+    posts: List[BlogPost]
 
 
 @dataclasses.dataclass
@@ -0,0 +1,374 @@
+"""Streaming, resumable downloads of large files.
+
+Scrapy's HTTP/1.1 handler keeps every response body in memory until it's
+complete, and an interrupted download starts from scratch on retry.
+`StreamingDownloadHandler` downloads requests with `scrapmetal_download_path`
+in their meta straight into that file instead, in chunks:
+
+- the body is hashed while it's written, the response has no body and
+  the result is in `request.meta["scrapmetal_download"]`: the path, the
+  size of the file, `sha256` and `md5` of its content and the bytes
+  received by this request;
+- an interrupted download keeps its partial file, and the next attempt
+  (e.g. by `RetryMiddleware`) asks only for the rest of it with a `Range`
+  request. `If-Range` makes the server send the whole file again if it
+  has changed since;
+- the size is checked against `Content-Length`/`Content-Range`, and the
+  hash against `Content-MD5` if the server sends it. An incomplete file
+  fails the request with `ResponseFailed`, which is retried;
+- `SCRAPMETAL_DOWNLOADS_MAX_BYTES_IN_FLIGHT` caps the bytes of all bodies
+  being received at once. Downloads over the cap wait with their
+  connection paused, so memory use doesn't depend on sizes of files.
+  `download_timeout` applies to getting the response and to reading the
+  body, each on its own, and not to the wait.
+
+Other requests are downloaded as usual, and so are requests through a
+proxy. Moving a complete file to its place is up to the caller, see
+`r2d2.scrapmetal.files.DedupFilesPipeline`.
+"""
+
+import base64
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+import urllib.parse
+
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from twisted.internet import defer, protocol
+from twisted.internet.error import TimeoutError
+from twisted.python.failure import Failure
+from twisted.web.client import Agent, PotentialDataLoss, ResponseDone, ResponseFailed
+from twisted.web.http_headers import Headers as TxHeaders
+from twisted.web.iweb import UNKNOWN_LENGTH
+
+# Path of the file to download a request to.
+META_KEY_DOWNLOAD_PATH = "scrapmetal_download_path"
+# Result of a streamed download.
+META_KEY_DOWNLOAD = "scrapmetal_download"
+
+DEFAULT_MAX_BYTES_IN_FLIGHT = 64 << 20
+# Bytes accounted for a body of unknown length.
+UNKNOWN_LENGTH_ESTIMATE = 1 << 20
+HASH_CHUNK_SIZE = 1 << 20
+PATTERN_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class IncompleteDownload(Exception):
+    """A body is shorter or other than the server said."""
+
+
+def parse_content_range(value):
+    """Return `(first byte, total size or None)` of a `Content-Range` header."""
+    match = PATTERN_CONTENT_RANGE.fullmatch(value.strip()) if value else None
+    if match is None:
+        return None
+    first, _, total = match.groups()
+    return int(first), None if total == "*" else int(total)
+
+
+def hash_file(path, hashes):
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            for digest in hashes:
+                digest.update(chunk)
+
+
+def read_state(path):
+    """Validators of the response a partial file came from, or None."""
+    try:
+        with open(path + ".json", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_state(path, state):
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+
+def discard(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def discard_partial(path):
+    discard(path, path + ".json")
+
+
+def headers_from_twisted(txresponse):
+    headers = Headers()
+    for key, values in txresponse.headers.getAllRawHeaders():
+        headers[key] = values
+    return headers
+
+
+class ByteBudget:
+    """Bytes which may be received at once, shared by all downloads.
+
+    A download over the budget waits until earlier ones are done, in
+    order. A download larger than the whole budget runs on its own.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.waiting = collections.deque()
+
+    def fits(self, size):
+        return not self.used or self.used + size <= self.limit
+
+    def acquire(self, size):
+        """Return a Deferred which fires when `size` bytes are granted.
+
+        Cancelling the Deferred gives up the place in the queue.
+        """
+        deferred = defer.Deferred(lambda d: self.waiting.remove((size, d)))
+        if not self.waiting and self.fits(size):
+            self.grant(size, deferred)
+        else:
+            self.waiting.append((size, deferred))
+        return deferred
+
+    def grant(self, size, deferred):
+        self.used += size
+        deferred.callback(size)
+
+    def release(self, size):
+        self.used -= size
+        while self.waiting and self.fits(self.waiting[0][0]):
+            self.grant(*self.waiting.popleft())
+
+
+class FileWriter(protocol.Protocol):
+    """Write a response body to a file, feeding it to `hashes` too.
+
+    Without a file the body is read and dropped. `finished` fires with the
+    number of received bytes, or fails with the reason the body is
+    incomplete.
+    """
+
+    def __init__(self, file, finished, hashes=()):
+        self.file = file
+        self.finished = finished
+        self.hashes = hashes
+        self.received = 0
+
+    def dataReceived(self, data):
+        if self.file is not None:
+            self.file.write(data)
+        for digest in self.hashes:
+            digest.update(data)
+        self.received += len(data)
+
+    def connectionLost(self, reason):
+        if self.finished.called:
+            return
+        # Without `Content-Length` a body ends with the connection.
+        if reason.check(ResponseDone, PotentialDataLoss):
+            self.finished.callback(self.received)
+        else:
+            self.finished.errback(reason)
+
+
+class StreamingDownloadHandler(HTTP11DownloadHandler):
+    """HTTP(S) handler which downloads marked requests into files."""
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler=crawler)
+        self.budget = ByteBudget(
+            settings.getint(
+                "SCRAPMETAL_DOWNLOADS_MAX_BYTES_IN_FLIGHT", DEFAULT_MAX_BYTES_IN_FLIGHT
+            )
+        )
+
+    def download_request(self, request, spider):
+        if META_KEY_DOWNLOAD_PATH not in request.meta or request.meta.get("proxy"):
+            return super().download_request(request, spider)
+        return defer.ensureDeferred(self.stream(request))
+
+    def inc_stats(self, key, count=1):
+        if self._crawler is not None:
+            self._crawler.stats.inc_value(f"scrapmetal/downloads/{key}", count)
+
+    async def stream(self, request):
+        from twisted.internet import reactor
+
+        path = request.meta[META_KEY_DOWNLOAD_PATH]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        headers = TxHeaders(request.headers)
+        state = read_state(path)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset and state and state.get("validator"):
+            headers.setRawHeaders(b"Range", [f"bytes={offset}-".encode()])
+            headers.setRawHeaders(b"If-Range", [state["validator"].encode()])
+
+        timeout = request.meta.get("download_timeout") or 180
+        agent = Agent(
+            reactor,
+            contextFactory=self._contextFactory,
+            connectTimeout=timeout,
+            pool=self._pool,
+        )
+        url = urllib.parse.urldefrag(request.url)[0]
+        started = time.monotonic()
+        # Every network operation gets its own timeout, waiting for the
+        # budget of bytes in flight doesn't count.
+        txresponse = await self.timed(
+            agent.request(request.method.encode(), url.encode(), headers),
+            request,
+            timeout,
+        )
+        request.meta["download_latency"] = time.monotonic() - started
+        if txresponse.code not in (200, 206):
+            if txresponse.code == 416:
+                # The partial file doesn't fit the file on the server.
+                discard_partial(path)
+            _, finished = self.read_body(txresponse, None)
+            await self.timed(finished, request, timeout)
+            return self.make_response(request, txresponse)
+        offset, total = self.resume_offset(txresponse, offset, path)
+        if txresponse.code == 200:
+            state = {
+                "validator": self.validator(txresponse),
+                "content_md5": self.header(txresponse, b"Content-MD5"),
+            }
+            write_state(path, state)
+        result = await self.receive(
+            request, txresponse, path, offset, total, state, timeout
+        )
+        request.meta[META_KEY_DOWNLOAD] = result
+        flags = ["streamed", "resumed"] if offset else ["streamed"]
+        # The file is complete, whichever part of it this response had.
+        return self.make_response(request, txresponse, status=200, flags=flags)
+
+    @staticmethod
+    def timed(deferred, request, timeout):
+        """Cancel `deferred` and fail with TimeoutError after `timeout`."""
+        from twisted.internet import reactor
+
+        def timed_out(result, timeout):
+            raise TimeoutError(
+                f"Getting {request.url} took longer than {timeout} seconds."
+            )
+
+        return deferred.addTimeout(timeout, reactor, onTimeoutCancel=timed_out)
+
+    @staticmethod
+    def header(txresponse, name):
+        values = txresponse.headers.getRawHeaders(name)
+        return values[-1].decode("latin-1") if values else None
+
+    def validator(self, txresponse):
+        # A weak ETag can't be used with `If-Range`.
+        etag = self.header(txresponse, b"ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return self.header(txresponse, b"Last-Modified")
+
+    def resume_offset(self, txresponse, offset, path):
+        """Return the offset the body starts at and the total size."""
+        length = txresponse.length if txresponse.length != UNKNOWN_LENGTH else None
+        if txresponse.code == 200:
+            # The whole file, either not resumed or changed on the server.
+            return 0, length
+        content_range = parse_content_range(self.header(txresponse, b"Content-Range"))
+        if content_range is None or content_range[0] != offset:
+            discard_partial(path)
+            raise ResponseFailed(
+                [Failure(IncompleteDownload(f"Unexpected range {content_range}"))]
+            )
+        self.inc_stats("resumed")
+        self.inc_stats("bytes_resumed", offset)
+        return offset, content_range[1]
+
+    async def receive(self, request, txresponse, path, offset, total, state, timeout):
+        sha256, md5 = hashlib.sha256(), hashlib.md5()
+        if offset:
+            hash_file(path, (sha256, md5))
+        expected = total - offset if total is not None else UNKNOWN_LENGTH_ESTIMATE
+        granted = self.budget.acquire(expected)
+        held = granted.called
+        try:
+            # Files are written in the reactor thread, chunk by chunk as
+            # they come, see FileWriter.
+            with open(path, "ab" if offset else "wb") as f:  # noqa: ASYNC230
+                producer, finished = self.read_body(txresponse, f, (sha256, md5))
+                if not held:
+                    self.inc_stats("budget_waits")
+                    # Twisted buffers a body until it's read, the connection
+                    # is paused instead.
+                    if producer is not None:
+                        producer.pauseProducing()
+                    await granted
+                    held = True
+                    if producer is not None:
+                        producer.resumeProducing()
+                if self._crawler is not None:
+                    self._crawler.stats.max_value(
+                        "scrapmetal/downloads/max_bytes_in_flight", self.budget.used
+                    )
+                received = await self.timed(finished, request, timeout)
+        finally:
+            if held:
+                self.budget.release(expected)
+            else:
+                # Leave the queue, e.g. when the download is cancelled.
+                granted.cancel()
+        size = offset + received
+        if total is not None and size != total:
+            self.inc_stats("incomplete")
+            raise ResponseFailed(
+                [Failure(IncompleteDownload(f"Got {size} of {total} bytes"))]
+            )
+        content_md5 = state.get("content_md5") if state else None
+        if content_md5 and base64.b64decode(content_md5) != md5.digest():
+            self.inc_stats("corrupt")
+            discard_partial(path)
+            raise ResponseFailed([Failure(IncompleteDownload("Content-MD5 mismatch"))])
+        discard(path + ".json")
+        return {
+            "path": path,
+            "size": size,
+            "received": received,
+            "sha256": sha256.hexdigest(),
+            "md5": md5.hexdigest(),
+        }
+
+    def read_body(self, txresponse, file, hashes=()):
+        """Start reading a body into a file with a `FileWriter`.
+
+        Return the producer of the body, which pauses, resumes and stops
+        the connection (None for an empty body), and a Deferred which
+        fires when the body is read.
+        """
+
+        def stop(_):
+            if writer.transport is not None:
+                writer.transport.stopProducing()
+
+        writer = FileWriter(file, defer.Deferred(stop), hashes)
+        if txresponse.length == 0:
+            writer.finished.callback(0)
+        else:
+            txresponse.deliverBody(writer)
+        return writer.transport, writer.finished
+
+    def make_response(self, request, txresponse, status=None, flags=None):
+        headers = headers_from_twisted(txresponse)
+        respcls = responsetypes.from_args(headers=headers, url=request.url)
+        return respcls(
+            url=request.url,
+            status=status or txresponse.code,
+            headers=headers,
+            body=b"",
+            flags=flags,
+        )
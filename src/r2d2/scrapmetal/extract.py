@@ -0,0 +1,96 @@
+"""Declarative extraction of fields from pages.
+
+Callbacks of the spider used to run every `response.css(...)` and
+`response.xpath(...)` query on its own: each query wraps the results in
+new selectors, and CSS is translated to XPath on every call. A `Spec`
+describes the fields of a kind of page instead:
+
+    POST = Spec(
+        title=Field(css="h1.x-title::text", strip=True),
+        images=Field(css="div.c-post__pic img::attr('src')", many=True),
+    )
+    fields = POST.extract(response)
+
+Queries are compiled into `lxml.etree.XPath` objects once, when the spec
+is created, and evaluated one after another over the tree which Scrapy
+has parsed for the response. Values are the same as `.get()` and
+`.getall()` of the selectors would return. `Repeated` extracts fields of
+every card of a listing, with queries relative to the card.
+"""
+
+from lxml import etree
+
+# Importing parsel also registers its `has-class()` XPath function in lxml.
+from parsel import css2xpath
+
+
+def serialize(value):
+    """Text of a query result, as `parsel.Selector.get()` returns it."""
+    if isinstance(value, etree._Element):
+        return etree.tostring(value, method="html", encoding="unicode", with_tail=False)
+    return str(value)
+
+
+def compile_query(css, xpath):
+    if (css is None) == (xpath is None):
+        raise ValueError("Field needs either a CSS or an XPath query.")
+    query = css2xpath(css) if css is not None else xpath
+    return query, etree.XPath(query, smart_strings=False)
+
+
+class Field:
+    """A value matched by a CSS or an XPath query.
+
+    The first match is extracted, None if there is none, or all of them
+    with `many=True`. `strip=True` strips whitespace around values.
+    """
+
+    def __init__(self, css=None, xpath=None, many=False, strip=False):
+        self.query, self.xpath = compile_query(css, xpath)
+        self.many = many
+        self.strip = strip
+
+    def extract(self, root):
+        values = self.xpath(root)
+        if self.many:
+            values = [serialize(value) for value in values]
+            return [value.strip() for value in values] if self.strip else values
+        if not values:
+            return None
+        value = serialize(values[0])
+        return value.strip() if self.strip else value
+
+    def __repr__(self):
+        return f"Field({self.query!r})"
+
+
+class Spec:
+    """Named fields of a kind of page."""
+
+    def __init__(self, **fields):
+        self.fields = fields
+
+    def extract(self, response):
+        """Return a dict of field values of a response."""
+        return self.extract_root(response.selector.root)
+
+    def extract_root(self, root):
+        return {name: field.extract(root) for name, field in self.fields.items()}
+
+
+class Repeated:
+    """Dicts of fields of every element matched by a CSS or an XPath query.
+
+    Queries of the fields are relative to the element, e.g.
+    `Repeated(css="div.card", link=Field(css="a::attr(href)"))`.
+    """
+
+    def __init__(self, css=None, xpath=None, **fields):
+        self.query, self.xpath = compile_query(css, xpath)
+        self.spec = Spec(**fields)
+
+    def extract(self, root):
+        return [self.spec.extract_root(element) for element in self.xpath(root)]
+
+    def __repr__(self):
+        return f"Repeated({self.query!r})"
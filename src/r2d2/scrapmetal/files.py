@@ -0,0 +1,286 @@
+"""Content-addressed, deduplicating store for downloaded photos.
+
+The same photo often appears on a car page, in an album and inside posts.
+`DedupFilesPipeline` keeps an index of every downloaded URL in
+`FILES_STORE/index` and doesn't schedule a download for a URL which is
+already in the index, in this crawl or in any previous one. Files are
+stored by a hash of their content in `FILES_STORE/objects`, so different
+URLs with the same content share one file.
+
+Both directories are sharded by the first two bytes of the hash
+(`ab/cd/abcd...`), so no directory grows too large.
+
+With `r2d2.scrapmetal.downloads.StreamingDownloadHandler` photos are
+downloaded into `FILES_STORE/partial` instead of memory, interrupted
+downloads are resumed from there, and complete files are moved into
+`objects`.
+
+Scrapy hands photo requests straight to the downloader, past the
+scheduler and its priorities, and takes no requests off the scheduler
+while the downloader holds `CONCURRENT_REQUESTS`. `DownloadGate` keeps
+photos to `SCRAPMETAL_FILES_MAX_ACTIVE` at once and lets the waiting ones
+in in the order they came, so pages are never held up by photos.
+"""
+
+import collections
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines.files import FileException, FilesPipeline, FSFilesStore
+from scrapy.settings import Settings
+from scrapy.utils.python import to_bytes
+from twisted.internet import defer
+
+from r2d2.scrapmetal.downloads import META_KEY_DOWNLOAD, META_KEY_DOWNLOAD_PATH
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = "index"
+OBJECTS_DIR = "objects"
+PARTIAL_DIR = "partial"
+
+
+def streamed_download(response):
+    """Result of a download streamed into a file, None for other responses.
+
+    It's in the meta of the request which was downloaded, e.g. a retry,
+    not of the request FilesPipeline has made.
+    """
+    request = getattr(response, "request", None) if response is not None else None
+    return request.meta.get(META_KEY_DOWNLOAD) if request is not None else None
+
+
+def sharded(digest, suffix=""):
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{suffix}"
+
+
+def open_index(basedir):
+    """`UrlIndex` of the files stored in a local FILES_STORE directory."""
+    return UrlIndex(os.path.join(basedir, INDEX_DIR))
+
+
+class UrlIndex:
+    """url -> stored file record, one small JSON file per URL.
+
+    Recently used records are also kept in memory, up to `cache_size`.
+    """
+
+    def __init__(self, root, cache_size=50_000):
+        self.root = root
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+
+    def record_path(self, url):
+        digest = hashlib.sha1(to_bytes(url)).hexdigest()
+        return os.path.join(self.root, *sharded(digest, ".json").split("/"))
+
+    def remember(self, url, record):
+        self.cache[url] = record
+        self.cache.move_to_end(url)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, url):
+        record = self.cache.get(url)
+        if record is not None:
+            self.cache.move_to_end(url)
+            return record
+        try:
+            with open(self.record_path(url), encoding="utf-8") as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        self.remember(url, record)
+        return record
+
+    def add(self, url, record):
+        path = self.record_path(url)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first, so an interrupted crawl never
+        # leaves a truncated record behind.
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+        self.remember(url, record)
+
+
+class DownloadGate:
+    """At most `limit` downloads at once, the waiting ones in order."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiting = collections.deque()
+
+    def acquire(self):
+        """Return a Deferred which fires when the download may start."""
+        deferred = defer.Deferred()
+        self.waiting.append(deferred)
+        self.let_in()
+        return deferred
+
+    def release(self):
+        self.active -= 1
+        self.let_in()
+
+    def let_in(self):
+        while self.waiting and self.active < self.limit:
+            deferred = self.waiting.popleft()
+            self.active += 1
+            deferred.callback(None)
+
+
+class DedupFilesPipeline(FilesPipeline):
+    """FilesPipeline which downloads every URL once and stores it by content.
+
+    Stats: `scrapmetal/files/downloads_avoided` counts URLs found in the
+    index, `scrapmetal/files/duplicate_content` counts downloads with
+    already stored content, `scrapmetal/files/bytes_saved` sums up both.
+    `scrapmetal/files/gate_waits` counts downloads which waited for the
+    gate, `scrapmetal/files/max_gate_waiting` is the longest wait list.
+    """
+
+    def __init__(self, store_uri, download_func=None, settings=None):
+        super().__init__(store_uri, download_func=download_func, settings=settings)
+        if not isinstance(self.store, FSFilesStore):
+            raise NotConfigured("DedupFilesPipeline supports only local FILES_STORE")
+        self.index = open_index(self.store.basedir)
+        if isinstance(settings, dict) or settings is None:
+            settings = Settings(settings)
+        max_active = settings.get("SCRAPMETAL_FILES_MAX_ACTIVE")
+        self.gate = DownloadGate(int(max_active)) if max_active else None
+        self.priority = settings.getdict("SCRAPMETAL_KIND_PRIORITIES").get("Photo", 0)
+
+    def stored_path(self, path):
+        return os.path.join(self.store.basedir, *path.split("/"))
+
+    def partial_path(self, url):
+        digest = hashlib.sha1(to_bytes(url)).hexdigest()
+        return os.path.join(self.store.basedir, PARTIAL_DIR, f"{digest}.part")
+
+    def inc_dedup_stats(self, spider, key, size):
+        stats = spider.crawler.stats
+        stats.inc_value(f"scrapmetal/files/{key}", spider=spider)
+        stats.inc_value("scrapmetal/files/bytes_saved", size, spider=spider)
+
+    def media_to_download(self, request, info, *, item=None):
+        record = self.index.get(request.url)
+        if record is None or not os.path.exists(self.stored_path(record["path"])):
+            # Returning None forces download, once the gate lets it in.
+            return self.pass_gate(request, info)
+        self.inc_stats(info.spider, "uptodate")
+        self.inc_dedup_stats(info.spider, "downloads_avoided", record["size"])
+        return {
+            "url": request.url,
+            "path": record["path"],
+            "checksum": record["checksum"],
+            "status": "uptodate",
+        }
+
+    def pass_gate(self, request, info):
+        if self.gate is None:
+            return None
+        passed = self.gate.acquire()
+        if not passed.called:
+            stats = info.spider.crawler.stats
+            stats.inc_value("scrapmetal/files/gate_waits", spider=info.spider)
+            stats.max_value(
+                "scrapmetal/files/max_gate_waiting",
+                len(self.gate.waiting),
+                spider=info.spider,
+            )
+        return passed
+
+    def leave_gate(self):
+        if self.gate is not None:
+            self.gate.release()
+
+    def get_media_requests(self, item, info):
+        requests = super().get_media_requests(item, info)
+        for request in requests:
+            request.meta[META_KEY_DOWNLOAD_PATH] = self.partial_path(request.url)
+            request.priority = self.priority
+        return requests
+
+    def media_failed(self, failure, request, info):
+        self.leave_gate()
+        return super().media_failed(failure, request, info)
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        self.leave_gate()
+        if streamed_download(response) is None or response.status != 200:
+            return super().media_downloaded(response, request, info, item=item)
+        # The body was streamed into a file, FilesPipeline would reject the
+        # empty response.
+        self.inc_stats(info.spider, "downloaded")
+        path = self.file_path(request, response=response, info=info, item=item)
+        try:
+            checksum = self.file_downloaded(response, request, info, item=item)
+        except OSError as exc:
+            logger.error(f"Failed to store {request.url}: {exc!r}")
+            raise FileException(str(exc)) from exc
+        return {
+            "url": request.url,
+            "path": path,
+            "checksum": checksum,
+            "status": "downloaded",
+        }
+
+    def file_path(self, request, response=None, info=None, *, item=None):
+        """Path of a file in the store.
+
+        Without a response it's known only for already downloaded URLs,
+        otherwise None is returned.
+        """
+        if response is None:
+            record = self.index.get(request.url)
+            return record["path"] if record else None
+        download = streamed_download(response)
+        if download is not None:
+            digest = download["sha256"]
+        else:
+            digest = hashlib.sha256(response.body).hexdigest()
+        extension = os.path.splitext(super().file_path(request))[1]
+        return f"{OBJECTS_DIR}/{sharded(digest, extension)}"
+
+    def file_downloaded(self, response, request, info, *, item=None):
+        if streamed_download(response) is not None:
+            return self.file_streamed(response, request, info, item=item)
+        path = self.file_path(request, response=response, info=info, item=item)
+        checksum = hashlib.md5(response.body).hexdigest()
+        size = len(response.body)
+        if os.path.exists(self.stored_path(path)):
+            logger.debug(f"File {request.url} is a duplicate of {path}")
+            self.inc_dedup_stats(info.spider, "duplicate_content", size)
+        else:
+            self.store.persist_file(path, io.BytesIO(response.body), info)
+        self.index.add(request.url, {"path": path, "checksum": checksum, "size": size})
+        return checksum
+
+    def file_streamed(self, response, request, info, *, item=None):
+        """Move a file downloaded by `StreamingDownloadHandler` into place."""
+        download = streamed_download(response)
+        path = self.file_path(request, response=response, info=info, item=item)
+        size = download["size"]
+        if os.path.getsize(download["path"]) != size:
+            os.remove(download["path"])
+            raise FileException(f"{download['path']} isn't {size} bytes")
+        target = self.stored_path(path)
+        if os.path.exists(target):
+            logger.debug(f"File {request.url} is a duplicate of {path}")
+            self.inc_dedup_stats(info.spider, "duplicate_content", size)
+            os.remove(download["path"])
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Both are in FILES_STORE, so the file is renamed atomically.
+            os.replace(download["path"], target)
+        checksum = download["md5"]
+        self.index.add(request.url, {"path": path, "checksum": checksum, "size": size})
+        return checksum
@@ -0,0 +1,330 @@
+"""Resumable crawl state: the request frontier and seen requests on disk.
+
+Run a crawl with `-s JOBDIR=<dir>` to keep its state in that directory;
+running the same command again continues where the crawl stopped.
+
+- `FrontierQueue` is the scheduler disk queue. Requests of the spider are
+  stored compactly, as the URL, the name of the callback and the
+  `scrapmetal_origin`/`scrapmetal_parent`/`scrapmetal_user` meta. Other
+  requests are pickled.
+- `UserRoundRobinQueue` is the scheduler priority queue: every user of a
+  batch crawl has a queue of its own and users take turns.
+- `FrontierScheduler` finds non-empty queues of a crawl which didn't stop
+  cleanly, when Scrapy hasn't written `active.json`.
+- `FingerprintDupeFilter` keeps fingerprints of seen requests in SQLite
+  and only the recently seen ones in memory.
+
+Both are SQLite databases which commit every change, so memory stays
+bounded however large the frontier grows, and a killed crawl loses at
+most the items which `ScrapmetalPipeline` hasn't flushed yet.
+"""
+
+import collections
+import hashlib
+import os
+import pickle
+import sqlite3
+
+from scrapy import Request
+from scrapy.core.scheduler import Scheduler
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.pqueues import ScrapyPriorityQueue
+from scrapy.utils.request import request_from_dict
+
+from r2d2.scrapmetal.spiders.d2_spider import (
+    META_KEY_ORIGIN,
+    META_KEY_PARENT,
+    META_KEY_USER,
+)
+
+# Meta which is safe to lose: it's only used on the way to the scheduler.
+TRANSIENT_META = frozenset({"depth"})
+QUEUE_SUFFIX = ".sqlite"
+SEEN_FILENAME = "requests.seen.sqlite"
+# Queue of requests without a user, i.e. of a single-user crawl.
+DEFAULT_QUEUE = "default"
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+def path_safe(text):
+    """Filesystem-safe name for `text` which doesn't collide with others."""
+    safe = "".join(char if char.isalnum() or char in "-._" else "_" for char in text)
+    return f"{safe}-{hashlib.md5(text.encode('utf-8')).hexdigest()[:8]}"
+
+
+def queue_key(user):
+    return path_safe(user) if user else DEFAULT_QUEUE
+
+
+def is_compact(request, spider):
+    """Check that a request survives the trip through a compact entry."""
+    callback = request.callback
+    if callback is not None and getattr(spider, callback.__name__, None) != callback:
+        return False
+    return (
+        request.method == "GET"
+        and not request.body
+        and not request.cookies
+        and request.errback is None
+        and not request.cb_kwargs
+        and set(request.headers) <= {b"Referer"}
+        and set(request.meta)
+        <= {META_KEY_ORIGIN, META_KEY_PARENT, META_KEY_USER, *TRANSIENT_META}
+    )
+
+
+class FrontierQueue:
+    """LIFO disk queue of requests of one priority, in an SQLite file.
+
+    LIFO, like Scrapy's default disk queue: posts and photos of a listing
+    page are crawled before the next listing page, so the frontier stays
+    small. Compact entries don't keep the priority, it's in the name of
+    the file, `<-priority>.sqlite` (see `ScrapyPriorityQueue`).
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS frontier (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            callback TEXT,
+            origin TEXT,
+            parent TEXT,
+            user TEXT,
+            request BLOB
+        )
+    """
+
+    def __init__(self, spider, path):
+        self.spider = spider
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = connect(path)
+        with self.connection:
+            self.connection.execute(self.SCHEMA)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        self.priority = -int(stem) if stem.lstrip("-").isdigit() else 0
+        # The scheduler checks the length after every pop.
+        (self.size,) = self.connection.execute(
+            "SELECT COUNT(*) FROM frontier"
+        ).fetchone()
+
+    @classmethod
+    def from_crawler(cls, crawler, key):
+        return cls(crawler.spider, key + QUEUE_SUFFIX)
+
+    def to_row(self, request):
+        if is_compact(request, self.spider):
+            callback = request.callback.__name__ if request.callback else None
+            meta = request.meta
+            return (
+                request.url,
+                callback,
+                meta.get(META_KEY_ORIGIN),
+                meta.get(META_KEY_PARENT),
+                meta.get(META_KEY_USER),
+                None,
+            )
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        return request.url, None, None, None, None, data
+
+    def from_row(self, url, callback, origin, parent, user, data):
+        if data is not None:
+            return request_from_dict(pickle.loads(data), spider=self.spider)
+        meta = {}
+        if origin is not None:
+            meta[META_KEY_ORIGIN] = origin
+        if parent is not None:
+            meta[META_KEY_PARENT] = parent
+        if user is not None:
+            meta[META_KEY_USER] = user
+        return Request(
+            url,
+            callback=getattr(self.spider, callback) if callback else None,
+            meta=meta,
+            priority=self.priority,
+        )
+
+    def push(self, request):
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO frontier (url, callback, origin, parent, user, request) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self.to_row(request),
+            )
+        self.size += 1
+
+    def last(self):
+        return self.connection.execute(
+            "SELECT id, url, callback, origin, parent, user, request FROM frontier "
+            "ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+
+    def pop(self):
+        row = self.last()
+        if row is None:
+            return None
+        with self.connection:
+            self.connection.execute("DELETE FROM frontier WHERE id = ?", (row[0],))
+        self.size -= 1
+        return self.from_row(*row[1:])
+
+    def peek(self):
+        row = self.last()
+        return self.from_row(*row[1:]) if row is not None else None
+
+    def close(self):
+        self.connection.close()
+        if not self.size:
+            os.remove(self.path)
+
+    def __len__(self):
+        return self.size
+
+
+class UserRoundRobinQueue:
+    """Priority queue which takes requests of users in turn.
+
+    Requests are put into a `ScrapyPriorityQueue` of their
+    `scrapmetal_user`, and `pop` moves to the next user every time, so a
+    user with thousands of photos doesn't hold up the others. Users share
+    the download slots and the throttle.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler, downstream_queue_cls, key, startprios=()):
+        return cls(crawler, downstream_queue_cls, key, startprios)
+
+    def __init__(self, crawler, downstream_queue_cls, key, startprios=()):
+        if startprios and not isinstance(startprios, dict):
+            raise ValueError(
+                "UserRoundRobinQueue can't resume a crawl started with another "
+                "priority queue."
+            )
+        self.crawler = crawler
+        self.downstream_queue_cls = downstream_queue_cls
+        self.key = key
+        # Queue key -> priority queue, in the order of turns.
+        self.pqueues = collections.OrderedDict()
+        for user_key, priorities in (startprios or {}).items():
+            self.pqueues[user_key] = self.pqfactory(user_key, priorities)
+
+    def pqfactory(self, user_key, startprios=()):
+        return ScrapyPriorityQueue(
+            self.crawler,
+            self.downstream_queue_cls,
+            self.key + "/" + user_key,
+            startprios,
+        )
+
+    def push(self, request):
+        user_key = queue_key(request.meta.get(META_KEY_USER))
+        if user_key not in self.pqueues:
+            self.pqueues[user_key] = self.pqfactory(user_key)
+        self.pqueues[user_key].push(request)
+
+    def pop(self):
+        while self.pqueues:
+            user_key, queue = next(iter(self.pqueues.items()))
+            request = queue.pop()
+            if len(queue):
+                self.pqueues.move_to_end(user_key)
+            else:
+                del self.pqueues[user_key]
+                queue.close()
+            if request is not None:
+                return request
+        return None
+
+    def peek(self):
+        for queue in self.pqueues.values():
+            return queue.peek()
+        return None
+
+    def close(self):
+        active = {user_key: queue.close() for user_key, queue in self.pqueues.items()}
+        self.pqueues.clear()
+        return active
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.pqueues.values())
+
+
+class FrontierScheduler(Scheduler):
+    """Scheduler which resumes from `FrontierQueue` files after a crash.
+
+    Scrapy remembers priorities of non-empty disk queues in `active.json`
+    when the crawl stops cleanly; this scheduler also looks for the queue
+    files themselves, `<user queue>/<priority>.sqlite`.
+    """
+
+    def _read_dqs_state(self, dqdir):
+        state = collections.defaultdict(set)
+        for user_key, priorities in (super()._read_dqs_state(dqdir) or {}).items():
+            state[user_key].update(priorities)
+        for user_key in os.listdir(dqdir):
+            if not os.path.isdir(os.path.join(dqdir, user_key)):
+                continue
+            for name in os.listdir(os.path.join(dqdir, user_key)):
+                stem, suffix = os.path.splitext(name)
+                if suffix == QUEUE_SUFFIX and stem.lstrip("-").isdigit():
+                    state[user_key].add(int(stem))
+        return {user_key: sorted(priorities) for user_key, priorities in state.items()}
+
+
+class FingerprintDupeFilter(RFPDupeFilter):
+    """Request fingerprints filter which keeps fingerprints in SQLite.
+
+    Scrapy's own filter keeps every fingerprint of a crawl in memory and
+    rereads all of them on resume. This one only keeps the last
+    `cache_size` seen fingerprints in memory. Without `JOBDIR` it's the
+    in-memory Scrapy filter.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS seen (
+            fingerprint BLOB PRIMARY KEY
+        ) WITHOUT ROWID
+    """
+
+    def __init__(
+        self, path=None, debug=False, *, fingerprinter=None, cache_size=50_000
+    ):
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.connection = None
+        self.cache_size = cache_size
+        self.recent = collections.OrderedDict()
+        if path:
+            self.connection = connect(os.path.join(path, SEEN_FILENAME))
+            with self.connection:
+                self.connection.execute(self.SCHEMA)
+
+    def remember(self, fingerprint):
+        self.recent[fingerprint] = None
+        self.recent.move_to_end(fingerprint)
+        if len(self.recent) > self.cache_size:
+            self.recent.popitem(last=False)
+
+    def request_seen(self, request):
+        if self.connection is None:
+            return super().request_seen(request)
+        fingerprint = self.fingerprinter.fingerprint(request)
+        if fingerprint in self.recent:
+            self.recent.move_to_end(fingerprint)
+            return True
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO seen (fingerprint) VALUES (?)", (fingerprint,)
+            )
+        self.remember(fingerprint)
+        return cursor.rowcount == 0
+
+    def close(self, reason):
+        super().close(reason)
+        if self.connection is not None:
+            self.connection.close()
@@ -0,0 +1,100 @@
+"""Persistent cache of downloaded pages used for conditional requests."""
+
+import dataclasses
+import json
+import sqlite3
+import time
+import zlib
+from typing import Dict, List, Optional
+
+
+@dataclasses.dataclass
+class CacheEntry:
+    url: str
+    status: int
+    headers: Dict[str, List[str]]
+    body: bytes
+    fetched_at: float
+
+    def header(self, name):
+        values = self.headers.get(name.lower())
+        return values[0] if values else None
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self.header("ETag")
+
+    @property
+    def last_modified(self) -> Optional[str]:
+        return self.header("Last-Modified")
+
+
+class ResponseCache:
+    """url -> response store in SQLite, bodies are zlib-compressed."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            status INTEGER NOT NULL,
+            headers TEXT NOT NULL,
+            body BLOB NOT NULL,
+            fetched_at REAL NOT NULL
+        )
+    """
+
+    def __init__(self, path, compression_level=6, clock=time.time):
+        self.path = path
+        self.compression_level = compression_level
+        self.clock = clock
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(self.SCHEMA)
+
+    def get(self, url):
+        row = self.connection.execute(
+            "SELECT status, headers, body, fetched_at FROM responses WHERE url = ?",
+            (url,),
+        ).fetchone()
+        if row is None:
+            return None
+        status, headers, body, fetched_at = row
+        return CacheEntry(
+            url=url,
+            status=status,
+            headers=json.loads(headers),
+            body=zlib.decompress(body),
+            fetched_at=fetched_at,
+        )
+
+    def store(self, url, status, headers, body):
+        """Save a response, `headers` is a mapping of name -> list of values."""
+        headers = {name.lower(): list(values) for name, values in headers.items()}
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(url, status, headers, body, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (
+                    url,
+                    status,
+                    json.dumps(headers),
+                    zlib.compress(body, self.compression_level),
+                    self.clock(),
+                ),
+            )
+
+    def touch(self, url):
+        """Mark a cached response as revalidated right now."""
+        with self.connection:
+            self.connection.execute(
+                "UPDATE responses SET fetched_at = ? WHERE url = ?",
+                (self.clock(), url),
+            )
+
+    def is_fresh(self, entry, ttl):
+        """`ttl` is None for pages which never change, or seconds."""
+        return ttl is None or self.clock() - entry.fetched_at < ttl
+
+    def close(self):
+        self.connection.close()
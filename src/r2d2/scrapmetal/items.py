@@ -1,12 +1,187 @@
-# Define here the models for your scraped items
-#
-# See documentation in:
-# https://docs.scrapy.org/en/latest/topics/items.html
+"""Items scraped from Drive2.
 
-import scrapy
+Items are dataclasses with `__slots__`, so an item costs a few pointers
+instead of a dict, and Scrapy handles them through `ItemAdapter` like
+dicts. Dates are `datetime` objects.
 
+In storage an item is a compact JSON array: its kind followed by values
+of its fields in the order of declaration (see `encode_item`). New fields
+must be added at the end of a class, so older archives still decode.
+"""
 
-class ScrapmetalItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+import dataclasses
+import datetime
+import json
+import operator
+import typing
+from typing import List, Optional
+
+
+def slotted(cls):
+    """Recreate a dataclass with `__slots__`.
+
+    It's what `dataclass(slots=True)` does on Python 3.10+. Defaults stay
+    in the generated `__init__`, so fields may have them. Fields which
+    aren't set by `__init__` (`init=False` with a default, like `kind`)
+    remain class attributes shared by all instances.
+    """
+    inherited = {
+        name for base in cls.__mro__[1:] for name in getattr(base, "__slots__", ())
+    }
+    fields = tuple(
+        field.name
+        for field in dataclasses.fields(cls)
+        if field.name not in inherited
+        and (field.init or field.default is dataclasses.MISSING)
+    )
+    namespace = dict(cls.__dict__)
+    for name in fields:
+        namespace.pop(name, None)
+    namespace.pop("__dict__", None)
+    namespace.pop("__weakref__", None)
+    namespace["__slots__"] = fields
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+@slotted
+@dataclasses.dataclass
+class D2Item:
+    url: str
+    parent: Optional[str] = None
+    origin: Optional[str] = None
+    # User of a batch crawl.
+    user: Optional[str] = None
+
+
+@slotted
+@dataclasses.dataclass
+class UserJournal(D2Item):
+    kind: str = dataclasses.field(default="UserJournal", init=False)
+
+
+@slotted
+@dataclasses.dataclass
+class Car(D2Item):
+    kind: str = dataclasses.field(default="Car", init=False)
+    title: Optional[str] = None
+    description: Optional[str] = None
+    published: Optional[datetime.datetime] = None
+
+
+@slotted
+@dataclasses.dataclass
+class CarLogbook(D2Item):
+    kind: str = dataclasses.field(default="CarLogbook", init=False)
+
+
+@slotted
+@dataclasses.dataclass
+class PhotoAlbum(D2Item):
+    kind: str = dataclasses.field(default="PhotoAlbum", init=False)
+    title: Optional[str] = None
+
+
+@slotted
+@dataclasses.dataclass
+class PhotoPost(D2Item):
+    kind: str = dataclasses.field(default="PhotoPost", init=False)
+    description: Optional[str] = None
+    published: Optional[datetime.datetime] = None
+
+
+@slotted
+@dataclasses.dataclass
+class BlogPost(D2Item):
+    kind: str = dataclasses.field(default="BlogPost", init=False)
+    title: Optional[str] = None
+    published: Optional[datetime.datetime] = None
+    content: Optional[str] = None
+    tag: Optional[str] = None
+    markdown_text: Optional[str] = None
+
+
+@slotted
+@dataclasses.dataclass
+class Photo(D2Item):
+    kind: str = dataclasses.field(default="Photo", init=False)
+    # `file_urls` and `files` are the fields of Scrapy's FilesPipeline.
+    file_urls: List[str] = dataclasses.field(default_factory=list)
+    files: List[dict] = dataclasses.field(default_factory=list)
+
+
+ITEM_CLASSES = {
+    cls.kind: cls
+    for cls in (UserJournal, Car, CarLogbook, PhotoAlbum, PhotoPost, BlogPost, Photo)
+}
+
+
+def parse_datetime(value):
+    """Parse an ISO 8601 date of a page, None if it's missing."""
+    if not value:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class Schema:
+    """Field order of an item class, for `encode_item`/`decode_item`."""
+
+    def __init__(self, cls):
+        self.cls = cls
+        hints = typing.get_type_hints(cls)
+        # `kind` isn't an argument of `__init__`, the rest are in this order.
+        self.names = [
+            field.name for field in dataclasses.fields(cls) if field.name != "kind"
+        ]
+        self.getter = operator.attrgetter(*self.names)
+        self.dates = {
+            name for name in self.names if hints[name] == Optional[datetime.datetime]
+        }
+        self.date_positions = [
+            position for position, name in enumerate(self.names) if name in self.dates
+        ]
+
+
+SCHEMAS = {kind: Schema(cls) for kind, cls in ITEM_CLASSES.items()}
+
+
+def item_from_dict(data):
+    """Build an item from a dict with a `kind`; unknown keys are dropped."""
+    schema = SCHEMAS[data["kind"]]
+    values = {name: data[name] for name in schema.names if name in data}
+    for name in schema.dates & values.keys():
+        values[name] = parse_datetime(values[name])
+    return schema.cls(**values)
+
+
+def as_item(item):
+    return item_from_dict(item) if isinstance(item, dict) else item
+
+
+def encode_item(item):
+    """Encode an item (or a dict with a `kind`) as a JSON array."""
+    item = as_item(item)
+    schema = SCHEMAS[item.kind]
+    values = list(schema.getter(item))
+    for position in schema.date_positions:
+        if values[position] is not None:
+            values[position] = values[position].isoformat()
+    values.insert(0, item.kind)
+    return json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_item(data):
+    """Decode an item written by `encode_item`.
+
+    JSON objects, which archives stored before the items got types, are
+    decoded as well.
+    """
+    values = json.loads(data)
+    if isinstance(values, dict):
+        return item_from_dict(values)
+    schema = SCHEMAS[values.pop(0)]
+    for position in schema.date_positions:
+        if position < len(values) and values[position]:
+            values[position] = datetime.datetime.fromisoformat(values[position])
+    return schema.cls(*values)
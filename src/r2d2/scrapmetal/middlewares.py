@@ -3,37 +3,139 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
-from scrapy import signals
+import time
+import urllib.parse
 
-# useful for handling different item types with a single interface
+from itemadapter import ItemAdapter
+from scrapy import Request, signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers, TextResponse
+from scrapy.responsetypes import responsetypes
+from twisted.internet import task
+
+from r2d2.scrapmetal.httpcache import ResponseCache
+from r2d2.scrapmetal.pages import PageArchive
+from r2d2.scrapmetal.pipelines import pipeline_stage_done
+from r2d2.scrapmetal.spiders.d2_spider import KEY_USER, META_KEY_USER
+from r2d2.scrapmetal.telemetry import Telemetry, append_jsonl, write_prometheus
 
 
 class ScrapmetalSpiderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the spider middleware does not modify the
-    # passed objects.
+    """Save raw pages and collect crawl telemetry.
+
+    Pages are saved when `SCRAPMETAL_PAGES_PATH` is set, with the callback
+    which parses them, so the archive can be parsed again offline with
+    `r2d2 reparse`.
+
+    With `SCRAPMETAL_TELEMETRY_ENABLED` the time spent in every callback
+    and everything the callbacks yield is counted, together with download
+    latency per host, time per item pipeline and queue depths. A snapshot
+    is appended to `SCRAPMETAL_TELEMETRY_PATH` (JSON lines) and written to
+    `SCRAPMETAL_TELEMETRY_PROMETHEUS` (Prometheus textfile) every
+    `SCRAPMETAL_TELEMETRY_INTERVAL` seconds and when the spider closes.
+
+    The `scrapmetal_user` of a page is passed on to the requests and items
+    the page yields.
+    """
+
+    def __init__(
+        self,
+        crawler=None,
+        pages_path=None,
+        telemetry_path=None,
+        prometheus_path=None,
+        telemetry_interval=60,
+    ):
+        self.crawler = crawler
+        self.pages_path = pages_path
+        self.pages = None
+        self.telemetry_path = telemetry_path
+        self.prometheus_path = prometheus_path
+        self.telemetry_interval = telemetry_interval
+        self.telemetry = None
+        self.snapshot_task = None
 
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        telemetry = settings.getbool("SCRAPMETAL_TELEMETRY_ENABLED")
+        s = cls(
+            crawler=crawler,
+            pages_path=settings.get("SCRAPMETAL_PAGES_PATH"),
+            telemetry_path=telemetry and settings.get("SCRAPMETAL_TELEMETRY_PATH"),
+            prometheus_path=telemetry
+            and settings.get("SCRAPMETAL_TELEMETRY_PROMETHEUS"),
+            telemetry_interval=settings.getfloat("SCRAPMETAL_TELEMETRY_INTERVAL"),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        if s.telemetry_path or s.prometheus_path:
+            s.telemetry = Telemetry()
+            crawler.signals.connect(
+                s.response_received, signal=signals.response_received
+            )
+            crawler.signals.connect(s.pipeline_stage_done, signal=pipeline_stage_done)
         return s
 
     def process_spider_input(self, response, spider):
         # Called for each response that goes through the spider
         # middleware and into the spider.
-
-        # Should return None or raise an exception.
-        return None
+        callback = getattr(response.request.callback, "__name__", None)
+        if self.pages is not None and callback and isinstance(response, TextResponse):
+            self.pages.add(
+                url=response.url,
+                callback=callback,
+                meta=response.meta,
+                encoding=response.encoding,
+                body=response.body,
+            )
 
     def process_spider_output(self, response, result, spider):
         # Called with the results returned from the Spider, after
         # it has processed the response.
 
         # Must return an iterable of Request, or item objects.
+        if self.telemetry is not None:
+            result = self.measure_callback(response, result)
+        user = response.meta.get(META_KEY_USER)
+        if user is None:
+            yield from result
+            return
+        # Pass the user of a batch crawl on to everything found on the page.
         for i in result:
+            if isinstance(i, Request):
+                i.meta.setdefault(META_KEY_USER, user)
+            else:
+                adapter = ItemAdapter(i)
+                if adapter.get(KEY_USER) is None:
+                    adapter[KEY_USER] = user
+            yield i
+
+    def measure_callback(self, response, result):
+        callback = getattr(response.request.callback, "__name__", None) or "parse"
+        telemetry = self.telemetry
+        # Callbacks are generators: only the time spent getting the next
+        # result is the callback's, the rest is spent by whoever consumes it.
+        seconds = cpu_seconds = 0.0
+        result = iter(result)
+        while True:
+            started, cpu_started = time.perf_counter(), time.process_time()
+            try:
+                i = next(result)
+            except StopIteration:
+                break
+            finally:
+                seconds += time.perf_counter() - started
+                cpu_seconds += time.process_time() - cpu_started
+            if isinstance(i, Request):
+                telemetry.requests[
+                    getattr(i.callback, "__name__", None) or "parse"
+                ] += 1
+            else:
+                telemetry.items[ItemAdapter(i).get("kind") or type(i).__name__] += 1
             yield i
+        telemetry.callbacks[callback].add(seconds, cpu_seconds)
 
     def process_spider_exception(self, response, exception, spider):
         # Called when a spider or process_spider_input() method
@@ -51,52 +153,152 @@ class ScrapmetalSpiderMiddleware:
         for r in start_requests:
             yield r
 
+    def response_received(self, response, request, spider):
+        if "cached" in response.flags:
+            self.telemetry.cached_responses += 1
+            return
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            host = urllib.parse.urlsplit(request.url).hostname
+            self.telemetry.downloads[host].add(latency)
+
+    def pipeline_stage_done(self, stage, seconds):
+        self.telemetry.pipelines[stage].add(seconds)
+
+    def write_snapshot(self):
+        engine = self.crawler.engine
+        slot = getattr(engine, "slot", None)
+        if slot is not None and slot.scheduler is not None:
+            self.telemetry.queues["scheduler"] = len(slot.scheduler)
+        self.telemetry.queues["downloader"] = len(engine.downloader.active)
+        self.telemetry.queues["scraper"] = len(engine.scraper.slot.active)
+        # Set by ScrapmetalPipeline.
+        stats = self.crawler.stats
+        self.telemetry.queues["storage"] = stats.get_value(
+            "scrapmetal/storage/queued_items", 0
+        )
+        self.telemetry.storage_stall_seconds = stats.get_value(
+            "scrapmetal/storage/stall_seconds", 0.0
+        )
+        snapshot = self.telemetry.snapshot()
+        if self.telemetry_path:
+            append_jsonl(snapshot, self.telemetry_path)
+        if self.prometheus_path:
+            write_prometheus(snapshot, self.prometheus_path)
+
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+        if self.pages_path:
+            self.pages = PageArchive(self.pages_path)
+        if self.telemetry is not None:
+            self.snapshot_task = task.LoopingCall(self.write_snapshot)
+            self.snapshot_task.start(self.telemetry_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.pages is not None:
+            self.pages.close()
+        if self.snapshot_task is not None:
+            self.snapshot_task.stop()
+            self.write_snapshot()
 
 
 class ScrapmetalDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+    """Serve pages from a persistent cache and revalidate them with the site.
+
+    Pages are cached per callback which parses them, see
+    `SCRAPMETAL_HTTPCACHE_TTL`: a cached page younger than its TTL is served
+    without touching the network, an older one is requested with
+    `If-None-Match`/`If-Modified-Since` and a `304 Not Modified` reply is
+    served from the cache. Pages with TTL `None` (posts and photos) are
+    never downloaded again once cached.
+    """
+
+    def __init__(self, stats, path, ttls):
+        self.stats = stats
+        self.cache = ResponseCache(path)
+        self.ttls = ttls
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        settings = crawler.settings
+        if not settings.getbool("SCRAPMETAL_HTTPCACHE_ENABLED"):
+            raise NotConfigured
+        s = cls(
+            stats=crawler.stats,
+            path=settings.get("SCRAPMETAL_HTTPCACHE_PATH"),
+            ttls=settings.getdict("SCRAPMETAL_HTTPCACHE_TTL"),
+        )
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
+    def is_cacheable(self, request):
+        callback = getattr(request.callback, "__name__", None)
+        return (
+            request.method == "GET"
+            and not request.meta.get("dont_cache")
+            and callback in self.ttls
+        )
+
+    def ttl(self, request):
+        return self.ttls[request.callback.__name__]
+
+    def build_response(self, request, entry, flags):
+        headers = Headers(entry.headers)
+        respcls = responsetypes.from_args(
+            headers=headers, url=entry.url, body=entry.body
+        )
+        return respcls(
+            url=entry.url,
+            status=entry.status,
+            headers=headers,
+            body=entry.body,
+            flags=flags,
+            request=request,
+        )
+
     def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
-
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
+        if not self.is_cacheable(request):
+            return None
+        entry = self.cache.get(request.url)
+        if entry is None:
+            self.stats.inc_value("scrapmetal/httpcache/miss")
+            return None
+        if self.cache.is_fresh(entry, self.ttl(request)):
+            self.stats.inc_value("scrapmetal/httpcache/hit")
+            self.stats.inc_value("scrapmetal/httpcache/bytes_saved", len(entry.body))
+            return self.build_response(request, entry, flags=["cached"])
+        if entry.etag:
+            request.headers.setdefault("If-None-Match", entry.etag)
+        if entry.last_modified:
+            request.headers.setdefault("If-Modified-Since", entry.last_modified)
         return None
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        if "cached" in response.flags or not self.is_cacheable(request):
+            return response
+        if response.status == 304:
+            entry = self.cache.get(request.url)
+            if entry is not None:
+                self.cache.touch(request.url)
+                self.stats.inc_value("scrapmetal/httpcache/revalidated")
+                self.stats.inc_value(
+                    "scrapmetal/httpcache/bytes_saved", len(entry.body)
+                )
+                return self.build_response(
+                    request, entry, flags=["cached", "revalidated"]
+                )
+        elif response.status == 200:
+            headers = {
+                name.decode("latin1"): [value.decode("latin1") for value in values]
+                for name, values in response.headers.items()
+            }
+            self.cache.store(request.url, response.status, headers, response.body)
+            self.stats.inc_value("scrapmetal/httpcache/stored")
         return response
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
-
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
-
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+    def spider_closed(self, spider):
+        self.cache.close()
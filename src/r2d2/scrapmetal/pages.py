@@ -0,0 +1,82 @@
+"""Archive of raw pages saved during a crawl.
+
+Every page is stored with the name of the spider callback which parsed it
+and the `scrapmetal_*` meta of its request, so it can be parsed again
+offline exactly as during the crawl.
+"""
+
+import json
+import sqlite3
+import zlib
+
+META_PREFIX = "scrapmetal_"
+
+
+class PageArchive:
+    """url -> zlib-compressed page body in SQLite, written in batches."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pages (
+            url TEXT PRIMARY KEY,
+            callback TEXT NOT NULL,
+            meta TEXT NOT NULL,
+            encoding TEXT NOT NULL,
+            body BLOB NOT NULL
+        )
+    """
+
+    def __init__(self, path, batch_size=100, compression_level=6):
+        self.path = path
+        self.batch_size = batch_size
+        self.compression_level = compression_level
+        self.rows = []
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(self.SCHEMA)
+
+    def add(self, url, callback, meta, encoding, body):
+        meta = {key: meta[key] for key in meta if key.startswith(META_PREFIX)}
+        self.rows.append(
+            (
+                url,
+                callback,
+                json.dumps(meta),
+                encoding,
+                zlib.compress(body, self.compression_level),
+            )
+        )
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pages (url, callback, meta, encoding, body) "
+                "VALUES (?, ?, ?, ?, ?)",
+                self.rows,
+            )
+        self.rows = []
+
+    def __len__(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM pages").fetchone()
+        return count
+
+    def iter_pages(self):
+        """Yield `(url, callback, meta, encoding, compressed_body)`.
+
+        Bodies are left compressed: they're decompressed by whoever parses
+        them, e.g. in a worker process.
+        """
+        cursor = self.connection.execute(
+            "SELECT url, callback, meta, encoding, body FROM pages ORDER BY rowid"
+        )
+        for url, callback, meta, encoding, body in cursor:
+            yield url, callback, json.loads(meta), encoding, body
+
+    def close(self):
+        self.flush()
+        self.connection.close()
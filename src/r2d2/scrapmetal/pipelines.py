@@ -3,20 +3,319 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
-import shelve
+import asyncio
+import concurrent.futures
+import os
 import time
 
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from scrapy.pipelines import ItemPipelineManager
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.job import job_dir
+from twisted.internet.defer import Deferred
+
+from r2d2.markdown import MarkdownConverter
+from r2d2.scrapmetal.files import open_index
+from r2d2.scrapmetal.frontier import path_safe
+from r2d2.scrapmetal.spiders.d2_spider import KEY_USER
+from r2d2.scrapmetal.storage import BACKENDS, AsyncWriteBehindBuffer, open_storage
+from r2d2.search import SearchIndex, searchable
+
+KIND_BLOG_POST = "BlogPost"
+# File in JOBDIR with the path of the job's export.
+JOB_EXPORT_FILENAME = "scrapmetal_export"
+
+# Sent by `TimedItemPipelineManager` with `stage` and `seconds` arguments.
+pipeline_stage_done = object()
+
+
+class TimedItemPipelineManager(ItemPipelineManager):
+    """Item pipeline manager which times `process_item` of every pipeline.
+
+    Set as `ITEM_PROCESSOR`. The time until a pipeline is done with an
+    item is sent with the `pipeline_stage_done` signal, the stage is the
+    class name of the pipeline.
+    """
+
+    signals = None
+
+    def __init__(self, *middlewares):
+        for pipeline in middlewares:
+            if hasattr(pipeline, "process_item"):
+                pipeline.process_item = self.timed_stage(
+                    type(pipeline).__name__, pipeline.process_item
+                )
+        super().__init__(*middlewares)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        manager = super().from_crawler(crawler)
+        manager.signals = crawler.signals
+        return manager
+
+    def timed_stage(self, stage, process_item):
+        def done(result, started):
+            if self.signals is not None:
+                self.signals.send_catch_log(
+                    pipeline_stage_done,
+                    stage=stage,
+                    seconds=time.perf_counter() - started,
+                )
+            return result
+
+        def timed_process_item(item, spider):
+            started = time.perf_counter()
+            result = deferred_from_coro(process_item(item, spider))
+            if isinstance(result, Deferred):
+                return result.addBoth(done, started)
+            return done(result, started)
+
+        return timed_process_item
+
 
 class ScrapmetalPipeline:
+    """Store scraped items in a local archive.
+
+    Backend and batching are configured with `SCRAPMETAL_STORAGE`,
+    `SCRAPMETAL_FLUSH_ITEMS` and `SCRAPMETAL_FLUSH_INTERVAL` settings.
+    In incremental mode (`scrapy -a incremental=<export>`) new items are
+    appended to the given export instead of a fresh timestamped one.
+    A crawl with `JOBDIR` remembers its export there, so a resumed crawl
+    continues the same export. In batch mode (`scrapy -a batch=<file>`)
+    every user gets an export of its own.
+
+    `process_item` is a coroutine and never touches the disk itself:
+    exports are opened and written by a worker thread. When
+    `SCRAPMETAL_STORAGE_MAX_PENDING` batches wait for the disk, items wait
+    too, so a slow disk slows down the crawl. Stats under
+    `scrapmetal/storage/`: `queued_items` (gauge, also in the telemetry),
+    `max_queued_items`, `stalls` and `stall_seconds`.
+    """
+
+    def __init__(
+        self,
+        backend="sqlite",
+        flush_items=500,
+        flush_interval=5.0,
+        jobdir=None,
+        max_pending=4,
+        stats=None,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Unknown SCRAPMETAL_STORAGE {backend!r}, "
+                f"expected one of: {', '.join(BACKENDS)}"
+            )
+        self.backend = backend
+        self.flush_items = flush_items
+        self.flush_interval = flush_interval
+        self.jobdir = jobdir
+        self.max_pending = max_pending
+        self.stats = stats
+        self.executor = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            backend=settings.get("SCRAPMETAL_STORAGE", "sqlite"),
+            flush_items=settings.getint("SCRAPMETAL_FLUSH_ITEMS", 500),
+            flush_interval=settings.getfloat("SCRAPMETAL_FLUSH_INTERVAL", 5.0),
+            jobdir=job_dir(settings),
+            max_pending=settings.getint("SCRAPMETAL_STORAGE_MAX_PENDING", 4),
+            stats=crawler.stats,
+        )
+
+    def job_export_file(self, user=None):
+        filename = JOB_EXPORT_FILENAME
+        if user is not None:
+            filename += "." + path_safe(user)
+        return os.path.join(self.jobdir, filename)
+
+    def export_path(self, user=None):
+        """Path of the export of the job in `JOBDIR`, None for a new job."""
+        try:
+            with open(self.job_export_file(user)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def remember_export(self, path, user=None):
+        with open(self.job_export_file(user), "w") as f:
+            f.write(os.path.abspath(path) + "\n")
+
+    def open_export(self, spider, user=None):
+        incremental = getattr(spider, "incremental", None)
+        resumed = self.jobdir and self.export_path(user)
+        if incremental:
+            return open_storage(incremental)
+        if resumed:
+            spider.logger.info(f"Resuming export {resumed}")
+            return open_storage(resumed)
+        storage_cls = BACKENDS[self.backend]
+        suffix = "_" + path_safe(user) if user is not None else ""
+        filename = f"d2_export_{self.started}{suffix}{storage_cls.extension}"
+        storage = storage_cls(filename)
+        if self.jobdir:
+            self.remember_export(filename, user)
+        return storage
+
+    async def open_buffer(self, spider, user=None):
+        # Items of a user may come while the export is being opened.
+        opening = self.opening.get(user)
+        if opening is None:
+            loop = asyncio.get_running_loop()
+            opening = self.opening[user] = loop.run_in_executor(
+                self.executor, self.open_export, spider, user
+            )
+        storage = await opening
+        buffer = self.buffers.get(user)
+        if buffer is None:
+            buffer = self.buffers[user] = self.make_buffer(storage)
+            del self.opening[user]
+        return buffer
+
+    def make_buffer(self, storage):
+        return AsyncWriteBehindBuffer(
+            storage,
+            self.executor,
+            max_items=self.flush_items,
+            max_interval=self.flush_interval,
+            max_pending=self.max_pending,
+        )
+
     def open_spider(self, spider):
-        filename = "d2_export_{}.db".format(int(time.time()))
-        self.db = shelve.open(filename, 'c')
+        self.started = int(time.time())
+        self.batch = bool(getattr(spider, "batch", None))
+        self.buffers = {}
+        self.opening = {}
+        # A single thread writes all exports, in the order of batches.
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="scrapmetal-storage"
+        )
+        if not self.batch:
+            self.buffers[None] = self.make_buffer(self.open_export(spider))
 
     def close_spider(self, spider):
-        self.db.close()
+        return deferred_from_coro(self.close_buffers())
+
+    async def close_buffers(self):
+        try:
+            for buffer in self.buffers.values():
+                await buffer.close()
+        finally:
+            self.executor.shutdown()
+
+    def update_stats(self, stalled):
+        if self.stats is None:
+            return
+        queued = sum(len(buffer) for buffer in self.buffers.values())
+        self.stats.set_value("scrapmetal/storage/queued_items", queued)
+        self.stats.max_value("scrapmetal/storage/max_queued_items", queued)
+        if stalled:
+            self.stats.inc_value("scrapmetal/storage/stalls")
+            self.stats.inc_value("scrapmetal/storage/stall_seconds", stalled)
+
+    async def process_item(self, item, spider):
+        user = ItemAdapter(item).get(KEY_USER) if self.batch else None
+        buffer = self.buffers.get(user)
+        if buffer is None:
+            buffer = await self.open_buffer(spider, user)
+        self.update_stats(await buffer.add(item))
+        return item
+
+
+class MarkdownPipeline:
+    """Convert HTML `content` of blog posts to Markdown as `markdown_text`.
+
+    Pictures of a post are downloaded by the files pipeline, Markdown refers
+    to them by their paths in `FILES_STORE`. Pictures which aren't
+    downloaded yet keep their URLs, `r2d2 markdown` fixes them afterwards.
+    """
+
+    def __init__(self, files_store):
+        self.files_store = files_store
+        # The index of `DedupFilesPipeline`, read-only here.
+        self.index = open_index(files_store) if files_store else None
+        self.converter = MarkdownConverter(resolve_image=self.resolve_image)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(files_store=crawler.settings.get("FILES_STORE"))
+
+    def resolve_image(self, url):
+        record = self.index.get(url) if self.index is not None else None
+        return os.path.join(self.files_store, record["path"]) if record else None
 
     def process_item(self, item, spider):
-        key = item["url"]
-        self.db[key] = item
-        self.db.sync()
+        adapter = ItemAdapter(item)
+        if adapter.get("kind") == KIND_BLOG_POST:
+            adapter["markdown_text"] = self.converter.convert(adapter.get("content"))
+        return item
+
+
+class SearchIndexPipeline:
+    """Add items to the full-text index at `SCRAPMETAL_SEARCH_PATH`.
+
+    Posts, cars, albums and photo descriptions are indexed by
+    `r2d2.search.SearchIndex`, in batches written by a worker thread like
+    the items of `ScrapmetalPipeline`. Items whose text is indexed already
+    are skipped, so re-crawls keep the same index up to date. Stats under
+    `scrapmetal/search/`: `queued_items`, `stalls` and `stall_seconds`.
+    """
+
+    def __init__(
+        self, path, flush_items=500, flush_interval=5.0, max_pending=4, stats=None
+    ):
+        self.path = path
+        self.flush_items = flush_items
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        path = settings.get("SCRAPMETAL_SEARCH_PATH")
+        if not path:
+            raise NotConfigured("SCRAPMETAL_SEARCH_PATH is not set")
+        return cls(
+            path,
+            flush_items=settings.getint("SCRAPMETAL_FLUSH_ITEMS", 500),
+            flush_interval=settings.getfloat("SCRAPMETAL_FLUSH_INTERVAL", 5.0),
+            max_pending=settings.getint("SCRAPMETAL_STORAGE_MAX_PENDING", 4),
+            stats=crawler.stats,
+        )
+
+    def open_spider(self, spider):
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="scrapmetal-search"
+        )
+        self.buffer = AsyncWriteBehindBuffer(
+            SearchIndex(self.path),
+            self.executor,
+            max_items=self.flush_items,
+            max_interval=self.flush_interval,
+            max_pending=self.max_pending,
+        )
+
+    def close_spider(self, spider):
+        return deferred_from_coro(self.close_buffer())
+
+    async def close_buffer(self):
+        try:
+            await self.buffer.close()
+        finally:
+            self.executor.shutdown()
+
+    async def process_item(self, item, spider):
+        if not searchable(item):
+            return item
+        stalled = await self.buffer.add(item)
+        if self.stats is not None:
+            self.stats.set_value("scrapmetal/search/queued_items", len(self.buffer))
+            if stalled:
+                self.stats.inc_value("scrapmetal/search/stalls")
+                self.stats.inc_value("scrapmetal/search/stall_seconds", stalled)
         return item
@@ -0,0 +1,107 @@
+"""Parse saved pages again, offline, on a pool of processes.
+
+Pages saved with `SCRAPMETAL_PAGES_PATH` are replayed through the same
+spider callbacks as during the crawl, wrapped in `HtmlResponse` objects.
+Requests yielded by the callbacks are dropped, items are collected into a
+new archive. There is no network and no download delay, so re-extracting
+an archive takes as long as the CPUs need.
+"""
+
+import collections
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+
+import scrapy
+from scrapy.http import HtmlResponse
+
+from r2d2.scrapmetal.spiders.d2_spider import D2ExperimentalSpider
+
+# Spider instance of a worker process, see `init_worker`.
+_spider = None
+
+
+def init_worker(spider_kwargs):
+    global _spider
+    logging.disable(logging.INFO)
+    _spider = D2ExperimentalSpider(**spider_kwargs)
+
+
+def parse_pages(pages):
+    """Parse a chunk of pages in a worker, return items and timing."""
+    started = time.process_time()
+    items = []
+    failed = 0
+    for url, callback, meta, encoding, body in pages:
+        request = scrapy.Request(url, meta=meta)
+        response = HtmlResponse(
+            url,
+            body=zlib.decompress(body),
+            encoding=encoding,
+            request=request,
+        )
+        try:
+            for result in getattr(_spider, callback)(response):
+                if not isinstance(result, scrapy.Request):
+                    items.append(result)
+        except Exception:
+            logging.getLogger(__name__).exception(f"Failed to parse {url}")
+            failed += 1
+    return os.getpid(), len(pages), failed, time.process_time() - started, items
+
+
+def chunked(iterable, size):
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class WorkerStats:
+    def __init__(self):
+        self.pages = 0
+        self.failed = 0
+        self.cpu_time = 0.0
+
+    @property
+    def pages_per_second(self):
+        return self.pages / self.cpu_time if self.cpu_time else 0.0
+
+
+def reparse(pages, buffer, workers=None, chunk_size=50, spider_kwargs=None):
+    """Parse pages of a `PageArchive` and add items to a `WriteBehindBuffer`.
+
+    At most two chunks per worker are in flight, so the archive is never
+    read into memory as a whole. Return per-worker stats, keyed by pid.
+    """
+    workers = workers or os.cpu_count()
+    stats = collections.defaultdict(WorkerStats)
+
+    def collect(result):
+        pid, count, failed, cpu_time, items = result.get()
+        worker = stats[pid]
+        worker.pages += count
+        worker.failed += failed
+        worker.cpu_time += cpu_time
+        for item in items:
+            buffer.add(item)
+
+    with multiprocessing.Pool(
+        processes=workers,
+        initializer=init_worker,
+        initargs=(spider_kwargs or {},),
+    ) as pool:
+        pending = collections.deque()
+        for chunk in chunked(pages.iter_pages(), chunk_size):
+            pending.append(pool.apply_async(parse_pages, (chunk,)))
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+    return stats
@@ -44,31 +44,91 @@ CONCURRENT_REQUESTS_PER_DOMAIN = 1
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    "scrapmetal.middlewares.ScrapmetalSpiderMiddleware": 543,
-# }
+SPIDER_MIDDLEWARES = {
+    "r2d2.scrapmetal.middlewares.ScrapmetalSpiderMiddleware": 543,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-# DOWNLOADER_MIDDLEWARES = {
-#    "scrapmetal.middlewares.ScrapmetalDownloaderMiddleware": 543,
-# }
+DOWNLOADER_MIDDLEWARES = {
+    "r2d2.scrapmetal.middlewares.ScrapmetalDownloaderMiddleware": 543,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-# }
+EXTENSIONS = {
+    "r2d2.scrapmetal.throttle.AdaptiveThrottle": 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
-    "scrapy.pipelines.files.FilesPipeline": 1,
+    "r2d2.scrapmetal.files.DedupFilesPipeline": 1,
+    "r2d2.scrapmetal.thumbnails.ThumbnailPipeline": 100,
+    "r2d2.scrapmetal.pipelines.MarkdownPipeline": 200,
     "r2d2.scrapmetal.pipelines.ScrapmetalPipeline": 300,
+    "r2d2.scrapmetal.pipelines.SearchIndexPipeline": 400,
 }
 
+# Photos are stored by content hash in FILES_STORE/objects,
+# FILES_STORE/index maps their URLs to the files.
 FILES_STORE = 'd2images'
 
+# Photos are streamed into FILES_STORE/partial instead of memory, and
+# interrupted downloads are resumed with Range requests. Bodies of at most
+# SCRAPMETAL_DOWNLOADS_MAX_BYTES_IN_FLIGHT bytes are received at once.
+DOWNLOAD_HANDLERS = {
+    "http": "r2d2.scrapmetal.downloads.StreamingDownloadHandler",
+    "https": "r2d2.scrapmetal.downloads.StreamingDownloadHandler",
+}
+SCRAPMETAL_DOWNLOADS_MAX_BYTES_IN_FLIGHT = 64 * 1024 * 1024
+
+# Resized copies of photos for Day One, in FILES_STORE/thumbnails: JPEGs
+# which fit into SCRAPMETAL_THUMBNAILS_SIZE pixels, without EXIF. Made in
+# SCRAPMETAL_THUMBNAILS_WORKERS processes (default: number of CPUs).
+# Requires Pillow.
+SCRAPMETAL_THUMBNAILS_ENABLED = False
+SCRAPMETAL_THUMBNAILS_SIZE = 1600
+SCRAPMETAL_THUMBNAILS_QUALITY = 85
+SCRAPMETAL_THUMBNAILS_WORKERS = None
+
+# Storage backend for scraped items: "sqlite" (batched, WAL mode) or "shelve".
+SCRAPMETAL_STORAGE = "sqlite"
+# Items are written in batches: when the batch has this many items...
+SCRAPMETAL_FLUSH_ITEMS = 500
+# ...or when this many seconds passed since the previous write.
+SCRAPMETAL_FLUSH_INTERVAL = 5
+# Batches are written by a worker thread. When this many batches wait for
+# the disk, the crawl waits too.
+SCRAPMETAL_STORAGE_MAX_PENDING = 4
+
+# Full-text index of posts, cars, albums and photo descriptions, updated
+# as items are scraped, see `r2d2 search`. None disables it.
+SCRAPMETAL_SEARCH_PATH = "d2search.sqlite"
+
+# Adaptive per-host politeness, see r2d2.scrapmetal.throttle.
+# DOWNLOAD_DELAY and CONCURRENT_REQUESTS_PER_DOMAIN above apply to hosts
+# without a profile.
+SCRAPMETAL_THROTTLE_ENABLED = True
+# Drive2 pages are never requested faster than DOWNLOAD_DELAY, the delay only
+# grows when the site slows down.
+SCRAPMETAL_THROTTLE_SLOTS = {
+    "www.drive2.ru": {
+        "delay": 10,
+        "min_delay": 10,
+        "max_delay": 120,
+        "concurrency": 1,
+        "max_concurrency": 1,
+    },
+    "a.d-cd.net": {
+        "delay": 0.25,
+        "min_delay": 0,
+        "max_delay": 30,
+        "concurrency": 4,
+        "max_concurrency": 16,
+    },
+}
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -90,6 +150,66 @@ FILES_STORE = 'd2images'
 # HTTPCACHE_IGNORE_HTTP_CODES = []
 # HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# Persistent page cache with conditional revalidation,
+# see ScrapmetalDownloaderMiddleware.
+SCRAPMETAL_HTTPCACHE_ENABLED = True
+SCRAPMETAL_HTTPCACHE_PATH = "d2cache.sqlite"
+# Seconds a cached page is served without asking the site, by callback
+# name. After that the page is revalidated with a conditional request.
+# None means the page never changes and is never downloaded again.
+# Pages of callbacks not listed here are not cached.
+SCRAPMETAL_HTTPCACHE_TTL = {
+    "parse_user_profile": 0,
+    "parse_car": 0,
+    "parse_logbook": 0,
+    "parse_photo_album": 0,
+    "parse_blog_post": None,
+    "parse_photo_post": None,
+}
+
+# Save raw pages into this file to parse them again offline with
+# `r2d2 reparse`, e.g. `-s SCRAPMETAL_PAGES_PATH=d2pages.sqlite`.
+SCRAPMETAL_PAGES_PATH = None
+
+# Crawl telemetry: time per callback, pipeline and host, items per kind and
+# queue depths. A snapshot is appended to SCRAPMETAL_TELEMETRY_PATH (JSON
+# lines) every SCRAPMETAL_TELEMETRY_INTERVAL seconds. Set
+# SCRAPMETAL_TELEMETRY_PROMETHEUS to also write a Prometheus textfile, e.g.
+# into the directory of the node_exporter textfile collector.
+# TimedItemPipelineManager times the item pipelines for it.
+ITEM_PROCESSOR = 'r2d2.scrapmetal.pipelines.TimedItemPipelineManager'
+SCRAPMETAL_TELEMETRY_ENABLED = True
+SCRAPMETAL_TELEMETRY_PATH = "d2telemetry.jsonl"
+SCRAPMETAL_TELEMETRY_PROMETHEUS = None
+SCRAPMETAL_TELEMETRY_INTERVAL = 60
+
+# Priorities of requests by the kind of pages they fetch, higher first:
+# cars, then logbook and journal listings, then posts, then photo albums
+# and photo pages. A crawl which is stopped early has the text already.
+# Photo requests carry the priority of `Photo`, but skip the scheduler, so
+# it doesn't order them: instead at most SCRAPMETAL_FILES_MAX_ACTIVE photos
+# are in the downloader at once, in the order they came, so they never fill
+# up CONCURRENT_REQUESTS and hold up pages; None lifts the limit.
+SCRAPMETAL_KIND_PRIORITIES = {
+    "Car": 40,
+    "CarLogbook": 30,
+    "UserJournal": 30,
+    "BlogPost": 20,
+    "PhotoAlbum": 10,
+    "PhotoPost": 0,
+    "Photo": 0,
+}
+SCRAPMETAL_FILES_MAX_ACTIVE = 8
+
+# Resumable crawls: with `-s JOBDIR=<dir>` the request frontier and seen
+# requests are kept in SQLite files in the directory, and running the same
+# command again continues the crawl and its export.
+SCHEDULER = "r2d2.scrapmetal.frontier.FrontierScheduler"
+# Users of a batch crawl (`-a batch=<file>`) take turns.
+SCHEDULER_PRIORITY_QUEUE = "r2d2.scrapmetal.frontier.UserRoundRobinQueue"
+SCHEDULER_DISK_QUEUE = "r2d2.scrapmetal.frontier.FrontierQueue"
+DUPEFILTER_CLASS = "r2d2.scrapmetal.frontier.FingerprintDupeFilter"
+
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
@@ -1,7 +1,17 @@
+import collections
+import datetime
+import os
 import re
+import time
 import urllib.parse
 
 import scrapy
+from parsel import css2xpath
+from scrapy import signals
+
+from r2d2.scrapmetal import items
+from r2d2.scrapmetal.extract import Field, Repeated, Spec
+from r2d2.scrapmetal.storage import open_storage
 
 PATTERN_CAR = re.compile(r"/r/[a-z0-9_]+/[a-z0-9_]+/[\d]+/$")
 PATTERN_CAR_LOGBOOK = re.compile(r"/r/[a-z0-9_]+/[a-z0-9_]+/[\d]+/logbook")
@@ -10,6 +20,9 @@ PATTERN_BLOG_POST = re.compile(r"/b/[0-9]+/")
 PATTERN_PHOTO_ALBUM = re.compile("/s/a/[a-zA-Z0-9]+")
 PATTERN_PHOTO_POST = re.compile("/s/[a-zA-Z0-9]+")
 PATTERN_PHOTO_IMAGE = re.compile("https://a.d-cd.net/[a-zA-Z0-9_-]+.jpg")
+# Pages which never change once published. In incremental mode they are
+# not fetched again if they are already in the export.
+INCREMENTAL_PATTERNS = (PATTERN_CAR_POST, PATTERN_BLOG_POST, PATTERN_PHOTO_POST)
 
 KIND_USER_PROFILE = "UserProfile"
 KIND_USER_JOURNAL = "UserJournal"
@@ -27,6 +40,9 @@ META_KEY_ORIGIN = "scrapmetal_origin"
 # Parent is a root for a few collections.
 # Generally, it's a car page.
 META_KEY_PARENT = "scrapmetal_parent"
+# User whose archive the page belongs to, it's passed on to every request
+# and item by `ScrapmetalSpiderMiddleware`.
+META_KEY_USER = "scrapmetal_user"
 
 KEY_KIND = "kind"
 KEY_URL = "url"
@@ -38,11 +54,258 @@ KEY_PARENT = "parent"
 KEY_PHOTO_URL = "photo_url"
 KEY_CONTENT = "content"
 KEY_TAG = "tag"
+KEY_USER = "user"
 
 # Special fields which have specific meaning to Scrapy.
 SCRAPY_FILE_URLS = "file_urls"
 
 USER_PROFILE_TEMPLATE = "https://www.drive2.ru/users/{username}/"
+# Drive2 shows dates in Moscow time, which has had no DST since 2014.
+DRIVE2_TIMEZONE = datetime.timezone(datetime.timedelta(hours=3), "MSK")
+
+# Fields of pages, compiled once for the whole crawl.
+POST_LINKS = Field(css="div.c-post-preview__title a.c-link::attr('href')", many=True)
+# Links and dates of post preview cards, for the date window.
+PREVIEWS = Repeated(
+    css="div.c-post-preview",
+    link=Field(css="div.c-post-preview__title a.c-link::attr('href')"),
+    date=Field(css=".c-post-preview__date::text"),
+)
+USERNAME = Field(xpath=css2xpath("a.c-username") + "/span[@itemprop='name']/text()")
+LIGHTBOX_URL = Field(css="a.c-lightbox-anchor::attr('href')")
+NEXT_PAGE = Field(xpath="//a[has-class('c-pager__link')][@rel='next']/@href")
+PUBLISHED_TIME = Field(xpath="//meta[@property='article:published_time']/@content")
+SPEC_USER_PROFILE = Spec(
+    links=Field(css="a.u-link-area::attr(href)", many=True),
+    post_links=POST_LINKS,
+)
+SPEC_CAR = Spec(
+    title=Field(css="h1.x-title::text", strip=True),
+    description=Field(css="div.c-car-desc__text"),
+    published=Field(
+        xpath=css2xpath("div.c-car-desc") + "/meta[@itemprop='datePublished']/@content"
+    ),
+    photos=Field(css="a.c-lightbox-anchor::attr(href)", many=True),
+    links=Field(css="h3 a.c-link::attr(href)", many=True),
+)
+SPEC_PHOTO_ALBUM = Spec(
+    title=Field(css="h1.x-title::text"),
+    photo_links=Field(css="div.c-snaps-preview a::attr('href')", many=True),
+    # A card may have the author, the description and the lightbox link
+    # of its photo page, see `D2ExperimentalSpider.snap_items`.
+    snaps=Repeated(
+        css="div.c-snaps-preview",
+        links=Field(css="a::attr(href)", many=True),
+        username=USERNAME,
+        description=Field(xpath=".//div[@itemprop='description']/*"),
+        photo_url=LIGHTBOX_URL,
+        datetime=Field(css="time::attr(datetime)"),
+        date=Field(css=".c-snaps-preview__date::text"),
+    ),
+)
+SPEC_PHOTO_POST = Spec(
+    username=USERNAME,
+    description=Field(xpath="//div[@itemprop='description']/*"),
+    photo_url=LIGHTBOX_URL,
+    published=PUBLISHED_TIME,
+)
+SPEC_LOGBOOK = Spec(post_links=POST_LINKS)
+SPEC_BLOG_POST = Spec(
+    title=Field(css="h1.x-title::text", strip=True),
+    published=PUBLISHED_TIME,
+    content=Field(xpath="//div[@itemprop='articleBody']"),
+    tag=Field(css="span.c-post-meta__item a.c-link::text"),
+    images=Field(css="div.c-post__pic img::attr('src')", many=True),
+)
+
+# Month names in dates of preview cards, e.g. "25 мая 2021".
+MONTHS = {
+    name: number
+    for number, name in enumerate(
+        (
+            "января",
+            "февраля",
+            "марта",
+            "апреля",
+            "мая",
+            "июня",
+            "июля",
+            "августа",
+            "сентября",
+            "октября",
+            "ноября",
+            "декабря",
+        ),
+        start=1,
+    )
+}
+PATTERN_PREVIEW_DATE = re.compile(r"(\d{1,2})\s+([а-яё]+)(?:\s+(\d{4}))?")
+
+
+class LinkDispatcher:
+    """Find which of the patterns a link matches with a single regex.
+
+    Patterns are tried in the given order, the first one matched wins.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = {f"p{i}": pattern for i, pattern in enumerate(patterns)}
+        self.regex = re.compile(
+            "|".join(
+                f"(?P<{group}>{pattern.pattern})"
+                for group, pattern in self.patterns.items()
+            )
+        )
+
+    def match(self, link):
+        """Return the pattern which matches the link or None."""
+        match = self.regex.match(link)
+        return self.patterns[match.lastgroup] if match else None
+
+
+def read_batch(path):
+    """Read `(user, url)` pairs of a batch file.
+
+    Every line is a username, a starting URL or a name followed by a
+    starting URL. Empty lines and lines starting with `#` are skipped.
+    """
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) > 2:
+                raise ValueError(f"Unexpected batch line: {line.strip()!r}")
+            if len(fields) == 2:
+                yield fields[0], fields[1]
+            elif "://" in fields[0]:
+                yield fields[0], fields[0]
+            else:
+                yield fields[0], USER_PROFILE_TEMPLATE.format(username=fields[0])
+
+
+def parse_preview_date(text, today=None):
+    """Parse the date of a preview card, None if it's not recognized.
+
+    Cards show "25 мая 2021", "25 мая" in the current year, "сегодня",
+    "вчера" or an ISO 8601 date.
+    """
+    if not text:
+        return None
+    text = text.strip().lower()
+    today = today or datetime.date.today()
+    if text.startswith("сегодня"):
+        return today
+    if text.startswith("вчера"):
+        return today - datetime.timedelta(days=1)
+    try:
+        return datetime.date.fromisoformat(text[:10])
+    except ValueError:
+        pass
+    match = PATTERN_PREVIEW_DATE.match(text)
+    if not match or match.group(2) not in MONTHS:
+        return None
+    day, month, year = match.groups()
+    try:
+        return datetime.date(int(year or today.year), MONTHS[month], int(day))
+    except ValueError:
+        return None
+
+
+class DateWindow:
+    """Publish date range `since <= published < until` of a crawl.
+
+    Either bound may be None. Dates of preview cards are days, a day is in
+    the window if any part of it is.
+    """
+
+    def __init__(self, since=None, until=None):
+        self.since = self.as_datetime(since)
+        self.until = self.as_datetime(until)
+
+    @staticmethod
+    def as_datetime(value):
+        # Preview cards show the local date of Drive2, time zones are dropped.
+        value = items.parse_datetime(value)
+        return value.replace(tzinfo=None) if value is not None else None
+
+    def __bool__(self):
+        return self.since is not None or self.until is not None
+
+    def day_bounds(self, day):
+        start = datetime.datetime.combine(day, datetime.time())
+        return start, start + datetime.timedelta(days=1)
+
+    def contains(self, day):
+        start, end = self.day_bounds(day)
+        return (self.since is None or end > self.since) and (
+            self.until is None or start < self.until
+        )
+
+    def is_past(self, day):
+        """Check that `day` is older than the window."""
+        return self.since is not None and self.day_bounds(day)[1] <= self.since
+
+
+class RecentUrls:
+    """Set of the last `size` added URLs.
+
+    Duplicate links are found on neighbouring pages of a listing, so the
+    recent URLs catch most of them in bounded memory. The rest is dropped
+    by the scheduler's duplicates filter.
+    """
+
+    def __init__(self, size=100_000):
+        self.size = size
+        self.urls = collections.OrderedDict()
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, url):
+        self.urls[url] = None
+        self.urls.move_to_end(url)
+        if len(self.urls) > self.size:
+            self.urls.popitem(last=False)
+
+    def clear(self):
+        self.urls.clear()
+
+
+class ListingProgress:
+    """Requests of logbooks and journals which aren't parsed yet.
+
+    A listing counts its first page, then its next pages and posts as
+    they are requested. It's complete when all of them are parsed or
+    dropped. A request which fails is neither, so a listing with a broken
+    page never completes. Listings of a resumed crawl aren't tracked.
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def start(self, origin):
+        self.pending[origin] = self.pending.get(origin, 0) + 1
+
+    def track(self, origin, requests):
+        """Count requests of a listing while passing them on."""
+        for request in requests:
+            if origin in self.pending:
+                self.pending[origin] += 1
+            yield request
+
+    def done(self, origin):
+        """Count off a request of a listing, return True if it completes."""
+        if origin not in self.pending:
+            return False
+        self.pending[origin] -= 1
+        if self.pending[origin]:
+            return False
+        del self.pending[origin]
+        return True
 
 
 class D2ExperimentalSpider(scrapy.Spider):
@@ -56,118 +319,403 @@ class D2ExperimentalSpider(scrapy.Spider):
         PATTERN_CAR_POST: "parse_blog_post",
         PATTERN_BLOG_POST: "parse_blog_post",
     }
+    # Kinds of pages the callbacks parse, see SCRAPMETAL_KIND_PRIORITIES.
+    CALLBACK_KINDS = {
+        "parse_user_profile": KIND_USER_JOURNAL,
+        "parse_car": KIND_CAR,
+        "parse_logbook": KIND_CAR_LOGBOOK,
+        "parse_photo_album": KIND_PHOTO_ALBUM,
+        "parse_photo_post": KIND_PHOTO_POST,
+        "parse_blog_post": KIND_BLOG_POST,
+    }
+    # Kinds of entries of listings. Next pages of a listing go with its
+    # entries, so a logbook is crawled to the end before the next one.
+    ENTRY_KINDS = {
+        "parse_user_profile": KIND_BLOG_POST,
+        "parse_logbook": KIND_BLOG_POST,
+        "parse_photo_album": KIND_PHOTO_POST,
+    }
+    # Callbacks of the pages of logbooks and journals, see `ListingProgress`.
+    LISTING_CALLBACKS = frozenset(
+        {"parse_user_profile", "parse_logbook", "parse_blog_post"}
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Incremental mode: `scrapy -a incremental=<export>` loads URLs of
+        # the previous export and the pipeline appends new items to it.
+        self.known_urls = set()
+        incremental = getattr(self, "incremental", None)
+        if incremental and getattr(self, "batch", None):
+            raise ValueError("Incremental mode isn't supported for batches.")
+        if incremental and os.path.exists(incremental):
+            storage = open_storage(incremental)
+            self.known_urls = set(storage.urls())
+            storage.close()
+        # `scrapy -a since=2023-01-01 -a until=2023-02-01` crawls posts of
+        # January only.
+        self.window = DateWindow(
+            getattr(self, "since", None), getattr(self, "until", None)
+        )
+        # Photos of albums are taken from album pages when the cards have
+        # everything of a photo page, `scrapy -a full_fidelity=1` fetches
+        # every photo page anyway.
+        self.full_fidelity = str(getattr(self, "full_fidelity", "")).lower() in (
+            "1",
+            "true",
+            "yes",
+        )
+        self.callbacks = {
+            pattern: getattr(self, parser_name)
+            for pattern, parser_name in self.PARSER_MAP.items()
+        }
+        self.dispatchers = {}
+        # URLs recently requested by `follow_known_links`.
+        self.seen_urls = RecentUrls()
+        # They are set up by `from_crawler`, a spider without a crawler
+        # (e.g. of `r2d2 reparse`) neither prioritizes, tracks nor counts
+        # anything.
+        self.kind_priorities = {}
+        self.progress = None
+        self.stats = None
+        self.started = time.monotonic()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.kind_priorities = crawler.settings.getdict("SCRAPMETAL_KIND_PRIORITIES")
+        spider.progress = ListingProgress()
+        spider.stats = crawler.stats
+        crawler.signals.connect(
+            spider.on_request_dropped, signal=signals.request_dropped
+        )
+        return spider
+
+    def priority(self, callback):
+        """Priority of requests of a callback, by the kind of its pages."""
+        kind = self.CALLBACK_KINDS.get(callback.__name__)
+        return self.kind_priorities.get(kind, 0)
+
+    def listing_started(self, origin):
+        if self.progress is not None:
+            self.progress.start(origin)
+
+    def track_listing(self, origin, requests):
+        if self.progress is None:
+            return requests
+        return self.progress.track(origin, requests)
+
+    def listing_parsed(self, origin):
+        """Count off a page of a logbook or a journal, see `ListingProgress`."""
+        if self.progress is None or not self.progress.done(origin):
+            return
+        stats = self.crawler.stats
+        elapsed = round(time.monotonic() - self.started, 1)
+        stats.inc_value("scrapmetal/logbooks/complete")
+        stats.set_value("scrapmetal/logbooks/last_complete_seconds", elapsed)
+        if stats.get_value("scrapmetal/logbooks/first_complete_seconds") is None:
+            stats.set_value("scrapmetal/logbooks/first_complete_seconds", elapsed)
+            self.logger.info(f"First complete logbook {origin} after {elapsed:.0f}s")
+
+    def on_request_dropped(self, request, spider):
+        callback = getattr(request.callback, "__name__", None)
+        if spider is self and callback in self.LISTING_CALLBACKS:
+            self.listing_parsed(request.meta.get(META_KEY_ORIGIN))
 
     def start_requests(self):
         """Scrapy calls the method automatically at the start of crawling."""
         username = getattr(self, "username", None)
         starter = getattr(self, "starter", None)
-        if not username and not starter:
+        batch = getattr(self, "batch", None)
+        if not username and not starter and not batch:
             raise ValueError(
                 "Starting page is missing. "
-                "Either start from url as `scrapy -a starter=<url>` or "
+                "Either start from url as `scrapy -a starter=<url>`, "
                 "with a username as "
-                " `scrapy -a username=<drive2username>`"
+                " `scrapy -a username=<drive2username>` or "
+                "with a file of usernames and urls as `scrapy -a batch=<file>`"
             )
         if username:
             url = USER_PROFILE_TEMPLATE.format(username=username)
-            yield scrapy.Request(url=url, callback=self.parse_user_profile)
+            yield from self.start_from(url, user=username)
         if starter:
-            starter_path = urllib.parse.urlparse(starter).path
-            for pattern in self.PARSER_MAP.keys():
-                if pattern.match(starter_path):
-                    parser_name = self.PARSER_MAP[pattern]
-                    callback = getattr(self, parser_name)
-                    yield scrapy.Request(url=starter, callback=callback)
+            yield from self.start_from(starter)
+        if batch:
+            # Round-robin scheduling (see `UserRoundRobinQueue`) interleaves
+            # the users, the order here doesn't matter.
+            for user, url in read_batch(batch):
+                yield from self.start_from(url, user=user)
+
+    def start_from(self, url, user=None):
+        meta = {META_KEY_USER: user} if user else {}
+        starter_path = urllib.parse.urlparse(url).path
+        if starter_path.startswith("/users/"):
+            yield scrapy.Request(
+                url=url,
+                callback=self.parse_user_profile,
+                meta=meta,
+                priority=self.priority(self.parse_user_profile),
+            )
+            return
+        for pattern in self.PARSER_MAP.keys():
+            if pattern.match(starter_path):
+                parser_name = self.PARSER_MAP[pattern]
+                callback = getattr(self, parser_name)
+                yield scrapy.Request(
+                    url=url,
+                    callback=callback,
+                    meta=meta,
+                    priority=self.priority(callback),
+                )
+
+    def get_dispatcher(self, patterns):
+        dispatcher = self.dispatchers.get(patterns)
+        if dispatcher is None:
+            dispatcher = self.dispatchers[patterns] = LinkDispatcher(patterns)
+        return dispatcher
 
     def follow_known_links(self, links, patterns, response, meta={}, page_name="N/A"):
+        dispatcher = self.get_dispatcher(patterns)
+        followed = duplicates = archived = 0
+        unknown = []
         for next_link in links:
-            if next_link:
-                link_parsed = False
-                for pattern in patterns:
-                    if pattern.match(next_link):
-                        link_parsed = True
-                        parser_name = self.PARSER_MAP[pattern]
-                        callback = getattr(self, parser_name)
-                        self.log(
-                            f"Found next link {next_link} -- parser is {parser_name}."
-                        )
-                        next_url = response.urljoin(next_link)
-                        yield scrapy.Request(next_url, callback=callback, meta=meta)
-                if not link_parsed:
-                    self.log(
-                        f"Found a link {next_link} from the {page_name} "
-                        f" ({response.url}) but don't know what to do with it"
-                    )
+            if not next_link:
+                continue
+            pattern = dispatcher.match(next_link)
+            if pattern is None:
+                unknown.append(next_link)
+                continue
+            next_url = response.urljoin(next_link)
+            if next_url in self.seen_urls:
+                duplicates += 1
+            elif self.is_known(next_url, pattern):
+                archived += 1
+            else:
+                self.seen_urls.add(next_url)
+                followed += 1
+                callback = self.callbacks[pattern]
+                yield scrapy.Request(
+                    next_url,
+                    callback=callback,
+                    meta=meta,
+                    priority=self.priority(callback),
+                )
+        if archived:
+            self.crawler.stats.inc_value("scrapmetal/incremental/skipped", archived)
+        self.log(
+            f"Links on the {page_name} ({response.url}): {followed} followed, "
+            f"{duplicates} duplicates, {archived} already archived, "
+            f"{len(unknown)} unknown."
+        )
+        if unknown:
+            self.log(f"Don't know what to do with links {unknown} on {response.url}")
+
+    def is_known(self, url, pattern):
+        return pattern in INCREMENTAL_PATTERNS and url in self.known_urls
+
+    def is_listing_exhausted(self, links, response):
+        """Check that every entry on a listing page is already archived.
+
+        Listings are ordered from the newest to the oldest entries, so there
+        is nothing new on the next pages either.
+        """
+        urls = [response.urljoin(link) for link in links if link]
+        if not self.known_urls or not urls:
+            return False
+        if all(url in self.known_urls for url in urls):
+            self.log(
+                f"All entries on {response.url} are already archived, "
+                "stop following pagination."
+            )
+            return True
+        return False
+
+    def filter_previews(self, response, links):
+        """Keep links of post previews dated within the window.
+
+        Return the links and whether the listing is past the window, i.e.
+        every dated card on the page is older than it. Listings are ordered
+        from the newest to the oldest entries, so the next pages are older
+        still. Cards without a recognized date are kept.
+        """
+        if not self.window:
+            return links, False
+        dates = {}
+        for card in PREVIEWS.extract(response.selector.root):
+            day = parse_preview_date(card["date"])
+            if card["link"] and day is not None:
+                dates[card["link"]] = day
+        kept = [
+            link
+            for link in links
+            if link not in dates or self.window.contains(dates[link])
+        ]
+        if len(kept) < len(links):
+            self.crawler.stats.inc_value(
+                "scrapmetal/window/skipped", len(links) - len(kept)
+            )
+        past = bool(dates) and all(self.window.is_past(day) for day in dates.values())
+        if past:
+            self.crawler.stats.inc_value("scrapmetal/window/stopped")
+            self.log(
+                f"All entries on {response.url} are older than the date window, "
+                "stop following pagination."
+            )
+        return kept, past
+
+    def follow_next_page(self, response, callback, meta, links, past_window=False):
+        if past_window or self.is_listing_exhausted(links, response):
+            return
+        next_page = NEXT_PAGE.extract(response.selector.root)
+        if next_page:
+            next_url = response.urljoin(next_page)
+            kind = self.ENTRY_KINDS.get(callback.__name__)
+            yield scrapy.Request(
+                next_url,
+                callback=callback,
+                meta=meta,
+                priority=self.kind_priorities.get(kind, 0),
+            )
+
+    def snap_items(self, snap, response, meta):
+        """Return `PhotoPost` and `Photo` of an album card, None if incomplete.
+
+        A card is taken instead of its photo page only if it has what
+        `parse_photo_post` takes from the page: a link to the page, the
+        lightbox link of the full-size photo, the description, a date and,
+        when the spider crawls a user, the author.
+        """
+        link = next(
+            (link for link in snap["links"] if PATTERN_PHOTO_POST.match(link)), None
+        )
+        photo_url = snap["photo_url"] or ""
+        published = items.parse_datetime(snap["datetime"])
+        if published is None:
+            day = parse_preview_date(snap["date"])
+            if day is not None:
+                published = datetime.datetime.combine(
+                    day, datetime.time(), tzinfo=DRIVE2_TIMEZONE
+                )
+        owner = self.owner(response)
+        if (
+            not link
+            or not PATTERN_PHOTO_IMAGE.match(photo_url)
+            or not snap["description"]
+            or published is None
+            or (owner and snap["username"] != owner)
+        ):
+            return None
+        url = response.urljoin(link)
+        parent = meta.get(META_KEY_PARENT)
+        post = items.PhotoPost(
+            url=url,
+            description=snap["description"],
+            published=published,
+            parent=parent,
+            origin=meta.get(META_KEY_ORIGIN),
+        )
+        photo = items.Photo(
+            url=photo_url, parent=parent, origin=url, file_urls=[photo_url]
+        )
+        return post, photo
+
+    def harvest_album(self, snaps, links, response, meta):
+        """Yield items of complete cards, return the links left to follow.
+
+        Links of the cards which are taken are dropped, the rest are
+        followed as usual, and so are all links of the other cards.
+        """
+        taken = set()
+        avoided = fetched = 0
+        for snap in snaps:
+            harvested = self.snap_items(snap, response, meta)
+            if harvested is None:
+                fetched += 1
+                continue
+            post, photo = harvested
+            # Repeated and archived photos are left to `follow_known_links`.
+            if post.url in self.seen_urls or self.is_known(
+                post.url, PATTERN_PHOTO_POST
+            ):
+                continue
+            self.seen_urls.add(post.url)
+            taken.update(snap["links"])
+            avoided += 1
+            yield post
+            yield photo
+        if self.stats is not None:
+            if avoided:
+                self.stats.inc_value("scrapmetal/album/fetches_avoided", avoided)
+            if fetched:
+                self.stats.inc_value("scrapmetal/album/fetched", fetched)
+        return [link for link in links if link not in taken]
+
+    def owner(self, response):
+        """User whose archive a page belongs to, None if it's not known.
+
+        It's the user of a batch crawl which the page was found for, or the
+        user of `-a username=<name>`.
+        """
+        return response.meta.get(META_KEY_USER) or getattr(self, "username", None)
 
     def download_photo(self, url, parent=None, origin=None):
-        yield {
-            KEY_KIND: KIND_PHOTO,
-            KEY_URL: url,
-            KEY_PARENT: parent,
-            KEY_ORIGIN: origin,
-            SCRAPY_FILE_URLS: [url],
-        }
+        yield items.Photo(url=url, parent=parent, origin=origin, file_urls=[url])
 
     def parse_user_profile(self, response):
         meta = {
             META_KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN) or response.url,
         }
+        fields = SPEC_USER_PROFILE.extract(response)
         yield from self.follow_known_links(
-            links=response.css("a.u-link-area::attr(href)").getall(),
+            links=fields["links"],
             patterns=(PATTERN_CAR, PATTERN_PHOTO_ALBUM),
             page_name="user profile",
             response=response,
         )
         # If the page origin is the same as current page, then it's the main
         # logbook url and not one of its pages, thus we should return the payload.
-        if meta[META_KEY_ORIGIN] == response.url:
-            yield {
-                KEY_KIND: KIND_USER_JOURNAL,
-                KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN),
-                KEY_URL: response.url,
-            }
-        next_page = response.xpath(
-            "//a[has-class('c-pager__link')][@rel='next']/@href"
-        ).get()
-        if next_page:
-            next_url = response.urljoin(next_page)
-            yield scrapy.Request(next_url, callback=self.parse_user_profile, meta=meta)
-        yield from self.follow_known_links(
-            links=response.css(
-                "div.c-post-preview__title a.c-link::attr('href')"
-            ).getall(),
+        origin = meta[META_KEY_ORIGIN]
+        if origin == response.url:
+            self.listing_started(origin)
+            yield items.UserJournal(
+                url=response.url, origin=response.meta.get(META_KEY_ORIGIN)
+            )
+        post_links, past_window = self.filter_previews(response, fields["post_links"])
+        next_page = self.follow_next_page(
+            response,
+            callback=self.parse_user_profile,
+            meta=meta,
+            links=post_links,
+            past_window=past_window,
+        )
+        yield from self.track_listing(origin, next_page)
+        posts = self.follow_known_links(
+            links=post_links,
             patterns=(PATTERN_BLOG_POST,),
             page_name="user journal",
             response=response,
             meta=meta,
         )
+        yield from self.track_listing(origin, posts)
+        self.listing_parsed(origin)
 
     def parse_car(self, response):
         meta = {
             META_KEY_PARENT: response.url,
         }
-        car_title = response.css("h1.x-title::text").get().strip()
-        car_description = response.css("div.c-car-desc__text").get()
-        publish_date = (
-            response.css("div.c-car-desc")
-            .xpath("./meta[@itemprop='datePublished']/@content")
-            .get()
+        fields = SPEC_CAR.extract(response)
+        yield items.Car(
+            url=response.url,
+            title=fields["title"],
+            description=fields["description"],
+            published=items.parse_datetime(fields["published"]),
         )
-        yield {
-            KEY_KIND: KIND_CAR,
-            KEY_URL: response.url,
-            KEY_TITLE: car_title,
-            KEY_DESCRIPTION: car_description,
-            KEY_PUBLISHED: publish_date,
-        }
-        car_photos = response.css("a.c-lightbox-anchor::attr(href)").getall()
-
-        for car_photo_url in car_photos:
+        for car_photo_url in fields["photos"]:
             yield from self.download_photo(
                 url=car_photo_url, parent=meta[META_KEY_PARENT], origin=response.url
             )
         yield from self.follow_known_links(
-            links=response.css("h3 a.c-link::attr(href)").getall(),
+            links=fields["links"],
             patterns=(PATTERN_CAR_LOGBOOK, PATTERN_PHOTO_ALBUM),
             page_name="car page",
             response=response,
@@ -179,24 +727,24 @@ class D2ExperimentalSpider(scrapy.Spider):
             META_KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN) or response.url,
             META_KEY_PARENT: response.meta.get(META_KEY_PARENT),
         }
-        title = response.css("h1.x-title::text").get()
+        fields = SPEC_PHOTO_ALBUM.extract(response)
+        title = fields["title"]
         # If the page origin is the same as current page, then it's the photo
         # main photo album and not one of its pages, thus we should return the payload.
         if meta[META_KEY_ORIGIN] == response.url:
-            yield {
-                KEY_KIND: KIND_PHOTO_ALBUM,
-                KEY_TITLE: title,
-                KEY_URL: response.url,
-                KEY_PARENT: meta.get(META_KEY_PARENT),
-            }
-        next_page = response.xpath(
-            "//a[has-class('c-pager__link')][@rel='next']/@href"
-        ).get()
-        if next_page:
-            next_url = response.urljoin(next_page)
-            yield scrapy.Request(next_url, callback=self.parse_photo_album, meta=meta)
+            yield items.PhotoAlbum(
+                url=response.url, title=title, parent=meta.get(META_KEY_PARENT)
+            )
+        photo_links = fields["photo_links"]
+        yield from self.follow_next_page(
+            response, callback=self.parse_photo_album, meta=meta, links=photo_links
+        )
+        if fields["snaps"] and not self.full_fidelity:
+            photo_links = yield from self.harvest_album(
+                fields["snaps"], photo_links, response, meta
+            )
         yield from self.follow_known_links(
-            links=response.css("div.c-snaps-preview a::attr('href')").getall(),
+            links=photo_links,
             patterns=(PATTERN_PHOTO_POST,),
             page_name="photo album",
             response=response,
@@ -204,14 +752,12 @@ class D2ExperimentalSpider(scrapy.Spider):
         )
 
     def parse_photo_post(self, response):
-        username = (
-            response.css("a.c-username").xpath("./span[@itemprop='name']/text()").get()
-        )
-        photo_description = response.xpath("//div[@itemprop='description']/*").get()
-        photo_url = response.css("a.c-lightbox-anchor::attr('href')").get() or ""
-        publish_date = response.xpath(
-            "//meta[@property='article:published_time']/@content"
-        ).get()
+        fields = SPEC_PHOTO_POST.extract(response)
+        username = fields["username"]
+        owner = self.owner(response)
+        photo_description = fields["description"]
+        photo_url = fields["photo_url"] or ""
+        publish_date = fields["published"]
         match = PATTERN_PHOTO_IMAGE.match(photo_url)
         if not photo_url:
             self.log(f"Photo page {response.url} doesn't have a link to the photo.")
@@ -220,20 +766,19 @@ class D2ExperimentalSpider(scrapy.Spider):
                 f"Photo url {photo_url} from {response.url} is not recognized "
                 "as an url to a photo"
             )
-        elif getattr(self, "username", None) and username != getattr(self, "username"):
+        elif owner and username != owner:
             self.log(
                 "It looks like spider accidentally crawls a photo which "
                 f"isn't owned by a user: photo post {response.url} its user {username}."
             )
         else:
-            yield {
-                KEY_URL: response.url,
-                KEY_KIND: KIND_PHOTO_POST,
-                KEY_DESCRIPTION: photo_description,
-                KEY_PUBLISHED: publish_date,
-                KEY_PARENT: response.meta.get(META_KEY_PARENT),
-                KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN),
-            }
+            yield items.PhotoPost(
+                url=response.url,
+                description=photo_description,
+                published=items.parse_datetime(publish_date),
+                parent=response.meta.get(META_KEY_PARENT),
+                origin=response.meta.get(META_KEY_ORIGIN),
+            )
             yield from self.download_photo(
                 url=photo_url,
                 parent=response.meta.get(META_KEY_PARENT),
@@ -245,52 +790,51 @@ class D2ExperimentalSpider(scrapy.Spider):
             META_KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN) or response.url,
             META_KEY_PARENT: response.meta.get(META_KEY_PARENT),
         }
+        fields = SPEC_LOGBOOK.extract(response)
         # If the page origin is the same as current page, then it's the main
         # logbook url and not one of its pages, thus we should return the payload.
-        if meta[META_KEY_ORIGIN] == response.url:
-            yield {
-                KEY_KIND: KIND_CAR_LOGBOOK,
-                KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN),
-                KEY_PARENT: response.meta.get(META_KEY_PARENT),
-                KEY_URL: response.url,
-            }
-        next_page = response.xpath(
-            "//a[has-class('c-pager__link')][@rel='next']/@href"
-        ).get()
-        if next_page:
-            next_url = response.urljoin(next_page)
-            yield scrapy.Request(next_url, callback=self.parse_logbook, meta=meta)
-        yield from self.follow_known_links(
-            links=response.css(
-                "div.c-post-preview__title a.c-link::attr('href')"
-            ).getall(),
+        origin = meta[META_KEY_ORIGIN]
+        if origin == response.url:
+            self.listing_started(origin)
+            yield items.CarLogbook(
+                url=response.url,
+                origin=response.meta.get(META_KEY_ORIGIN),
+                parent=response.meta.get(META_KEY_PARENT),
+            )
+        post_links, past_window = self.filter_previews(response, fields["post_links"])
+        next_page = self.follow_next_page(
+            response,
+            callback=self.parse_logbook,
+            meta=meta,
+            links=post_links,
+            past_window=past_window,
+        )
+        yield from self.track_listing(origin, next_page)
+        posts = self.follow_known_links(
+            links=post_links,
             patterns=(PATTERN_CAR_POST,),
             page_name="car logbook",
             response=response,
             meta=meta,
         )
+        yield from self.track_listing(origin, posts)
+        self.listing_parsed(origin)
 
     def parse_blog_post(self, response):
-        title = response.css("h1.x-title::text").get().strip()
-        publish_date = response.xpath(
-            "//meta[@property='article:published_time']/@content"
-        ).get()
-        post_content = response.xpath("//div[@itemprop='articleBody']").get()
-        post_tag = response.css("span.c-post-meta__item a.c-link::text").get()
-        yield {
-            KEY_URL: response.url,
-            KEY_KIND: KIND_BLOG_POST,
-            KEY_TITLE: title,
-            KEY_PUBLISHED: publish_date,
-            KEY_PARENT: response.meta.get(META_KEY_PARENT),
-            KEY_ORIGIN: response.meta.get(META_KEY_ORIGIN),
-            KEY_CONTENT: post_content,
-            KEY_TAG: post_tag,
-        }
-        image_links = response.css("div.c-post__pic img::attr('src')").getall()
-        for image_link in image_links:
+        fields = SPEC_BLOG_POST.extract(response)
+        yield items.BlogPost(
+            url=response.url,
+            title=fields["title"],
+            published=items.parse_datetime(fields["published"]),
+            parent=response.meta.get(META_KEY_PARENT),
+            origin=response.meta.get(META_KEY_ORIGIN),
+            content=fields["content"],
+            tag=fields["tag"],
+        )
+        for image_link in fields["images"]:
             yield from self.download_photo(
                 url=image_link,
                 parent=response.meta.get(META_KEY_PARENT),
                 origin=response.url,
             )
+        self.listing_parsed(response.meta.get(META_KEY_ORIGIN))
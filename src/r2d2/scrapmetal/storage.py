@@ -0,0 +1,346 @@
+"""Storage backends for scraped items.
+
+Items are written through a write-behind buffer: the pipeline appends items
+to the buffer and the buffer hands them to the backend in batches, either
+when enough items are collected or when the previous flush is old enough.
+Each batch is committed as a single transaction, so a crash loses at most
+the items which are still in the buffer and never leaves a half-written
+batch in the store.
+
+`AsyncWriteBehindBuffer` is the buffer for coroutines: batches are written
+by a worker thread, and the caller only waits when too many of them are
+queued.
+"""
+
+import asyncio
+import datetime
+import functools
+import shelve
+import sqlite3
+import time
+
+from r2d2.scrapmetal.items import as_item, decode_item, encode_item
+
+KEY_KIND = "kind"
+KEY_URL = "url"
+KEY_PARENT = "parent"
+KEY_ORIGIN = "origin"
+
+
+def published_key(value):
+    """Sortable text of a publish date, as kept in the `published` column.
+
+    Dates with a timezone are converted to UTC, so dates of pages with
+    different offsets compare correctly as text.
+    """
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+class ShelveStorage:
+    """Legacy storage: url -> encoded item in a `shelve` database."""
+
+    extension = ".db"
+
+    def __init__(self, path):
+        self.path = path
+        # Open until close().
+        self.db = shelve.open(path, 'c')  # noqa: SIM115
+
+    def put_many(self, items):
+        for item in items:
+            item = as_item(item)
+            self.db[item.url] = encode_item(item)
+        self.db.sync()
+
+    def urls(self):
+        yield from self.db.keys()
+
+    def iter_items(self, kinds=None):
+        for key in self.db:
+            data = self.db[key]
+            # Items of old archives are pickled dicts.
+            item = as_item(data) if isinstance(data, dict) else decode_item(data)
+            if kinds is None or item.kind in kinds:
+                yield item
+
+    def iter_by_origin(self, origin, kinds=None):
+        # shelve has no indexes, it's a full scan for every call.
+        for item in self.iter_items(kinds):
+            if item.origin == origin:
+                yield item
+
+    def close(self):
+        self.db.close()
+
+
+class SQLiteStorage:
+    """SQLite storage in WAL mode keyed by `(kind, url)`.
+
+    `parent`, `origin` and `published` (see `published_key`) are kept as
+    separate indexed columns, so collections (e.g. all photos of a post)
+    can be read without decoding the whole archive, see `r2d2.archive`.
+    The item itself is stored by `encode_item`.
+    """
+
+    extension = ".sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS items (
+            kind TEXT NOT NULL,
+            url TEXT NOT NULL,
+            parent TEXT,
+            origin TEXT,
+            data TEXT NOT NULL,
+            published TEXT,
+            PRIMARY KEY (kind, url)
+        )
+    """
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS items_parent ON items (parent)",
+        "CREATE INDEX IF NOT EXISTS items_origin ON items (origin)",
+        "CREATE INDEX IF NOT EXISTS items_published ON items (published)",
+        "CREATE INDEX IF NOT EXISTS items_url ON items (url)",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        # The storage may be written by a worker thread of
+        # `AsyncWriteBehindBuffer`, one thread at a time.
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL keeps the database consistent after a crash,
+        # only the last committed transactions may be rolled back.
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.execute(self.SCHEMA)
+            self.add_published_column()
+            for statement in self.INDEXES:
+                self.connection.execute(statement)
+
+    def add_published_column(self):
+        """Add and fill `published` in an archive written before it existed."""
+        columns = {
+            row[1] for row in self.connection.execute("PRAGMA table_info(items)")
+        }
+        if "published" in columns:
+            return
+        self.connection.execute("ALTER TABLE items ADD COLUMN published TEXT")
+        rows = (
+            (published_key(item.published), item.kind, item.url)
+            for item in map(decode_item, self.iter_data())
+            if getattr(item, "published", None) is not None
+        )
+        self.connection.executemany(
+            "UPDATE items SET published = ? WHERE kind = ? AND url = ?", list(rows)
+        )
+
+    def iter_data(self):
+        for (data,) in self.connection.execute("SELECT data FROM items"):
+            yield data
+
+    def put_many(self, items):
+        rows = [
+            (
+                item.kind,
+                item.url,
+                item.parent,
+                item.origin,
+                encode_item(item),
+                published_key(getattr(item, "published", None)),
+            )
+            for item in map(as_item, items)
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO items "
+                "(kind, url, parent, origin, data, published) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def urls(self):
+        for (url,) in self.connection.execute("SELECT url FROM items"):
+            yield url
+
+    def iter_items(self, kinds=None):
+        if kinds is None:
+            cursor = self.connection.execute("SELECT data FROM items")
+        else:
+            kinds = list(kinds)
+            placeholders = ", ".join("?" * len(kinds))
+            cursor = self.connection.execute(
+                f"SELECT data FROM items WHERE kind IN ({placeholders})", kinds
+            )
+        for (data,) in cursor:
+            yield decode_item(data)
+
+    def iter_by_origin(self, origin, kinds=None):
+        query = "SELECT data FROM items WHERE origin = ?"
+        params = [origin]
+        if kinds is not None:
+            kinds = list(kinds)
+            query += " AND kind IN ({})".format(", ".join("?" * len(kinds)))
+            params.extend(kinds)
+        for (data,) in self.connection.execute(query + " ORDER BY rowid", params):
+            yield decode_item(data)
+
+    def close(self):
+        self.connection.close()
+
+
+BACKENDS = {
+    "sqlite": SQLiteStorage,
+    "shelve": ShelveStorage,
+}
+
+
+def open_storage(path, backend=None):
+    """Open a storage by backend name or guess the backend by file extension."""
+    if backend is None:
+        backend = "sqlite" if path.endswith(SQLiteStorage.extension) else "shelve"
+    try:
+        storage_cls = BACKENDS[backend]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage backend {backend!r}, "
+            f"expected one of: {', '.join(BACKENDS)}"
+        ) from None
+    return storage_cls(path)
+
+
+class WriteBehindBuffer:
+    """Collect items in memory and write them to a storage in batches.
+
+    The buffer is flushed when it holds `max_items` items or when
+    `max_interval` seconds passed since the previous flush, whatever comes
+    first. The interval is checked when an item is added.
+    """
+
+    def __init__(self, storage, max_items=500, max_interval=5.0, clock=time.monotonic):
+        self.storage = storage
+        self.max_items = max_items
+        self.max_interval = max_interval
+        self.clock = clock
+        self.items = []
+        self.flushed_at = clock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        self.items.append(item)
+        if (
+            len(self.items) >= self.max_items
+            or self.clock() - self.flushed_at >= self.max_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.items:
+            self.storage.put_many(self.items)
+            self.items = []
+        self.flushed_at = self.clock()
+
+    def close(self):
+        self.flush()
+        self.storage.close()
+
+
+class AsyncWriteBehindBuffer:
+    """`WriteBehindBuffer` whose batches are written in `executor`.
+
+    `add` hands a full batch over to the executor and returns without
+    waiting for the write. When `max_pending` batches are already queued,
+    it waits until one of them is written and returns the seconds it
+    waited: the caller, e.g. an item pipeline, is held up instead of the
+    queue growing in memory. `executor` must run tasks one at a time in
+    order (a single thread), batches are written in the order they came.
+
+    Must be used from coroutines running on an asyncio loop. A failed write
+    is raised by the next `add` or by `close`.
+    """
+
+    def __init__(
+        self,
+        storage,
+        executor,
+        max_items=500,
+        max_interval=5.0,
+        max_pending=4,
+        clock=time.monotonic,
+    ):
+        self.storage = storage
+        self.executor = executor
+        self.max_items = max_items
+        self.max_interval = max_interval
+        self.max_pending = max_pending
+        self.clock = clock
+        self.items = []
+        self.flushed_at = clock()
+        # Batches handed over to the executor and not written yet.
+        self.pending = set()
+        self.queued_items = 0
+        self.error = None
+
+    def __len__(self):
+        """Items which aren't written yet, buffered or queued."""
+        return len(self.items) + self.queued_items
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    async def add(self, item):
+        """Add an item, return the seconds spent waiting for the queue."""
+        self.raise_error()
+        self.items.append(item)
+        if (
+            len(self.items) >= self.max_items
+            or self.clock() - self.flushed_at >= self.max_interval
+        ):
+            return await self.flush()
+        return 0.0
+
+    async def flush(self):
+        stalled = 0.0
+        if len(self.pending) >= self.max_pending:
+            started = time.monotonic()
+            while len(self.pending) >= self.max_pending:
+                await asyncio.wait(self.pending, return_when=asyncio.FIRST_COMPLETED)
+            stalled = time.monotonic() - started
+        self.raise_error()
+        if self.items:
+            items, self.items = self.items, []
+            future = asyncio.wrap_future(
+                self.executor.submit(self.storage.put_many, items)
+            )
+            self.pending.add(future)
+            self.queued_items += len(items)
+            future.add_done_callback(functools.partial(self.written, len(items)))
+        self.flushed_at = self.clock()
+        return stalled
+
+    def written(self, count, future):
+        self.pending.discard(future)
+        self.queued_items -= count
+        if (
+            not future.cancelled()
+            and future.exception() is not None
+            and self.error is None
+        ):
+            self.error = future.exception()
+
+    async def close(self):
+        try:
+            await self.flush()
+            if self.pending:
+                await asyncio.wait(self.pending)
+            self.raise_error()
+        finally:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.storage.close)
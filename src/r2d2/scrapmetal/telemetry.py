@@ -0,0 +1,169 @@
+"""Crawl telemetry: where a long crawl spends its time.
+
+`Telemetry` collects timings and counters while the crawl runs, see
+`ScrapmetalSpiderMiddleware` for the hooks which feed it. A snapshot of
+the numbers is written periodically as a line of JSON and, optionally, as
+a Prometheus textfile (for the node_exporter textfile collector).
+
+Timings are sums with a count and a maximum, not histograms: they are
+cheap to collect and enough to find the slow callback, host or pipeline.
+"""
+
+import collections
+import json
+import os
+import tempfile
+import time
+
+
+class Timing:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.cpu_seconds = 0.0
+
+    def add(self, seconds, cpu_seconds=0.0):
+        self.count += 1
+        self.seconds += seconds
+        self.cpu_seconds += cpu_seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "seconds": round(self.seconds, 6),
+            "max_seconds": round(self.max_seconds, 6),
+            "cpu_seconds": round(self.cpu_seconds, 6),
+        }
+
+
+class Telemetry:
+    """Counters and timings of a crawl.
+
+    - `callbacks`: time spent inside spider callbacks, by callback name;
+    - `items`: items yielded by callbacks, by item kind;
+    - `requests`: requests yielded by callbacks, by the callback of the
+      request;
+    - `downloads`: download latency (time to response headers), by host;
+    - `pipelines`: time until a pipeline stage is done with an item, by
+      pipeline class. It includes waiting, e.g. for photo downloads.
+
+    Queue depths and the time item pipelines waited for the storage
+    (`storage_stall_seconds`) are set right before a snapshot is taken.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.callbacks = collections.defaultdict(Timing)
+        self.items = collections.Counter()
+        self.requests = collections.Counter()
+        self.downloads = collections.defaultdict(Timing)
+        self.cached_responses = 0
+        self.pipelines = collections.defaultdict(Timing)
+        self.queues = {}
+        self.storage_stall_seconds = 0.0
+        self.last_time = self.started
+        self.last_items = 0
+        self.last_responses = 0
+
+    def snapshot(self):
+        """Return the current numbers as a JSON-serializable dict.
+
+        Rates are computed since the previous snapshot.
+        """
+        now = self.clock()
+        items = sum(self.items.values())
+        responses = sum(timing.count for timing in self.callbacks.values())
+        interval = now - self.last_time
+        snapshot = {
+            "time": round(time.time(), 3),
+            "elapsed": round(now - self.started, 3),
+            "items": items,
+            "items_per_second": round((items - self.last_items) / interval, 3)
+            if interval > 0
+            else 0.0,
+            "responses": responses,
+            "responses_per_second": round(
+                (responses - self.last_responses) / interval, 3
+            )
+            if interval > 0
+            else 0.0,
+            "queues": dict(self.queues),
+            "storage_stall_seconds": round(self.storage_stall_seconds, 6),
+            "callbacks": {
+                name: timing.as_dict() for name, timing in self.callbacks.items()
+            },
+            "items_by_kind": dict(self.items),
+            "requests_by_callback": dict(self.requests),
+            "downloads": {
+                host: timing.as_dict() for host, timing in self.downloads.items()
+            },
+            "cached_responses": self.cached_responses,
+            "pipelines": {
+                stage: timing.as_dict() for stage, timing in self.pipelines.items()
+            },
+        }
+        self.last_time, self.last_items, self.last_responses = now, items, responses
+        return snapshot
+
+
+def append_jsonl(snapshot, path):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(snapshot, sort_keys=True) + "\n")
+
+
+LABEL_ESCAPE = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def metric_line(name, value, **labels):
+    if labels:
+        label_text = ",".join(
+            f'{key}="{str(label).translate(LABEL_ESCAPE)}"'
+            for key, label in labels.items()
+        )
+        return f"scrapmetal_{name}{{{label_text}}} {value}"
+    return f"scrapmetal_{name} {value}"
+
+
+def timing_lines(name, label, timings):
+    """Prometheus lines of a `Timing` group, e.g. seconds per callback."""
+    for key, timing in sorted(timings.items()):
+        yield metric_line(f"{name}_seconds_total", timing["seconds"], **{label: key})
+        yield metric_line(f"{name}_count_total", timing["count"], **{label: key})
+        yield metric_line(f"{name}_max_seconds", timing["max_seconds"], **{label: key})
+        if timing["cpu_seconds"]:
+            yield metric_line(
+                f"{name}_cpu_seconds_total", timing["cpu_seconds"], **{label: key}
+            )
+
+
+def prometheus_lines(snapshot):
+    yield metric_line("elapsed_seconds", snapshot["elapsed"])
+    yield metric_line("items_total", snapshot["items"])
+    yield metric_line("items_per_second", snapshot["items_per_second"])
+    yield metric_line("responses_total", snapshot["responses"])
+    yield metric_line("cached_responses_total", snapshot["cached_responses"])
+    for queue, depth in sorted(snapshot["queues"].items()):
+        yield metric_line("queue_depth", depth, queue=queue)
+    yield metric_line(
+        "storage_stall_seconds_total", snapshot.get("storage_stall_seconds", 0.0)
+    )
+    for kind, count in sorted(snapshot["items_by_kind"].items()):
+        yield metric_line("items_by_kind_total", count, kind=kind)
+    for callback, count in sorted(snapshot["requests_by_callback"].items()):
+        yield metric_line("requests_total", count, callback=callback)
+    yield from timing_lines("callback", "callback", snapshot["callbacks"])
+    yield from timing_lines("download_latency", "host", snapshot["downloads"])
+    yield from timing_lines("pipeline", "stage", snapshot["pipelines"])
+
+
+def write_prometheus(snapshot, path):
+    """Replace the textfile at `path`; a scraper never sees a partial file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        for line in prometheus_lines(snapshot):
+            f.write(line + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,181 @@
+"""Adaptive politeness for downloader slots.
+
+Scrapy keeps one downloader slot per host. Drive2 pages and photos on the
+`a.d-cd.net` CDN live on different hosts, so they can be throttled
+separately: pages stay slow and polite, photos are fetched quickly. The
+delay and concurrency of each slot start from a profile in
+`SCRAPMETAL_THROTTLE_SLOTS` and follow observed latency: concurrency
+grows slowly while the host answers fine and both delay and concurrency
+back off on 429 and 5xx responses.
+"""
+
+import dataclasses
+import time
+from typing import Optional
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+from r2d2.scrapmetal.downloads import META_KEY_DOWNLOAD
+
+THROTTLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+@dataclasses.dataclass
+class SlotProfile:
+    delay: float
+    min_delay: float
+    max_delay: float
+    concurrency: int
+    max_concurrency: int
+    # Grow concurrency by one after this many successful responses in a row.
+    grow_after: int = 10
+
+
+@dataclasses.dataclass
+class SlotController:
+    """Delay and concurrency of a single slot plus its throughput counters."""
+
+    profile: SlotProfile
+    delay: float = 0.0
+    concurrency: int = 1
+    responses: int = 0
+    throttled: int = 0
+    bytes_received: int = 0
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    streak: int = 0
+
+    def __post_init__(self):
+        self.delay = self.profile.delay
+        self.concurrency = self.profile.concurrency
+
+    def on_response(self, latency, status, size, now, retry_after=None):
+        if self.started_at is None:
+            self.started_at = now - latency
+        self.finished_at = now
+        self.responses += 1
+        self.bytes_received += size
+        profile = self.profile
+        if status in THROTTLE_STATUSES:
+            self.throttled += 1
+            self.streak = 0
+            self.concurrency = max(1, self.concurrency // 2)
+            delay = max(self.delay * 2, latency, retry_after or 0, profile.min_delay)
+            self.delay = min(profile.max_delay, delay)
+            return
+        # The same idea as in AutoThrottle: with `concurrency` parallel
+        # requests a delay of latency / concurrency keeps the host busy
+        # with about `concurrency` requests at a time.
+        target = latency / self.concurrency
+        delay = (self.delay + target) / 2
+        self.delay = min(profile.max_delay, max(profile.min_delay, delay))
+        self.streak += 1
+        if self.streak >= profile.grow_after:
+            self.streak = 0
+            self.concurrency = min(profile.max_concurrency, self.concurrency + 1)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+    @property
+    def responses_per_minute(self):
+        return 60 * self.responses / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes_received / self.elapsed if self.elapsed else 0.0
+
+
+def parse_retry_after(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # HTTP dates are possible too, but Drive2 doesn't send them.
+        return None
+
+
+class AdaptiveThrottle:
+    """Scrapy extension which drives downloader slots by `SlotController`."""
+
+    def __init__(self, crawler, profiles, clock=time.monotonic):
+        self.crawler = crawler
+        self.profiles = profiles
+        self.clock = clock
+        self.controllers = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("SCRAPMETAL_THROTTLE_ENABLED"):
+            raise NotConfigured
+        profiles = {
+            host: SlotProfile(**profile)
+            for host, profile in settings.getdict("SCRAPMETAL_THROTTLE_SLOTS").items()
+        }
+        ext = cls(crawler, profiles)
+        crawler.signals.connect(
+            ext.request_reached_downloader, signal=signals.request_reached_downloader
+        )
+        crawler.signals.connect(
+            ext.response_downloaded, signal=signals.response_downloaded
+        )
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def get_slot(self, request):
+        key = request.meta.get("download_slot")
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def request_reached_downloader(self, request, spider):
+        key, slot = self.get_slot(request)
+        if slot is None or key in self.controllers or key not in self.profiles:
+            return
+        controller = self.controllers[key] = SlotController(self.profiles[key])
+        slot.delay = controller.delay
+        slot.concurrency = controller.concurrency
+
+    def response_downloaded(self, response, request, spider):
+        key, slot = self.get_slot(request)
+        controller = self.controllers.get(key)
+        latency = request.meta.get("download_latency")
+        if slot is None or controller is None or latency is None:
+            return
+        controller.on_response(
+            latency=latency,
+            status=response.status,
+            # Streamed downloads have no body, see r2d2.scrapmetal.downloads.
+            size=request.meta.get(META_KEY_DOWNLOAD, {}).get(
+                "received", len(response.body)
+            ),
+            now=self.clock(),
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+        )
+        slot.delay = controller.delay
+        slot.concurrency = controller.concurrency
+
+    def spider_closed(self, spider):
+        stats = self.crawler.stats
+        for key, controller in self.controllers.items():
+            prefix = f"scrapmetal/throttle/{key}"
+            stats.set_value(f"{prefix}/responses", controller.responses)
+            stats.set_value(f"{prefix}/throttled", controller.throttled)
+            stats.set_value(
+                f"{prefix}/responses_per_minute",
+                round(controller.responses_per_minute, 2),
+            )
+            stats.set_value(
+                f"{prefix}/bytes_per_second", round(controller.bytes_per_second)
+            )
+            stats.set_value(f"{prefix}/delay", round(controller.delay, 3))
+            stats.set_value(f"{prefix}/concurrency", controller.concurrency)
+            spider.logger.info(
+                f"Slot {key}: {controller.responses} responses, "
+                f"{controller.responses_per_minute:.1f}/min, "
+                f"{controller.throttled} throttled, "
+                f"final delay {controller.delay:.2f}s "
+                f"x{controller.concurrency}"
+            )
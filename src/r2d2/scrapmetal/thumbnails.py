@@ -0,0 +1,219 @@
+"""Resized, re-encoded copies of downloaded photos.
+
+Photos from `a.d-cd.net` are stored at full size, and Day One imports of
+thousands of them are slow and huge. `ThumbnailPipeline` makes a JPEG of
+every downloaded photo which fits into `SCRAPMETAL_THUMBNAILS_SIZE` pixels,
+re-encoded with `SCRAPMETAL_THUMBNAILS_QUALITY` and without EXIF data.
+
+Images are decoded and encoded in a pool of worker processes, the
+pipeline only waits for the results, so the reactor never blocks on
+Pillow. Photos are stored by content hash (see `r2d2.scrapmetal.files`),
+and a variant is stored by the same hash under
+`FILES_STORE/thumbnails/<size>q<quality>/`, so a photo which has a variant
+already, from this crawl or from a previous one, is skipped.
+
+Pillow is optional: without it the pipeline is disabled.
+"""
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from twisted.internet.defer import Deferred, DeferredList
+
+logger = logging.getLogger(__name__)
+
+THUMBNAILS_DIR = "thumbnails"
+# Key of the variant path in records of `files`, next to `path`.
+KEY_THUMBNAIL = "thumbnail"
+
+
+def variant_path(path, size, quality):
+    """Path of a variant of a stored file, relative to `FILES_STORE`.
+
+    `objects/ab/cd/abcd...jpg` becomes `thumbnails/1600q85/ab/cd/abcd...jpg`.
+    """
+    sharded = path.split("/", 1)[1]
+    stem = os.path.splitext(sharded)[0]
+    return f"{THUMBNAILS_DIR}/{size}q{quality}/{stem}.jpg"
+
+
+def make_variant(source, target, size, quality):
+    """Write a resized JPEG of `source` to `target`, in a worker process.
+
+    Return sizes of both files and CPU time spent on the image.
+    """
+    from PIL import Image, ImageOps
+
+    started = time.process_time()
+    with Image.open(source) as image:
+        # EXIF is dropped, so its orientation is applied to the pixels.
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.LANCZOS)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, "JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    cpu_seconds = time.process_time() - started
+    return os.path.getsize(source), os.path.getsize(target), cpu_seconds
+
+
+class ThumbnailPipeline:
+    """Make resized copies of photos downloaded by `DedupFilesPipeline`.
+
+    Must come after the files pipeline in `ITEM_PIPELINES`. The variant
+    path is added to the records of `files` as `thumbnail`.
+
+    Stats under `scrapmetal/thumbnails/`: `created`, `skipped` (the
+    variant exists), `failed`, `bytes_in`/`bytes_out` of created variants,
+    `bytes_saved` and `cpu_seconds` of workers. Throughput is logged when
+    the spider closes.
+    """
+
+    def __init__(self, files_store, stats, size=1600, quality=85, workers=None):
+        self.files_store = files_store
+        self.stats = stats
+        self.size = size
+        self.quality = quality
+        self.workers = workers or os.cpu_count()
+        self.executor = None
+        # Variant path -> Deferreds of items waiting for the variant.
+        self.pending = {}
+        self.started = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("SCRAPMETAL_THUMBNAILS_ENABLED"):
+            raise NotConfigured
+        try:
+            import PIL  # noqa: F401
+        except ImportError:
+            raise NotConfigured("ThumbnailPipeline requires Pillow") from None
+        files_store = settings.get("FILES_STORE")
+        if not files_store or "://" in files_store:
+            raise NotConfigured("ThumbnailPipeline supports only local FILES_STORE")
+        return cls(
+            files_store,
+            crawler.stats,
+            size=settings.getint("SCRAPMETAL_THUMBNAILS_SIZE", 1600),
+            quality=settings.getint("SCRAPMETAL_THUMBNAILS_QUALITY", 85),
+            workers=settings.getint("SCRAPMETAL_THUMBNAILS_WORKERS") or None,
+        )
+
+    def open_spider(self, spider):
+        self.started = time.monotonic()
+        # Forking a process with the reactor's threads running isn't safe,
+        # workers are started from scratch.
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def close_spider(self, spider):
+        self.executor.shutdown()
+        elapsed = time.monotonic() - self.started
+        created = self.stats.get_value("scrapmetal/thumbnails/created", 0)
+        if created:
+            saved = self.stats.get_value("scrapmetal/thumbnails/bytes_saved", 0)
+            logger.info(
+                f"Made {created} thumbnails, {created / elapsed:.1f}/sec, "
+                f"saved {saved / (1 << 20):.1f} MiB"
+            )
+
+    def store_path(self, path):
+        return os.path.join(self.files_store, *path.split("/"))
+
+    def process_item(self, item, spider):
+        files = ItemAdapter(item).get("files")
+        if not files:
+            return item
+        waiting = [self.process_file(record) for record in files]
+        waiting = [deferred for deferred in waiting if deferred is not None]
+        if not waiting:
+            return item
+        deferred = DeferredList(waiting)
+        deferred.addCallback(lambda _: item)
+        return deferred
+
+    def process_file(self, record):
+        """Make a variant of a stored file, return a Deferred or None if done."""
+        path = record.get("path")
+        if not path:
+            return None
+        thumbnail = variant_path(path, self.size, self.quality)
+        if thumbnail not in self.pending and os.path.exists(self.store_path(thumbnail)):
+            self.stats.inc_value("scrapmetal/thumbnails/skipped")
+            record[KEY_THUMBNAIL] = thumbnail
+            return None
+        deferred = Deferred()
+        if thumbnail in self.pending:
+            # Another item has the same photo, its variant is on the way.
+            self.stats.inc_value("scrapmetal/thumbnails/skipped")
+        else:
+            future = self.executor.submit(
+                make_variant,
+                self.store_path(path),
+                self.store_path(thumbnail),
+                self.size,
+                self.quality,
+            )
+            self.pending[thumbnail] = []
+            made = deferred_from_future(future)
+            made.addCallbacks(
+                self.variant_done, self.variant_failed, errbackArgs=(path,)
+            )
+            made.addBoth(self.notify_waiting, thumbnail)
+        self.pending[thumbnail].append(deferred)
+        deferred.addCallback(self.add_thumbnail, record, thumbnail)
+        return deferred
+
+    def add_thumbnail(self, made, record, thumbnail):
+        if made:
+            record[KEY_THUMBNAIL] = thumbnail
+
+    def variant_done(self, result):
+        bytes_in, bytes_out, cpu_seconds = result
+        self.stats.inc_value("scrapmetal/thumbnails/created")
+        self.stats.inc_value("scrapmetal/thumbnails/bytes_in", bytes_in)
+        self.stats.inc_value("scrapmetal/thumbnails/bytes_out", bytes_out)
+        self.stats.inc_value("scrapmetal/thumbnails/bytes_saved", bytes_in - bytes_out)
+        self.stats.inc_value("scrapmetal/thumbnails/cpu_seconds", cpu_seconds)
+        return True
+
+    def variant_failed(self, failure, path):
+        logger.warning(f"Failed to make a thumbnail of {path}: {failure.value!r}")
+        self.stats.inc_value("scrapmetal/thumbnails/failed")
+        return False
+
+    def notify_waiting(self, made, thumbnail):
+        for deferred in self.pending.pop(thumbnail):
+            deferred.callback(made)
+
+
+def deferred_from_future(future):
+    """Deferred which fires in the reactor thread when `future` is done."""
+    from twisted.internet import reactor
+
+    deferred = Deferred()
+
+    def done(future):
+        if future.exception() is not None:
+            reactor.callFromThread(deferred.errback, future.exception())
+        else:
+            reactor.callFromThread(deferred.callback, future.result())
+
+    future.add_done_callback(done)
+    return deferred
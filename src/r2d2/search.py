@@ -0,0 +1,309 @@
+"""Full-text search over archived posts and photo descriptions.
+
+`SearchIndex` is an inverted index in a SQLite file, made by its FTS5
+extension. Titles, bodies of posts and cars with markup stripped, photo
+descriptions and tags are indexed, and a search returns URLs ranked by
+BM25, with matches in titles and tags weighted over matches in bodies:
+
+    with SearchIndex("d2search.sqlite") as index:
+        for hit in index.search("замена масла", kinds=["BlogPost"]):
+            print(hit.url, hit.title)
+
+Drive2 is mostly Russian, and FTS5 tokenizers know nothing about it, so
+text is normalized before it's indexed and so is a query: markup and
+entities are dropped, words are lowercased, "ё" becomes "е" and every
+word is cut by `stem` to a rough stem, so "масло", "масла" and "маслом"
+are the same word. An item is indexed again only if its text changed,
+re-crawling into the same index is cheap. The index is filled during a
+crawl by `r2d2.scrapmetal.pipelines.SearchIndexPipeline`, or from an
+archive by `r2d2 index`.
+"""
+
+import dataclasses
+import functools
+import hashlib
+import html
+import itertools
+import re
+import sqlite3
+
+from r2d2.scrapmetal.items import as_item
+from r2d2.scrapmetal.storage import published_key
+
+PATTERN_TAG = re.compile(r"<[^>]*>")
+PATTERN_WORD = re.compile(r"[^\W_]+")
+PATTERN_CYRILLIC = re.compile(r"[а-я]")
+# Inflectional endings of Russian words: nouns, adjectives, participles
+# and verbs. The longest ending of a word is cut, derivational suffixes
+# stay in the stem.
+ENDINGS = frozenset(
+    """
+    иями ями ами иях ях ах ией ей ью ья ия ье ии ев ов ом ем ам ям
+    ыми ими ого его ому ему ая яя ое ее ые ие ый ий ой ую юю ых их ым им
+    ющий ющая ющее ющие ющих ющим вший вшая вшее вшие вших
+    ить ать ять еть уть ешь ишь ете ите ует уют ила ило или ала ало али
+    яла яло яли ял ил ал ет ит ут ют ат ят
+    а е и й о у ы ь ю я
+    """.split()  # noqa: SIM905
+)
+ENDING_LENGTHS = sorted({len(ending) for ending in ENDINGS}, reverse=True)
+REFLEXIVE = ("ся", "сь")
+# Prepositions, conjunctions and particles, which neither are indexed nor
+# have to be found.
+STOPWORDS = frozenset(
+    """
+    а без в во да для до же за и из или к ко ли на над не ни но о об от по
+    под при про с со у что чтобы
+    """.split()  # noqa: SIM905
+)
+MIN_STEM = 3
+# Fields of items which are indexed, and kinds of items which have them.
+TEXT_FIELDS = ("title", "content", "description", "tag")
+KINDS = ("BlogPost", "Car", "PhotoAlbum", "PhotoPost")
+# Items indexed in a transaction by `SearchIndex.update`.
+BATCH_SIZE = 1000
+# Characters of a body shown as the title of an item which has none.
+TITLE_SNIPPET = 80
+# BM25 weights of the title, body and tag columns.
+WEIGHTS = (10.0, 1.0, 5.0)
+
+
+def strip_markup(text):
+    """Text of an HTML fragment without tags and entities."""
+    return html.unescape(PATTERN_TAG.sub(" ", text)) if "<" in text else text
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def stem(word):
+    """Cut the inflectional ending off a lowercase Russian word.
+
+    It's a light stemmer, not a morphological analyzer: a single ending is
+    removed, after a reflexive "ся"/"сь", and at least `MIN_STEM` letters
+    are kept. Other words are returned as is. Stems are cached, texts
+    repeat the same few thousand words.
+    """
+    if not PATTERN_CYRILLIC.search(word):
+        return word
+    for ending in REFLEXIVE:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            word = word[: -len(ending)]
+            break
+    for length in ENDING_LENGTHS:
+        if len(word) - length >= MIN_STEM and word[-length:] in ENDINGS:
+            return word[:-length]
+    return word
+
+
+def normalize(text):
+    """Return the words of a text as they are indexed."""
+    if not text:
+        return []
+    text = strip_markup(text).lower().replace("ё", "е")
+    return [stem(word) for word in PATTERN_WORD.findall(text) if word not in STOPWORDS]
+
+
+def searchable(item):
+    """Whether an item has any text to index."""
+    return any(getattr(item, name, None) for name in TEXT_FIELDS)
+
+
+@dataclasses.dataclass
+class Document:
+    """Text of an item to index."""
+
+    url: str
+    kind: str
+    title: str
+    body: str
+    tag: str
+    published: str
+
+    @classmethod
+    def from_item(cls, item):
+        """Document of an item, None if the item has no text."""
+        if not searchable(item):
+            return None
+        return cls(
+            item.url,
+            item.kind,
+            getattr(item, "title", None) or "",
+            getattr(item, "content", None) or getattr(item, "description", None) or "",
+            getattr(item, "tag", None) or "",
+            published_key(getattr(item, "published", None)),
+        )
+
+    @property
+    def digest(self):
+        """Digest of the text, to skip items which haven't changed."""
+        text = f"{self.kind}\0{self.title}\0{self.body}\0{self.tag}"
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    @property
+    def display_title(self):
+        """The title, or the start of the body if there is no title."""
+        if self.title:
+            return self.title
+        return " ".join(strip_markup(self.body).split())[:TITLE_SNIPPET]
+
+    def words(self):
+        """Normalized words of the title, the body and the tag."""
+        return tuple(
+            " ".join(normalize(text)) for text in (self.title, self.body, self.tag)
+        )
+
+
+@dataclasses.dataclass
+class Hit:
+    url: str
+    kind: str
+    title: str
+    published: str
+    score: float
+
+
+def build_query(text):
+    """FTS5 query of all words of a text, None if it has no words."""
+    words = dict.fromkeys(normalize(text))
+    if not words:
+        return None
+    # Quoted, so words like "and" or "near" aren't taken for operators.
+    return " ".join(f'"{word}"' for word in words)
+
+
+class SearchIndex:
+    """Inverted index of archived items in a SQLite file.
+
+    `documents` keeps URLs, kinds, titles and digests of the indexed text,
+    `search` is the FTS5 index of the normalized words, with the same
+    rowids. Like `SQLiteStorage`, it may be written by the worker thread
+    of `AsyncWriteBehindBuffer`.
+    """
+
+    SCHEMA = (
+        """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,
+            title TEXT NOT NULL,
+            published TEXT,
+            digest TEXT NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS documents_kind ON documents (kind)",
+        # Words are normalized already, the tokenizer only splits them.
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (
+            title, body, tag, tokenize = 'unicode61 remove_diacritics 0'
+        )
+        """,
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT count(*) FROM documents").fetchone()[0]
+
+    def put_many(self, items):
+        """Index items, return the number of added or changed documents.
+
+        Items without text are skipped, and so are items whose text is
+        indexed already.
+        """
+        changed = 0
+        with self.connection:
+            for item in map(as_item, items):
+                document = Document.from_item(item)
+                if document is not None and self.put(document):
+                    changed += 1
+        return changed
+
+    def update(self, items, batch_size=BATCH_SIZE):
+        """Index an iterable of items in batches, e.g. of an archive.
+
+        Return the number of items and of added or changed documents.
+        """
+        items = iter(items)
+        count = changed = 0
+        while batch := list(itertools.islice(items, batch_size)):
+            count += len(batch)
+            changed += self.put_many(batch)
+        return count, changed
+
+    def put(self, document):
+        digest = document.digest
+        row = self.connection.execute(
+            "SELECT id, digest FROM documents WHERE url = ?", (document.url,)
+        ).fetchone()
+        if row is not None:
+            if row[1] == digest:
+                return False
+            self.connection.execute("DELETE FROM search WHERE rowid = ?", (row[0],))
+            self.connection.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+        cursor = self.connection.execute(
+            "INSERT INTO documents (url, kind, title, published, digest) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                document.url,
+                document.kind,
+                document.display_title,
+                document.published,
+                digest,
+            ),
+        )
+        self.connection.execute(
+            "INSERT INTO search (rowid, title, body, tag) VALUES (?, ?, ?, ?)",
+            (cursor.lastrowid,) + document.words(),
+        )
+        return True
+
+    def optimize(self):
+        """Merge the segments of the index, e.g. after a large update."""
+        with self.connection:
+            self.connection.execute("INSERT INTO search (search) VALUES ('optimize')")
+
+    def search(self, text, kinds=None, limit=20):
+        """Return `Hit`s of items with all words of `text`, best first."""
+        query = build_query(text)
+        if query is None:
+            return []
+        join = where = ""
+        params = [query]
+        if kinds:
+            join = " JOIN documents ON documents.id = search.rowid"
+            where = f" AND documents.kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        params.append(limit)
+        weights = ", ".join(map(str, WEIGHTS))
+        # The best matches are picked from the index alone, and only they
+        # are looked up in `documents`.
+        sql = (
+            "SELECT url, kind, title, published, score FROM ("
+            f"SELECT search.rowid AS id, bm25(search, {weights}) AS score "
+            f"FROM search{join} WHERE search MATCH ?{where} "
+            "ORDER BY score LIMIT ?"
+            ") AS hits JOIN documents USING (id) ORDER BY score"
+        )
+        # bm25() is negative, the better the match the lower.
+        return [
+            Hit(url, kind, title, published, -score)
+            for url, kind, title, published, score in self.connection.execute(
+                sql, params
+            )
+        ]
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+from twisted.python.failure import Failure
+
+
+class FakeClock:
+    """Clock for `clock` arguments, which moves only when `now` is set."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(scope="session")
+def wait():
+    """Return a function which runs the reactor until a Deferred fires.
+
+    Names are resolved in the threadpool of the reactor, which normally
+    starts with `reactor.run()`.
+    """
+    from twisted.internet import reactor
+
+    threadpool = reactor.getThreadPool()
+    threadpool.start()
+
+    def wait(deferred, timeout=10):
+        results = []
+        deferred.addBoth(results.append)
+        deadline = time.monotonic() + timeout
+        while not results and time.monotonic() < deadline:
+            reactor.iterate(0.01)
+        (result,) = results
+        if isinstance(result, Failure):
+            result.raiseException()
+        return result
+
+    yield wait
+    threadpool.stop()
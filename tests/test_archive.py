@@ -0,0 +1,74 @@
+import datetime
+import sqlite3
+
+from r2d2.archive import Archive
+from r2d2.scrapmetal import items
+from r2d2.scrapmetal.storage import SQLiteStorage, open_storage
+
+CAR = "https://www.drive2.ru/r/lada/1/"
+POST = "https://www.drive2.ru/l/1/"
+MSK = datetime.timezone(datetime.timedelta(hours=3))
+
+
+def make_items():
+    return [
+        items.Car(CAR, title="Lada"),
+        items.BlogPost(
+            POST, parent=CAR, published=datetime.datetime(2023, 5, 1, 2, tzinfo=MSK)
+        ),
+        items.BlogPost(
+            "https://www.drive2.ru/l/2/",
+            parent=CAR,
+            published=datetime.datetime(2022, 12, 31, 23, tzinfo=MSK),
+        ),
+        items.BlogPost("https://www.drive2.ru/l/3/", parent=CAR),
+        items.Photo("https://a.d-cd.net/1.jpg", origin=POST),
+        items.Photo("https://a.d-cd.net/2.jpg", origin="https://www.drive2.ru/l/2/"),
+    ]
+
+
+def test_lookups(tmp_path):
+    path = str(tmp_path / "a.sqlite")
+    storage = open_storage(path)
+    storage.put_many(make_items())
+    with Archive(storage) as archive:
+        posts = archive.records(kinds=["BlogPost"], parent=CAR)
+        assert [record.url[-5:] for record in posts] == ["/l/1/", "/l/2/", "/l/3/"]
+        photos = archive.items(kinds=["Photo"], origin=POST)
+        assert [photo.url for photo in photos] == ["https://a.d-cd.net/1.jpg"]
+        # 2023-05-01 02:00+03:00 is 2023-04-30 in UTC.
+        assert archive.count(since="2023-01-01", until="2023-05-01") == 1
+        assert archive.count(since=datetime.date(2023, 1, 1)) == 1
+        by_date = archive.records(kinds=["BlogPost"], order="published")
+        assert [record.url[-5:] for record in by_date] == ["/l/3/", "/l/2/", "/l/1/"]
+        assert archive.get(CAR).title == "Lada"
+        assert archive.get("https://www.drive2.ru/nope/") is None
+
+
+def test_shelve_lookups(tmp_path):
+    storage = open_storage(str(tmp_path / "a.db"), backend="shelve")
+    storage.put_many(make_items())
+    with Archive(storage) as archive:
+        assert archive.count(kinds=["BlogPost"], parent=CAR) == 3
+        assert archive.count(since="2023-01-01", until="2023-05-01") == 1
+        (photo,) = archive.items(origin=POST)
+        assert photo.kind == "Photo"
+
+
+def test_published_column_added_to_old_archive(tmp_path):
+    path = str(tmp_path / "a.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE items (kind TEXT NOT NULL, url TEXT NOT NULL, parent TEXT, "
+        "origin TEXT, data TEXT NOT NULL, PRIMARY KEY (kind, url))"
+    )
+    connection.execute(
+        "INSERT INTO items VALUES (?, ?, NULL, NULL, ?)",
+        ("BlogPost", POST, items.encode_item(make_items()[1])),
+    )
+    connection.commit()
+    connection.close()
+
+    with Archive(SQLiteStorage(path)) as archive:
+        (record,) = archive.records(since="2023-04-30")
+        assert record.published == "2023-04-30T23:00:00"
@@ -0,0 +1,64 @@
+import json
+import zipfile
+
+from r2d2.archive import Archive
+from r2d2.exporters.dayone import DayOneExporter
+from r2d2.scrapmetal.storage import SQLiteStorage
+
+POST_URL = "https://www.drive2.ru/l/1/"
+PHOTO_URL = "https://a.d-cd.net/abc.jpg"
+
+
+def make_archive(tmp_path):
+    (tmp_path / "images" / "full").mkdir(parents=True)
+    (tmp_path / "images" / "full" / "abc.jpg").write_bytes(b"\xff\xd8jpeg")
+    storage = SQLiteStorage(str(tmp_path / "archive.sqlite"))
+    storage.put_many(
+        [
+            {
+                "kind": "BlogPost",
+                "url": POST_URL,
+                "title": "Oil change",
+                "published": "2023-05-01T10:00:00+03:00",
+                "content": "<div><p>First</p><p>Second</p></div>",
+                "tag": "Repair",
+                "parent": None,
+                "origin": None,
+            },
+            {
+                "kind": "Photo",
+                "url": PHOTO_URL,
+                "parent": None,
+                "origin": POST_URL,
+                "files": [{"url": PHOTO_URL, "path": "full/abc.jpg"}],
+            },
+            {
+                "kind": "BlogPost",
+                "url": "https://www.drive2.ru/l/2/",
+                "title": "Draft",
+                "published": None,
+                "parent": None,
+                "origin": None,
+            },
+        ]
+    )
+    return Archive(storage)
+
+
+def test_export(tmp_path):
+    exporter = DayOneExporter(
+        make_archive(tmp_path), files_store=str(tmp_path / "images")
+    )
+    assert exporter.export(str(tmp_path / "dayone.zip")) == 1
+    assert exporter.skipped == 1
+
+    with zipfile.ZipFile(tmp_path / "dayone.zip") as archive:
+        journal = json.loads(archive.read("Journal.json"))
+        photo_names = [n for n in archive.namelist() if n.startswith("photos/")]
+    (entry,) = journal["entries"]
+    assert entry["creationDate"] == "2023-05-01T07:00:00Z"
+    assert entry["tags"] == ["Repair"]
+    assert entry["text"].startswith("# Oil change\n\nFirst\n\nSecond")
+    (photo,) = entry["photos"]
+    assert photo_names == [f"photos/{photo['md5']}.jpeg"]
+    assert f"dayone-moment://{photo['identifier']}" in entry["text"]
@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import io
+import json
+import os
+
+import pytest
+from scrapy import Request
+from scrapy.settings import Settings
+from twisted.internet import defer
+from twisted.python.failure import Failure
+from twisted.web import resource, server
+from twisted.web.client import ResponseDone, ResponseFailed
+
+from r2d2.scrapmetal.downloads import (
+    META_KEY_DOWNLOAD,
+    META_KEY_DOWNLOAD_PATH,
+    ByteBudget,
+    FileWriter,
+    StreamingDownloadHandler,
+    parse_content_range,
+)
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 100-199/200") == (100, 200)
+    assert parse_content_range("bytes 100-199/*") == (100, None)
+    assert parse_content_range("bytes */200") is None
+    assert parse_content_range(None) is None
+
+
+def test_byte_budget_grants_in_order():
+    budget = ByteBudget(100)
+    first = budget.acquire(60)
+    second = budget.acquire(60)
+    third = budget.acquire(10)
+    assert first.called
+    # The third one fits, but waits for the second.
+    assert not second.called and not third.called
+    budget.release(60)
+    assert second.called and third.called
+    assert budget.used == 70
+    budget.release(60)
+    budget.release(10)
+    # A download larger than the budget runs alone.
+    assert budget.acquire(500).called
+    assert not budget.acquire(1).called
+
+
+def test_file_writer_hashes_and_counts():
+    finished = defer.Deferred()
+    file = io.BytesIO()
+    digest = hashlib.sha256()
+    writer = FileWriter(file, finished, (digest,))
+    writer.dataReceived(b"jpeg ")
+    writer.dataReceived(b"data")
+    writer.connectionLost(Failure(ResponseDone()))
+    assert file.getvalue() == b"jpeg data"
+    assert digest.hexdigest() == hashlib.sha256(b"jpeg data").hexdigest()
+    assert finished.result == 9
+
+
+def test_file_writer_fails_on_broken_body():
+    finished = defer.Deferred()
+    failures = []
+    finished.addErrback(failures.append)
+    writer = FileWriter(None, finished)
+    writer.dataReceived(b"jpeg")
+    writer.connectionLost(Failure(ResponseFailed([Failure(ConnectionError())])))
+    assert failures[0].check(ResponseFailed)
+
+
+def test_byte_budget_wait_can_be_cancelled():
+    budget = ByteBudget(100)
+    budget.acquire(100)
+    waiting = budget.acquire(10)
+    waiting.addErrback(lambda failure: failure.trap(defer.CancelledError))
+    waiting.cancel()
+    assert not budget.waiting
+    budget.release(100)
+    assert budget.used == 0
+
+
+PHOTO = os.urandom(50_000)
+
+
+class PhotoResource(resource.Resource):
+    """A photo which supports `Range`/`If-Range` and can be cut short."""
+
+    isLeaf = True
+
+    def __init__(self, body, etag='"v1"'):
+        super().__init__()
+        self.body = body
+        self.etag = etag
+        self.cut = None
+        self.total = len(body)
+        self.content_md5 = base64.b64encode(hashlib.md5(body).digest())
+        self.ranges = []
+
+    def render_GET(self, request):
+        request.setHeader(b"ETag", self.etag.encode())
+        request.setHeader(b"Content-MD5", self.content_md5)
+        first = 0
+        byte_range = request.getHeader(b"Range")
+        self.ranges.append(byte_range)
+        if byte_range and request.getHeader(b"If-Range") == self.etag.encode():
+            first = int(byte_range.decode()[len("bytes=") : -1])
+            if first >= len(self.body):
+                request.setResponseCode(416)
+                return b""
+            request.setResponseCode(206)
+            request.setHeader(
+                b"Content-Range",
+                f"bytes {first}-{len(self.body) - 1}/{self.total}".encode(),
+            )
+        body = self.body[first:]
+        request.setHeader(b"Content-Length", str(len(body)).encode())
+        if self.cut is None:
+            return body
+        # Send a part of the body and drop the connection.
+        request.write(body[: self.cut])
+        self.cut = None
+        request.channel.transport.loseConnection()
+        return server.NOT_DONE_YET
+
+
+@pytest.fixture
+def photo_server(wait):
+    from twisted.internet import reactor
+
+    photo = PhotoResource(PHOTO)
+    port = reactor.listenTCP(0, server.Site(photo), interface="127.0.0.1")
+    handler = StreamingDownloadHandler(Settings())
+    url = f"http://127.0.0.1:{port.getHost().port}/photo.jpg"
+    yield photo, handler, url, wait
+    wait(handler.close())
+    wait(defer.maybeDeferred(port.stopListening))
+
+
+def download(handler, url, path, wait):
+    request = Request(url, meta={META_KEY_DOWNLOAD_PATH: path, "download_timeout": 5})
+    response = wait(handler.download_request(request, None))
+    return request, response
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_cut_download_is_resumed(photo_server, tmp_path):
+    photo, handler, url, wait = photo_server
+    path = str(tmp_path / "photo.part")
+    photo.cut = 20_000
+    with pytest.raises(ResponseFailed):
+        download(handler, url, path, wait)
+    assert os.path.getsize(path) == 20_000
+
+    request, response = download(handler, url, path, wait)
+    assert photo.ranges == [None, b"bytes=20000-"]
+    assert response.status == 200
+    assert response.flags == ["streamed", "resumed"]
+    assert read(path) == PHOTO
+    result = request.meta[META_KEY_DOWNLOAD]
+    assert result["size"] == len(PHOTO)
+    assert result["received"] == len(PHOTO) - 20_000
+    assert result["sha256"] == hashlib.sha256(PHOTO).hexdigest()
+    assert not os.path.exists(path + ".json")
+
+
+def test_changed_photo_replaces_partial_file(photo_server, tmp_path):
+    photo, handler, url, wait = photo_server
+    path = str(tmp_path / "photo.part")
+    with open(path, "wb") as f:
+        f.write(b"stale")
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump({"validator": '"v0"', "content_md5": None}, f)
+
+    request, response = download(handler, url, path, wait)
+    # The server ignores the range of another version and sends it all.
+    assert photo.ranges == [b"bytes=5-"]
+    assert response.flags == ["streamed"]
+    assert read(path) == PHOTO
+    assert request.meta[META_KEY_DOWNLOAD]["received"] == len(PHOTO)
+
+
+def test_partial_file_out_of_range_is_discarded(photo_server, tmp_path):
+    photo, handler, url, wait = photo_server
+    path = str(tmp_path / "photo.part")
+    with open(path, "wb") as f:
+        f.write(PHOTO + b"extra")
+    with open(path + ".json", "w", encoding="utf-8") as f:
+        json.dump({"validator": '"v1"', "content_md5": None}, f)
+
+    _, response = download(handler, url, path, wait)
+    assert photo.ranges == [f"bytes={len(PHOTO) + 5}-".encode()]
+    assert response.status == 416
+    assert not os.path.exists(path)
+    assert not os.path.exists(path + ".json")
+
+
+def test_corrupt_download_is_discarded(photo_server, tmp_path):
+    photo, handler, url, wait = photo_server
+    path = str(tmp_path / "photo.part")
+    photo.content_md5 = base64.b64encode(hashlib.md5(b"other").digest())
+    with pytest.raises(ResponseFailed):
+        download(handler, url, path, wait)
+    assert not os.path.exists(path)
+
+
+def test_short_download_is_kept_for_resuming(photo_server, tmp_path):
+    photo, handler, url, wait = photo_server
+    path = str(tmp_path / "photo.part")
+    photo.cut = 20_000
+    with pytest.raises(ResponseFailed):
+        download(handler, url, path, wait)
+    photo.total = len(PHOTO) + 10
+    with pytest.raises(ResponseFailed):
+        download(handler, url, path, wait)
+    assert read(path) == PHOTO
+    assert os.path.exists(path + ".json")
@@ -0,0 +1,75 @@
+import datetime
+import gzip
+import json
+
+import pytest
+
+from r2d2.archive import Archive
+from r2d2.exporters.ndjson import NdjsonExporter
+from r2d2.scrapmetal import items
+from r2d2.scrapmetal.storage import open_storage
+
+MSK = datetime.timezone(datetime.timedelta(hours=3))
+
+
+def make_archive(tmp_path, posts=50):
+    storage = open_storage(str(tmp_path / "archive.sqlite"))
+    storage.put_many(
+        items.BlogPost(
+            f"https://www.drive2.ru/l/{n}/",
+            title=f"Пост {n}",
+            published=datetime.datetime(2023, 5, 1, 12, tzinfo=MSK),
+            content=f"<p>{'текст ' * n}</p>",
+            tag="Ремонт",
+        )
+        for n in range(posts)
+    )
+    storage.put_many([items.Photo("https://a.d-cd.net/1.jpg", origin="/l/1/")])
+    return Archive(storage)
+
+
+def test_ndjson_is_split_into_files(tmp_path):
+    archive = make_archive(tmp_path)
+    exporter = NdjsonExporter(archive, max_bytes=1000)
+    assert exporter.export(str(tmp_path / "out"), kinds=["BlogPost"]) == 50
+    assert len(exporter.paths) > 1
+    lines = []
+    for path in exporter.paths:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            lines.extend(json.loads(line) for line in f)
+    assert [line["url"] for line in lines] == [
+        f"https://www.drive2.ru/l/{n}/" for n in range(50)
+    ]
+    assert lines[0]["published"] == "2023-05-01T12:00:00+03:00"
+
+
+def test_ndjson_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    exporter = NdjsonExporter(make_archive(tmp_path, posts=3), compression="zstd")
+    exporter.export(str(tmp_path / "out"))
+    (path,) = exporter.paths
+    assert path.endswith("items-00000.ndjson.zst")
+    with open(path, "rb") as f:
+        data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    assert len(data.splitlines()) == 4
+
+
+def test_parquet_metadata_refers_to_content(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    from r2d2.exporters.columnar import ColumnarExporter
+
+    exporter = ColumnarExporter(make_archive(tmp_path, posts=5), batch_size=2)
+    assert exporter.export(str(tmp_path / "out")) == 6
+    table = parquet.read_table(
+        tmp_path / "out" / "metadata.parquet", columns=["url", "published", "tag"]
+    )
+    assert table.num_rows == 6
+    rows = parquet.read_table(tmp_path / "out" / "metadata.parquet").to_pylist()
+    assert rows[0]["published"] == datetime.datetime(
+        2023, 5, 1, 9, tzinfo=datetime.timezone.utc
+    )
+    assert rows[-1]["kind"] == "Photo" and rows[-1]["content_offset"] is None
+    blob = (tmp_path / "out" / "content.bin").read_bytes()
+    row = rows[3]
+    html = blob[row["content_offset"] : row["content_offset"] + row["content_length"]]
+    assert html.decode("utf-8") == f"<p>{'текст ' * 3}</p>"
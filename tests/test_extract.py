@@ -0,0 +1,61 @@
+import pytest
+from scrapy.http import HtmlResponse
+
+from r2d2.scrapmetal.extract import Field, Repeated, Spec
+
+PAGE = """<html><head>
+<meta property="article:published_time" content="2021-05-25T10:00:00+03:00">
+</head><body>
+<h1 class="x-title">  Новые колодки </h1>
+<div itemprop="articleBody"><p>Текст <b>поста</b></p></div>
+<div class="c-post__pic"><img src="https://a.d-cd.net/1.jpg"></div>
+<div class="c-post__pic"><img src="https://a.d-cd.net/2.jpg"></div>
+</body></html>"""
+
+
+def test_spec_extracts_like_selectors():
+    response = HtmlResponse("https://www.drive2.ru/l/1/", body=PAGE, encoding="utf-8")
+    spec = Spec(
+        title=Field(css="h1.x-title::text", strip=True),
+        published=Field(xpath="//meta[@property='article:published_time']/@content"),
+        content=Field(xpath="//div[@itemprop='articleBody']"),
+        images=Field(css="div.c-post__pic img::attr('src')", many=True),
+        tag=Field(css="span.c-post-meta__item a.c-link::text"),
+    )
+    fields = spec.extract(response)
+    assert fields == {
+        "title": "Новые колодки",
+        "published": "2021-05-25T10:00:00+03:00",
+        "content": response.xpath("//div[@itemprop='articleBody']").get(),
+        "images": ["https://a.d-cd.net/1.jpg", "https://a.d-cd.net/2.jpg"],
+        "tag": None,
+    }
+    assert type(fields["images"][0]) is str
+
+
+def test_field_needs_one_query():
+    with pytest.raises(ValueError):
+        Field()
+    with pytest.raises(ValueError):
+        Field(css="h1", xpath="//h1")
+
+
+def test_repeated_fields_are_relative_to_elements():
+    response = HtmlResponse(
+        "https://www.drive2.ru/s/a/A1/",
+        body="""<html><body>
+        <div class="card"><a href="/s/1/">One</a></div>
+        <div class="card"><a href="/s/2/"></a></div>
+        </body></html>""",
+        encoding="utf-8",
+    )
+    spec = Spec(
+        cards=Repeated(
+            css="div.card",
+            link=Field(css="a::attr(href)"),
+            text=Field(xpath="./a/text()"),
+        )
+    )
+    assert spec.extract(response) == {
+        "cards": [{"link": "/s/1/", "text": "One"}, {"link": "/s/2/", "text": None}]
+    }
@@ -0,0 +1,133 @@
+import hashlib
+import os
+
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.downloads import (
+    META_KEY_DOWNLOAD,
+    META_KEY_DOWNLOAD_PATH,
+)
+from r2d2.scrapmetal.files import (
+    DedupFilesPipeline,
+    DownloadGate,
+    UrlIndex,
+)
+
+
+def make_pipeline(tmp_path):
+    crawler = get_crawler(settings_dict={"FILES_STORE": str(tmp_path)})
+    pipeline = DedupFilesPipeline.from_crawler(crawler)
+    pipeline.open_spider(crawler._create_spider("d2rnd"))
+    return pipeline, crawler.stats
+
+
+def download(pipeline, url, body):
+    request = Request(url)
+    response = Response(url, body=body, request=request)
+    return pipeline.media_downloaded(response, request, pipeline.spiderinfo)
+
+
+def test_index_survives_restart(tmp_path):
+    index = UrlIndex(str(tmp_path), cache_size=1)
+    index.add("https://a.d-cd.net/1.jpg", {"path": "objects/1.jpg"})
+    index.add("https://a.d-cd.net/2.jpg", {"path": "objects/2.jpg"})
+    assert len(index.cache) == 1
+    assert UrlIndex(str(tmp_path)).get("https://a.d-cd.net/1.jpg") == {
+        "path": "objects/1.jpg"
+    }
+    assert index.get("https://a.d-cd.net/3.jpg") is None
+
+
+def test_same_content_is_stored_once(tmp_path):
+    pipeline, stats = make_pipeline(tmp_path)
+    first = download(pipeline, "https://a.d-cd.net/a.jpg", b"jpeg data")
+    second = download(pipeline, "https://a.d-cd.net/b.jpg", b"jpeg data")
+    assert first["path"] == second["path"]
+    assert first["path"].startswith("objects/")
+    assert first["path"].endswith(".jpg")
+    assert stats.get_value("scrapmetal/files/duplicate_content") == 1
+    assert stats.get_value("scrapmetal/files/bytes_saved") == len(b"jpeg data")
+
+
+def test_known_url_is_not_downloaded_again(tmp_path):
+    pipeline, _ = make_pipeline(tmp_path)
+    stored = download(pipeline, "https://a.d-cd.net/a.jpg", b"jpeg data")
+
+    pipeline, stats = make_pipeline(tmp_path)
+    request = Request("https://a.d-cd.net/a.jpg")
+    result = pipeline.media_to_download(request, pipeline.spiderinfo)
+    assert result["status"] == "uptodate"
+    assert result["path"] == stored["path"]
+    assert result["checksum"] == stored["checksum"]
+    assert stats.get_value("scrapmetal/files/downloads_avoided") == 1
+    assert pipeline.file_path(request) == stored["path"]
+    unknown = Request("https://a.d-cd.net/new.jpg")
+    assert pipeline.media_to_download(unknown, pipeline.spiderinfo) is None
+
+
+def test_streamed_download_is_moved_into_place(tmp_path):
+    pipeline, stats = make_pipeline(tmp_path)
+    url = "https://a.d-cd.net/a.jpg"
+    (request,) = pipeline.get_media_requests({"file_urls": [url]}, None)
+    partial = request.meta[META_KEY_DOWNLOAD_PATH]
+    assert partial.startswith(str(tmp_path / "partial"))
+
+    def stream(body):
+        os.makedirs(os.path.dirname(partial), exist_ok=True)
+        with open(partial, "wb") as f:
+            f.write(body)
+        # The handler has downloaded a retry of the request.
+        downloaded = request.copy()
+        downloaded.meta[META_KEY_DOWNLOAD] = {
+            "path": partial,
+            "size": len(body),
+            "received": len(body),
+            "sha256": hashlib.sha256(body).hexdigest(),
+            "md5": hashlib.md5(body).hexdigest(),
+        }
+        response = Response(url, flags=["streamed"], request=downloaded)
+        return pipeline.media_downloaded(response, request, pipeline.spiderinfo)
+
+    result = stream(b"jpeg data")
+    assert result["status"] == "downloaded"
+    assert result["checksum"] == hashlib.md5(b"jpeg data").hexdigest()
+    assert (tmp_path / result["path"]).read_bytes() == b"jpeg data"
+    assert not os.path.exists(partial)
+    # The same path as for a body in memory.
+    in_memory = download(pipeline, "https://a.d-cd.net/b.jpg", b"jpeg data")
+    assert in_memory["path"] == result["path"]
+    assert stream(b"jpeg data") == result
+    assert stats.get_value("scrapmetal/files/duplicate_content") == 2
+    assert not os.path.exists(partial)
+
+
+def test_photos_get_the_priority_of_photos(tmp_path):
+    crawler = get_crawler(
+        settings_dict={
+            "FILES_STORE": str(tmp_path),
+            "SCRAPMETAL_KIND_PRIORITIES": {"BlogPost": 20, "Photo": -10},
+        }
+    )
+    pipeline = DedupFilesPipeline.from_crawler(crawler)
+    item = {
+        "file_urls": ["https://a.d-cd.net/a.jpg"],
+        "origin": "https://www.drive2.ru/l/1/",
+    }
+    (request,) = pipeline.get_media_requests(item, None)
+    assert request.priority == -10
+
+
+def test_download_gate_lets_in_in_order():
+    gate = DownloadGate(2)
+    order = []
+    for name in ("first", "second", "third", "fourth"):
+        gate.acquire().addCallback(lambda _, name=name: order.append(name))
+    assert order == ["first", "second"]
+    gate.release()
+    assert order == ["first", "second", "third"]
+    gate.release()
+    gate.release()
+    assert order == ["first", "second", "third", "fourth"]
+    assert gate.active == 1
+    assert not gate.waiting
@@ -0,0 +1,164 @@
+import asyncio
+
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.frontier import (
+    FingerprintDupeFilter,
+    FrontierQueue,
+    FrontierScheduler,
+    UserRoundRobinQueue,
+)
+from r2d2.scrapmetal.pipelines import ScrapmetalPipeline
+from r2d2.scrapmetal.spiders.d2_spider import D2ExperimentalSpider
+from r2d2.scrapmetal.storage import open_storage
+
+ORIGIN = "https://www.drive2.ru/r/a/b/1/logbook/"
+
+
+def make_spider():
+    return D2ExperimentalSpider.from_crawler(get_crawler(D2ExperimentalSpider))
+
+
+def test_queue_survives_restart(tmp_path):
+    spider = make_spider()
+    key = str(tmp_path / "0")
+    queue = FrontierQueue(spider, key + ".sqlite")
+    queue.push(
+        Request(
+            "https://www.drive2.ru/l/1/",
+            callback=spider.parse_blog_post,
+            meta={"scrapmetal_origin": ORIGIN, "depth": 2},
+        )
+    )
+    queue.push(
+        Request(
+            "https://www.drive2.ru/l/2/",
+            callback=spider.parse_blog_post,
+            meta={"retry_times": 1},
+        )
+    )
+    queue.close()
+
+    queue = FrontierQueue(spider, key + ".sqlite")
+    assert len(queue) == 2
+    retried = queue.pop()
+    assert retried.url == "https://www.drive2.ru/l/2/"
+    assert retried.meta["retry_times"] == 1
+    post = queue.pop()
+    assert post.callback == spider.parse_blog_post
+    assert post.meta == {"scrapmetal_origin": ORIGIN}
+    assert queue.pop() is None
+    queue.close()
+    assert not (tmp_path / "0.sqlite").exists()
+
+
+def test_queue_restores_priority(tmp_path):
+    spider = make_spider()
+    # ScrapyPriorityQueue names queues by negated priorities.
+    queue = FrontierQueue(spider, str(tmp_path / "-20.sqlite"))
+    queue.push(
+        Request(
+            "https://www.drive2.ru/l/1/", callback=spider.parse_blog_post, priority=20
+        )
+    )
+    assert queue.pop().priority == 20
+    queue.close()
+
+
+def test_scheduler_finds_queues_without_state(tmp_path):
+    (tmp_path / "default").mkdir()
+    (tmp_path / "default" / "0.sqlite").touch()
+    (tmp_path / "default" / "-10.sqlite").touch()
+    (tmp_path / "default" / "0.sqlite-wal").touch()
+    (tmp_path / "active.json").write_text('{"amazing-1a2b3c4d": [0]}')
+    scheduler = FrontierScheduler.__new__(FrontierScheduler)
+    assert scheduler._read_dqs_state(str(tmp_path)) == {
+        "default": [-10, 0],
+        "amazing-1a2b3c4d": [0],
+    }
+
+
+def test_dupefilter_survives_restart(tmp_path):
+    crawler = get_crawler(settings_dict={"JOBDIR": str(tmp_path)})
+    dupefilter = FingerprintDupeFilter.from_crawler(crawler)
+    dupefilter.cache_size = 1
+    assert not dupefilter.request_seen(Request("https://www.drive2.ru/l/1/"))
+    assert not dupefilter.request_seen(Request("https://www.drive2.ru/l/2/"))
+    assert len(dupefilter.recent) == 1
+    assert dupefilter.request_seen(Request("https://www.drive2.ru/l/1/"))
+    dupefilter.close("shutdown")
+
+    dupefilter = FingerprintDupeFilter.from_crawler(crawler)
+    assert dupefilter.request_seen(Request("https://www.drive2.ru/l/2/"))
+    assert not dupefilter.request_seen(Request("https://www.drive2.ru/l/3/"))
+    dupefilter.close("finished")
+
+
+def run_pipeline(pipeline, spider, items):
+    async def run():
+        pipeline.open_spider(spider)
+        for item in items:
+            await pipeline.process_item(item, spider)
+        await pipeline.close_buffers()
+
+    asyncio.run(run())
+
+
+def test_resumed_job_reopens_export(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jobdir = tmp_path / "job"
+    jobdir.mkdir()
+    spider = make_spider()
+
+    pipeline = ScrapmetalPipeline(jobdir=str(jobdir))
+    run_pipeline(
+        pipeline, spider, [{"kind": "BlogPost", "url": "https://www.drive2.ru/l/1/"}]
+    )
+    export = pipeline.export_path()
+
+    pipeline = ScrapmetalPipeline(jobdir=str(jobdir))
+    run_pipeline(
+        pipeline, spider, [{"kind": "BlogPost", "url": "https://www.drive2.ru/l/2/"}]
+    )
+
+    assert pipeline.export_path() == export
+    assert len(list(tmp_path.glob("d2_export_*"))) == 1
+    storage = open_storage(export)
+    assert set(storage.urls()) == {
+        "https://www.drive2.ru/l/1/",
+        "https://www.drive2.ru/l/2/",
+    }
+    storage.close()
+
+
+def test_users_take_turns(tmp_path):
+    crawler = get_crawler(D2ExperimentalSpider)
+    crawler.spider = D2ExperimentalSpider.from_crawler(crawler)
+    queue = UserRoundRobinQueue(crawler, FrontierQueue, str(tmp_path))
+    for user, count in (("amazing", 3), ("c3po", 1), ("r2d2", 2)):
+        for n in range(count):
+            queue.push(
+                Request(
+                    f"https://www.drive2.ru/l/{user}{n}/",
+                    meta={"scrapmetal_user": user},
+                )
+            )
+    assert len(queue) == 6
+    users = [queue.pop().meta["scrapmetal_user"] for _ in range(6)]
+    assert users == ["amazing", "c3po", "r2d2", "amazing", "r2d2", "amazing"]
+    assert queue.pop() is None
+    assert queue.close() == {}
+
+
+def test_batch_exports_per_user(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    spider = make_spider()
+    spider.batch = "users.txt"
+    items = [
+        {"kind": "BlogPost", "url": f"https://www.drive2.ru/l/{user}/", "user": user}
+        for user in ("amazing", "c3po", "amazing")
+    ]
+    run_pipeline(ScrapmetalPipeline(), spider, items)
+    assert len(list(tmp_path.glob("d2_export_*_amazing-*.sqlite"))) == 1
+    assert len(list(tmp_path.glob("d2_export_*_c3po-*.sqlite"))) == 1
@@ -0,0 +1,132 @@
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.httpcache import ResponseCache
+from r2d2.scrapmetal.middlewares import ScrapmetalDownloaderMiddleware
+from r2d2.scrapmetal.spiders.d2_spider import D2ExperimentalSpider
+
+
+def test_store_and_revalidate(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), clock=clock)
+    assert cache.get("https://www.drive2.ru/l/1/") is None
+
+    body = b"<html>" + b"x" * 10000 + b"</html>"
+    cache.store(
+        "https://www.drive2.ru/l/1/",
+        200,
+        {"ETag": ['"abc"'], "Content-Type": ["text/html"]},
+        body,
+    )
+    entry = cache.get("https://www.drive2.ru/l/1/")
+    assert entry.body == body
+    assert entry.etag == '"abc"'
+    assert entry.last_modified is None
+    assert cache.is_fresh(entry, ttl=60)
+    assert cache.is_fresh(entry, ttl=None)
+
+    clock.now += 60
+    assert not cache.is_fresh(entry, ttl=60)
+    cache.touch("https://www.drive2.ru/l/1/")
+    assert cache.is_fresh(cache.get("https://www.drive2.ru/l/1/"), ttl=60)
+    cache.close()
+
+
+POST_URL = "https://www.drive2.ru/l/1/"
+LOGBOOK_URL = "https://www.drive2.ru/r/a/b/1/logbook/"
+BODY = b"<html>" + b"x" * 1000 + b"</html>"
+
+
+def make_middleware(tmp_path):
+    crawler = get_crawler(
+        D2ExperimentalSpider,
+        settings_dict={
+            "SCRAPMETAL_HTTPCACHE_ENABLED": True,
+            "SCRAPMETAL_HTTPCACHE_PATH": str(tmp_path / "cache.sqlite"),
+            "SCRAPMETAL_HTTPCACHE_TTL": {"parse_logbook": 0, "parse_blog_post": None},
+        },
+    )
+    spider = D2ExperimentalSpider.from_crawler(crawler, username="r2d2")
+    crawler.stats.open_spider(spider)
+    middleware = ScrapmetalDownloaderMiddleware.from_crawler(crawler)
+    return middleware, spider, crawler.stats
+
+
+def fetch(middleware, spider, request, response):
+    """Pass a request through the middleware, `response` is the site's."""
+    cached = middleware.process_request(request, spider)
+    if cached is not None:
+        return cached
+    return middleware.process_response(request, response, spider)
+
+
+def site_response(request, status=200, body=BODY):
+    headers = {
+        "Content-Type": "text/html; charset=utf-8",
+        "ETag": '"v1"',
+        "Last-Modified": "Mon, 01 May 2023 10:00:00 GMT",
+    }
+    return HtmlResponse(
+        request.url, status=status, headers=headers, body=body, request=request
+    )
+
+
+def test_pages_which_never_change_are_served_from_cache(tmp_path):
+    middleware, spider, stats = make_middleware(tmp_path)
+    request = Request(POST_URL, callback=spider.parse_blog_post)
+    response = fetch(middleware, spider, request, site_response(request))
+    assert "cached" not in response.flags
+    assert stats.get_value("scrapmetal/httpcache/miss") == 1
+    assert stats.get_value("scrapmetal/httpcache/stored") == 1
+
+    request = Request(POST_URL, callback=spider.parse_blog_post)
+    response = middleware.process_request(request, spider)
+    assert response.flags == ["cached"]
+    assert response.body == BODY
+    assert isinstance(response, HtmlResponse)
+    assert stats.get_value("scrapmetal/httpcache/hit") == 1
+    assert stats.get_value("scrapmetal/httpcache/bytes_saved") == len(BODY)
+    # A cached response isn't stored again.
+    assert middleware.process_response(request, response, spider) is response
+    assert stats.get_value("scrapmetal/httpcache/stored") == 1
+    middleware.spider_closed(spider)
+
+
+def test_stale_pages_are_revalidated(tmp_path):
+    middleware, spider, stats = make_middleware(tmp_path)
+    request = Request(LOGBOOK_URL, callback=spider.parse_logbook)
+    fetch(middleware, spider, request, site_response(request))
+
+    # TTL 0: the page is requested again, conditionally.
+    request = Request(LOGBOOK_URL, callback=spider.parse_logbook)
+    assert middleware.process_request(request, spider) is None
+    assert request.headers["If-None-Match"] == b'"v1"'
+    assert request.headers["If-Modified-Since"] == b"Mon, 01 May 2023 10:00:00 GMT"
+    not_modified = site_response(request, status=304, body=b"")
+    response = middleware.process_response(request, not_modified, spider)
+    assert response.status == 200
+    assert response.body == BODY
+    assert response.flags == ["cached", "revalidated"]
+    assert stats.get_value("scrapmetal/httpcache/revalidated") == 1
+    assert stats.get_value("scrapmetal/httpcache/bytes_saved") == len(BODY)
+    assert stats.get_value("scrapmetal/httpcache/hit") is None
+
+    # A changed page replaces the cached one.
+    request = Request(LOGBOOK_URL, callback=spider.parse_logbook)
+    middleware.process_request(request, spider)
+    changed = site_response(request, body=b"<html>new</html>")
+    assert middleware.process_response(request, changed, spider) is changed
+    assert middleware.cache.get(LOGBOOK_URL).body == b"<html>new</html>"
+    assert stats.get_value("scrapmetal/httpcache/stored") == 2
+    middleware.spider_closed(spider)
+
+
+def test_pages_of_unlisted_callbacks_are_not_cached(tmp_path):
+    middleware, spider, stats = make_middleware(tmp_path)
+    for _ in range(2):
+        request = Request(POST_URL, callback=spider.parse_photo_post)
+        response = fetch(middleware, spider, request, site_response(request))
+        assert "cached" not in response.flags
+        assert b"If-None-Match" not in request.headers
+    assert middleware.cache.get(POST_URL) is None
+    assert stats.get_stats() == {}
+    middleware.spider_closed(spider)
@@ -0,0 +1,56 @@
+import datetime
+import json
+import sqlite3
+
+from r2d2.scrapmetal import items
+from r2d2.scrapmetal.storage import SQLiteStorage
+
+
+def test_items_have_no_dict():
+    post = items.BlogPost(url="https://www.drive2.ru/l/1/", title="Oil change")
+    assert not hasattr(post, "__dict__")
+    assert post.kind == "BlogPost"
+    assert items.Photo(url="https://a.d-cd.net/1.jpg").files == []
+
+
+def test_codec_roundtrip():
+    post = items.BlogPost(
+        url="https://www.drive2.ru/l/1/",
+        title="Замена масла",
+        published=items.parse_datetime("2023-05-01T10:00:00+03:00"),
+        content="<p>Текст</p>",
+        user="amazing",
+    )
+    data = items.encode_item(post)
+    assert json.loads(data)[0] == "BlogPost"
+    assert "Замена" in data
+    assert items.decode_item(data) == post
+
+
+def test_decode_shorter_array():
+    # Fields added after the item was stored get their defaults.
+    photo = items.decode_item('["Photo","https://a.d-cd.net/1.jpg",null,null]')
+    assert photo == items.Photo(url="https://a.d-cd.net/1.jpg")
+
+
+def test_storage_reads_dict_items(tmp_path):
+    path = str(tmp_path / "old.sqlite")
+    SQLiteStorage(path).close()
+    legacy = {
+        "kind": "Car",
+        "url": "https://www.drive2.ru/r/lada/2107/1/",
+        "title": "Lada 2107",
+        "published": "2015-06-01T00:00:00Z",
+        "parent": None,
+        "origin": None,
+    }
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "INSERT INTO items (kind, url, data) VALUES (?, ?, ?)",
+            ("Car", legacy["url"], json.dumps(legacy)),
+        )
+    storage = SQLiteStorage(path)
+    (car,) = storage.iter_items(kinds=["Car"])
+    storage.close()
+    assert car.title == "Lada 2107"
+    assert car.published == datetime.datetime(2015, 6, 1, tzinfo=datetime.timezone.utc)
@@ -0,0 +1,53 @@
+from r2d2.markdown import html_to_markdown
+from r2d2.scrapmetal.files import open_index
+from r2d2.scrapmetal.items import BlogPost
+from r2d2.scrapmetal.pipelines import MarkdownPipeline
+
+
+def test_paragraphs_and_inline_markup():
+    html = (
+        "<div itemprop='articleBody'>Intro   with <b>bold</b> and "
+        "<a href='/l/2/'>a link</a>.<p>Second<br>line</p></div>"
+    )
+    assert html_to_markdown(html) == (
+        "Intro with **bold** and [a link](/l/2/).\n\nSecond\nline"
+    )
+
+
+def test_post_pictures_are_resolved():
+    html = (
+        "<p>Before</p><div class='c-post__pic'>"
+        "<a href='https://a.d-cd.net/x.jpg'><img src='https://a.d-cd.net/x-960.jpg'>"
+        "</a></div><p>After</p>"
+    )
+    images = {"https://a.d-cd.net/x-960.jpg": "d2images/full/x.jpg"}
+    assert html_to_markdown(html, resolve_image=images.get) == (
+        "Before\n\n![](d2images/full/x.jpg)\n\nAfter"
+    )
+
+
+def test_pipeline_refers_to_downloaded_pictures(tmp_path):
+    store = str(tmp_path)
+    open_index(store).add("https://a.d-cd.net/x.jpg", {"path": "objects/ab/x.jpg"})
+    pipeline = MarkdownPipeline(files_store=store)
+    post = BlogPost(
+        "https://www.drive2.ru/l/1/",
+        content=(
+            "<div class='c-post__pic'><img src='https://a.d-cd.net/x.jpg'></div>"
+            "<div class='c-post__pic'><img src='https://a.d-cd.net/y.jpg'></div>"
+        ),
+    )
+    assert pipeline.process_item(post, None).markdown_text == (
+        f"![]({store}/objects/ab/x.jpg)\n\n![](https://a.d-cd.net/y.jpg)"
+    )
+
+
+def test_lists():
+    html = "<ol><li>one</li><li>two<ul><li>nested</li></ul></li></ol>"
+    assert html_to_markdown(html) == "1. one\n2. two\n   - nested"
+
+
+def test_escapes_and_skips():
+    html = "<p>2*2 [sic]</p><script>alert(1)</script><!-- note -->"
+    assert html_to_markdown(html) == "2\\*2 \\[sic\\]"
+    assert html_to_markdown(None) == ""
@@ -0,0 +1,74 @@
+from r2d2.scrapmetal.pages import PageArchive
+from r2d2.scrapmetal.reparse import reparse
+from r2d2.scrapmetal.storage import SQLiteStorage, WriteBehindBuffer
+
+POST = """<html><head>
+<meta property="article:published_time" content="2023-05-01T10:00:00+03:00">
+</head><body>
+<h1 class="x-title"> Post {n} </h1>
+<div itemprop="articleBody"><p>Text {n}</p>
+<div class="c-post__pic"><img src="https://a.d-cd.net/{n}.jpg"></div></div>
+</body></html>"""
+
+
+def test_reparse_saved_pages(tmp_path):
+    pages = PageArchive(str(tmp_path / "pages.sqlite"), batch_size=3)
+    for n in range(10):
+        pages.add(
+            url=f"https://www.drive2.ru/l/{n}/",
+            callback="parse_blog_post",
+            meta={"scrapmetal_parent": "https://www.drive2.ru/r/a/b/1/", "depth": 1},
+            encoding="utf-8",
+            body=POST.format(n=n).encode("utf-8"),
+        )
+    pages.flush()
+    assert len(pages) == 10
+
+    storage = SQLiteStorage(str(tmp_path / "out.sqlite"))
+    buffer = WriteBehindBuffer(storage)
+    stats = reparse(pages, buffer, workers=2, chunk_size=3)
+    buffer.flush()
+    assert sum(worker.pages for worker in stats.values()) == 10
+    assert sum(worker.failed for worker in stats.values()) == 0
+
+    posts = list(storage.iter_items(kinds=["BlogPost"]))
+    photos = list(storage.iter_items(kinds=["Photo"]))
+    storage.close()
+    pages.close()
+    assert len(posts) == 10
+    assert len(photos) == 10
+    assert {post.parent for post in posts} == {"https://www.drive2.ru/r/a/b/1/"}
+    assert "Post 3" in {post.title for post in posts}
+
+
+ALBUM = """<html><body>
+<h1 class="x-title">Фотоальбом</h1>
+<div class="c-snaps-preview"><a href="/s/Aa1/"><img src="https://a.d-cd.net/t1-200.jpg"
+  alt=""></a><time datetime="2021-05-25T10:00:00+03:00"></time>
+  <div class="c-snaps-preview__info">
+  <div itemprop="description"><p>Вид сбоку</p></div>
+  <a class="c-lightbox-anchor" href="https://a.d-cd.net/Aa1.jpg"></a></div></div>
+</body></html>"""
+
+
+def test_reparse_album_pages(tmp_path):
+    pages = PageArchive(str(tmp_path / "pages.sqlite"))
+    pages.add(
+        url="https://www.drive2.ru/s/a/A1/",
+        callback="parse_photo_album",
+        meta={"depth": 1},
+        encoding="utf-8",
+        body=ALBUM.encode("utf-8"),
+    )
+    pages.flush()
+
+    storage = SQLiteStorage(str(tmp_path / "out.sqlite"))
+    buffer = WriteBehindBuffer(storage)
+    stats = reparse(pages, buffer, workers=1)
+    buffer.flush()
+    assert sum(worker.failed for worker in stats.values()) == 0
+
+    kinds = [item.kind for item in storage.iter_items()]
+    storage.close()
+    pages.close()
+    assert sorted(kinds) == ["Photo", "PhotoAlbum", "PhotoPost"]
@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+
+from r2d2 import cli
+from r2d2.scrapmetal import items
+from r2d2.scrapmetal.pipelines import SearchIndexPipeline
+from r2d2.scrapmetal.storage import open_storage
+from r2d2.search import SearchIndex, normalize
+
+POSTS = [
+    items.BlogPost(
+        "https://www.drive2.ru/l/1/",
+        title="Замена масла",
+        published=datetime.datetime(2023, 5, 1, 12),
+        content="<p>Залил новое масло в двигатель.</p>",
+        tag="Плановое ТО",
+    ),
+    items.BlogPost(
+        "https://www.drive2.ru/l/2/",
+        title="Зимние колёса",
+        content="<p>Купил резину, масло проверил заодно.</p>",
+        tag="Колёса и шины",
+    ),
+    items.PhotoPost(
+        "https://www.drive2.ru/l/3/",
+        description="<p>Фото &laquo;двигателя&raquo; после мойки</p>",
+    ),
+    items.Photo("https://a.d-cd.net/1.jpg", origin="https://www.drive2.ru/l/3/"),
+]
+
+
+def test_normalize_folds_russian_word_forms():
+    assert normalize("<p>Колёса и КОЛЕСО</p>") == ["колес", "колес"]
+    assert normalize("маслом, масла") == normalize("масло масло")
+    assert normalize("Toyota Corolla 2008") == ["toyota", "corolla", "2008"]
+
+
+def test_search_ranks_title_matches_first(tmp_path):
+    with SearchIndex(str(tmp_path / "search.sqlite")) as index:
+        assert index.put_many(POSTS) == 3
+        hits = index.search("маслом")
+        assert [hit.url for hit in hits] == [
+            "https://www.drive2.ru/l/1/",
+            "https://www.drive2.ru/l/2/",
+        ]
+        assert hits[0].title == "Замена масла"
+        assert hits[0].published == "2023-05-01T12:00:00"
+        # Photo posts have no title, the start of the description is shown.
+        (hit,) = index.search("двигатели", kinds=["PhotoPost"])
+        assert hit.title == "Фото «двигателя» после мойки"
+        assert [hit.url for hit in index.search("колеса шины")] == [
+            "https://www.drive2.ru/l/2/"
+        ]
+        assert index.search("и") == []
+
+
+def test_reindexing_skips_unchanged_items(tmp_path):
+    with SearchIndex(str(tmp_path / "search.sqlite")) as index:
+        index.put_many(POSTS)
+        assert index.put_many(POSTS) == 0
+        changed = items.BlogPost(
+            "https://www.drive2.ru/l/2/", title="Летние колёса", content="<p></p>"
+        )
+        assert index.put_many([changed]) == 1
+        assert len(index) == 3
+        assert index.search("масло")[0].url == "https://www.drive2.ru/l/1/"
+        assert [hit.title for hit in index.search("колеса")] == ["Летние колёса"]
+
+
+def test_cli_indexes_archive_and_searches(tmp_path, capsys):
+    archive = str(tmp_path / "archive.sqlite")
+    storage = open_storage(archive)
+    storage.put_many(POSTS)
+    storage.close()
+    index = str(tmp_path / "search.sqlite")
+    cli.main(["index", archive, "-o", index])
+    assert "Indexed 3 new or changed of 3 items" in capsys.readouterr().out
+    cli.main(["search", "замена масла", "-i", index])
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split("\t")[2] for line in lines] == ["https://www.drive2.ru/l/1/"]
+
+
+def test_pipeline_indexes_items_with_text(tmp_path):
+    path = str(tmp_path / "search.sqlite")
+    pipeline = SearchIndexPipeline(path, flush_items=2)
+    pipeline.open_spider(None)
+
+    async def crawl():
+        for item in POSTS:
+            assert await pipeline.process_item(item, None) is item
+        await pipeline.close_buffer()
+
+    asyncio.run(crawl())
+    with SearchIndex(path) as index:
+        assert len(index) == 3
@@ -0,0 +1,313 @@
+import datetime
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.middlewares import ScrapmetalSpiderMiddleware
+from r2d2.scrapmetal.spiders import d2_spider
+from r2d2.scrapmetal.spiders.d2_spider import (
+    D2ExperimentalSpider,
+    LinkDispatcher,
+)
+
+LISTING = """<html><body>
+<div class="c-post-preview__title"><a class="c-link" href="/l/1/">One</a></div>
+<div class="c-post-preview__title"><a class="c-link" href="/l/2/">Two</a></div>
+<div class="c-post-preview__title"><a class="c-link" href="/l/1/">One</a></div>
+<div class="c-post-preview__title"><a class="c-link" href="/x/3/">Odd</a></div>
+</body></html>"""
+
+
+def make_spider(**kwargs):
+    crawler = get_crawler(D2ExperimentalSpider)
+    spider = D2ExperimentalSpider.from_crawler(crawler, **kwargs)
+    crawler.stats.open_spider(spider)
+    return spider
+
+
+def test_dispatcher_first_pattern_wins():
+    dispatcher = LinkDispatcher(
+        (d2_spider.PATTERN_PHOTO_ALBUM, d2_spider.PATTERN_PHOTO_POST)
+    )
+    assert dispatcher.match("/s/a/CbcAAgLGNiA/") is d2_spider.PATTERN_PHOTO_ALBUM
+    assert dispatcher.match("/s/CbcAAgLGNiA/") is d2_spider.PATTERN_PHOTO_POST
+    assert dispatcher.match("/l/1/") is None
+
+
+def test_follow_known_links_drops_duplicates():
+    spider = make_spider()
+    spider.known_urls = {"https://www.drive2.ru/l/2/"}
+    response = HtmlResponse(
+        "https://www.drive2.ru/r/a/b/1/logbook/", body=LISTING, encoding="utf-8"
+    )
+    links = response.css("a.c-link::attr(href)").getall()
+    requests = list(
+        spider.follow_known_links(links, (d2_spider.PATTERN_CAR_POST,), response)
+    )
+    assert [request.url for request in requests] == ["https://www.drive2.ru/l/1/"]
+    assert requests[0].callback == spider.parse_blog_post
+    assert spider.crawler.stats.get_value("scrapmetal/incremental/skipped") == 1
+    # The next page links to the same post again.
+    assert not list(
+        spider.follow_known_links(links, (d2_spider.PATTERN_CAR_POST,), response)
+    )
+
+
+def test_batch_users_are_passed_on(tmp_path):
+    batch = tmp_path / "users.txt"
+    batch.write_text(
+        "# users to archive\n"
+        "amazing\n"
+        "\n"
+        "https://www.drive2.ru/r/lada/2107/288230376151760000/\n"
+        "c3po https://www.drive2.ru/users/c3po/\n"
+    )
+    spider = make_spider(batch=str(batch))
+    requests = list(spider.start_requests())
+    assert [(r.url, r.meta["scrapmetal_user"]) for r in requests] == [
+        ("https://www.drive2.ru/users/amazing/", "amazing"),
+        (
+            "https://www.drive2.ru/r/lada/2107/288230376151760000/",
+            "https://www.drive2.ru/r/lada/2107/288230376151760000/",
+        ),
+        ("https://www.drive2.ru/users/c3po/", "c3po"),
+    ]
+    assert requests[0].callback == spider.parse_user_profile
+    assert requests[1].callback == spider.parse_car
+
+    response = HtmlResponse(
+        "https://www.drive2.ru/r/a/b/1/logbook/",
+        body=LISTING,
+        encoding="utf-8",
+        request=requests[0],
+    )
+    middleware = ScrapmetalSpiderMiddleware()
+    results = list(
+        middleware.process_spider_output(
+            response, spider.parse_logbook(response), spider
+        )
+    )
+    assert {result.meta["scrapmetal_user"] for result in results[1:]} == {"amazing"}
+    assert results[0].user == "amazing"
+
+
+DATED_LISTING = """<html><body>
+<div class="c-post-preview">
+  <div class="c-post-preview__title"><a class="c-link" href="/l/3/">Three</a></div>
+  <div class="c-post-preview__date">3 февраля 2023</div>
+</div>
+<div class="c-post-preview">
+  <div class="c-post-preview__title"><a class="c-link" href="/l/2/">Two</a></div>
+  <div class="c-post-preview__date">15 января 2023</div>
+</div>
+<div class="c-post-preview">
+  <div class="c-post-preview__title"><a class="c-link" href="/l/1/">One</a></div>
+  <div class="c-post-preview__date">{last}</div>
+</div>
+<a class="c-pager__link" rel="next" href="/r/a/b/1/logbook/?page=2">Next</a>
+</body></html>"""
+
+
+def test_parse_preview_date():
+    today = datetime.date(2023, 5, 10)
+    assert d2_spider.parse_preview_date("25 мая 2021") == datetime.date(2021, 5, 25)
+    assert d2_spider.parse_preview_date(" 1 Января ", today) == datetime.date(
+        2023, 1, 1
+    )
+    assert d2_spider.parse_preview_date("вчера в 12:30", today) == datetime.date(
+        2023, 5, 9
+    )
+    assert d2_spider.parse_preview_date("2023-11-14T22:13:20+00:00") == (
+        datetime.date(2023, 11, 14)
+    )
+    assert d2_spider.parse_preview_date("31 февраля 2023") is None
+    assert d2_spider.parse_preview_date("недавно") is None
+
+
+def crawl_logbook_page(spider, last):
+    url = "https://www.drive2.ru/r/a/b/1/logbook/?page=1"
+    response = HtmlResponse(
+        url,
+        body=DATED_LISTING.format(last=last),
+        encoding="utf-8",
+        request=Request(url, meta={"scrapmetal_origin": url[:-7]}),
+    )
+    return [request.url for request in spider.parse_logbook(response)]
+
+
+def test_date_window_filters_posts_and_pagination():
+    spider = make_spider(since="2023-01-15", until="2023-02-01")
+    # The last card is in the window, older ones may be on the next page.
+    assert crawl_logbook_page(spider, "15 января 2023") == [
+        "https://www.drive2.ru/r/a/b/1/logbook/?page=2",
+        "https://www.drive2.ru/l/2/",
+        "https://www.drive2.ru/l/1/",
+    ]
+    assert spider.crawler.stats.get_value("scrapmetal/window/skipped") == 1
+
+    spider = make_spider(since="2023-01-15")
+    assert crawl_logbook_page(spider, "14 января 2023") == [
+        "https://www.drive2.ru/r/a/b/1/logbook/?page=2",
+        "https://www.drive2.ru/l/3/",
+        "https://www.drive2.ru/l/2/",
+    ]
+
+    # Every card is older than the window: nothing is followed.
+    spider = make_spider(since="2023-03-01")
+    assert crawl_logbook_page(spider, "14 января 2023") == []
+    assert spider.crawler.stats.get_value("scrapmetal/window/stopped") == 1
+
+
+def test_without_date_window_every_post_is_followed():
+    spider = make_spider()
+    assert len(crawl_logbook_page(spider, "1 января 2000")) == 4
+
+
+ALBUM = """<html><body>
+<h1 class="x-title">Фотоальбом</h1>
+<div class="c-snaps-preview"><a href="/s/Aa1/"><img src="https://a.d-cd.net/t1-200.jpg"
+  alt=""></a><time datetime="2021-05-25T10:00:00+03:00"></time>
+  <div class="c-snaps-preview__info">
+  <a class="c-username" href="/users/r2d2/"><span itemprop="name">r2d2</span></a>
+  <div itemprop="description"><p>Вид <b>сбоку</b></p></div>
+  <a class="c-lightbox-anchor" href="https://a.d-cd.net/Aa1.jpg"></a></div></div>
+<div class="c-snaps-preview"><a href="/s/Bb2/"><img src="https://a.d-cd.net/t2-200.jpg"
+  alt=""></a><div class="c-snaps-preview__date">22 мая 2021</div>
+  <div class="c-snaps-preview__info">
+  <a class="c-username" href="/users/r2d2/"><span itemprop="name">r2d2</span></a>
+  <div itemprop="description"><p>Салон</p></div>
+  <a class="c-lightbox-anchor" href="https://a.d-cd.net/Bb2.jpg"></a></div></div>
+<div class="c-snaps-preview"><a href="/s/Cc3/"><img src="https://a.d-cd.net/Cc3-200.jpg"
+  alt="Двигатель"></a><time datetime="2021-05-20T10:00:00+03:00"></time></div>
+<div class="c-snaps-preview"><a href="/s/Dd4/"><img src="https://a.d-cd.net/t4-200.jpg"
+  alt=""></a><time datetime="2021-05-19T10:00:00+03:00"></time>
+  <div class="c-snaps-preview__info">
+  <a class="c-username" href="/users/c3po/"><span itemprop="name">c3po</span></a>
+  <div itemprop="description"><p>Чужое фото</p></div>
+  <a class="c-lightbox-anchor" href="https://a.d-cd.net/Dd4.jpg"></a></div></div>
+</body></html>"""
+
+
+def crawl_album(spider, meta=None):
+    url = "https://www.drive2.ru/s/a/A1/?page=2"
+    response = HtmlResponse(
+        url,
+        body=ALBUM,
+        encoding="utf-8",
+        request=Request(url, meta={"scrapmetal_origin": url[:-7], **(meta or {})}),
+    )
+    return list(spider.parse_photo_album(response))
+
+
+def test_album_photos_are_taken_from_listing():
+    spider = make_spider(username="r2d2")
+    results = crawl_album(spider)
+    post, photo, post2, photo2, request, request2 = results
+    assert (post.kind, post.url) == ("PhotoPost", "https://www.drive2.ru/s/Aa1/")
+    assert post.description == "<p>Вид <b>сбоку</b></p>"
+    assert post.published.isoformat() == "2021-05-25T10:00:00+03:00"
+    assert post.origin == "https://www.drive2.ru/s/a/A1/"
+    assert photo.file_urls == ["https://a.d-cd.net/Aa1.jpg"]
+    assert photo.origin == post.url
+    assert post2.published.isoformat() == "2021-05-22T00:00:00+03:00"
+    assert photo2.url == "https://a.d-cd.net/Bb2.jpg"
+    # A card with a thumbnail only, and a card of another user: their
+    # pages are fetched.
+    assert request.url == "https://www.drive2.ru/s/Cc3/"
+    assert request.callback == spider.parse_photo_post
+    assert request2.url == "https://www.drive2.ru/s/Dd4/"
+    stats = spider.crawler.stats
+    assert stats.get_value("scrapmetal/album/fetches_avoided") == 2
+    assert stats.get_value("scrapmetal/album/fetched") == 2
+    # Cards of the next pages may repeat.
+    assert crawl_album(spider) == []
+
+
+PHOTO = """<html><head>
+<meta property="article:published_time" content="2021-05-19T10:00:00+03:00">
+</head><body>
+<a class="c-username" href="/users/c3po/"><span itemprop="name">c3po</span></a>
+<div itemprop="description"><p>Чужое фото</p></div>
+<a class="c-lightbox-anchor" href="https://a.d-cd.net/Dd4.jpg"></a>
+</body></html>"""
+
+
+def test_batch_crawl_rejects_photos_of_other_users(tmp_path):
+    batch = tmp_path / "users.txt"
+    batch.write_text("r2d2\nc3po\n", encoding="utf-8")
+    spider = make_spider(batch=str(batch))
+    url = "https://www.drive2.ru/s/Dd4/"
+    response = make_response(url, PHOTO, meta={"scrapmetal_user": "r2d2"})
+    assert list(spider.parse_photo_post(response)) == []
+    response = make_response(url, PHOTO, meta={"scrapmetal_user": "c3po"})
+    assert [item.kind for item in spider.parse_photo_post(response)] == [
+        "PhotoPost",
+        "Photo",
+    ]
+    # The card of another user in an album of r2d2 isn't taken either.
+    results = crawl_album(spider, meta={"scrapmetal_user": "r2d2"})
+    requests = [r.url for r in results if isinstance(r, Request)]
+    assert requests == ["https://www.drive2.ru/s/Cc3/", url]
+
+
+def test_full_fidelity_fetches_every_photo_page():
+    spider = make_spider(full_fidelity="1")
+    assert [request.url for request in crawl_album(spider)] == [
+        "https://www.drive2.ru/s/Aa1/",
+        "https://www.drive2.ru/s/Bb2/",
+        "https://www.drive2.ru/s/Cc3/",
+        "https://www.drive2.ru/s/Dd4/",
+    ]
+    assert spider.crawler.stats.get_value("scrapmetal/album/fetches_avoided") is None
+
+
+LOGBOOK = "https://www.drive2.ru/r/a/b/1/logbook/"
+
+
+def make_response(url, body="<html></html>", meta=None):
+    return HtmlResponse(
+        url, body=body, encoding="utf-8", request=Request(url, meta=meta or {})
+    )
+
+
+def test_wrapped_album_links_are_followed():
+    spider = make_spider()
+    url = "https://www.drive2.ru/s/a/A1/"
+    response = make_response(
+        url,
+        """<html><body><div class="c-snaps-preview"><div class="c-snaps-preview__pic">
+        <a href="/s/Ee5/"><img src="https://a.d-cd.net/t5-200.jpg" alt=""></a>
+        </div></div></body></html>""",
+    )
+    requests = [r for r in spider.parse_photo_album(response) if isinstance(r, Request)]
+    assert [request.url for request in requests] == ["https://www.drive2.ru/s/Ee5/"]
+
+
+def test_requests_are_prioritized_by_kind():
+    priorities = {"CarLogbook": 30, "BlogPost": 20, "PhotoPost": 5, "Photo": 1}
+    crawler = get_crawler(
+        D2ExperimentalSpider,
+        settings_dict={"SCRAPMETAL_KIND_PRIORITIES": priorities},
+    )
+    spider = D2ExperimentalSpider.from_crawler(crawler, starter=LOGBOOK)
+    crawler.stats.open_spider(spider)
+    assert [request.priority for request in spider.start_requests()] == [30]
+    response = make_response(LOGBOOK, LISTING)
+    requests = [r for r in spider.parse_logbook(response) if isinstance(r, Request)]
+    assert [request.priority for request in requests] == [20, 20]
+
+
+def test_logbook_completes_when_its_posts_are_parsed():
+    spider = make_spider()
+    stats = spider.crawler.stats
+    list(spider.parse_logbook(make_response(LOGBOOK, LISTING)))
+    meta = {"scrapmetal_origin": LOGBOOK}
+    list(spider.parse_blog_post(make_response("https://www.drive2.ru/l/1/", meta=meta)))
+    assert stats.get_value("scrapmetal/logbooks/complete") is None
+    # A request dropped as a duplicate is never parsed, but counts as done.
+    dropped = Request(
+        "https://www.drive2.ru/l/2/", callback=spider.parse_blog_post, meta=meta
+    )
+    spider.on_request_dropped(dropped, spider)
+    assert stats.get_value("scrapmetal/logbooks/complete") == 1
+    assert stats.get_value("scrapmetal/logbooks/first_complete_seconds") >= 0
@@ -0,0 +1,120 @@
+import asyncio
+import concurrent.futures
+import threading
+
+import pytest
+
+from r2d2.scrapmetal.storage import (
+    AsyncWriteBehindBuffer,
+    SQLiteStorage,
+    WriteBehindBuffer,
+    open_storage,
+)
+
+
+def make_item(url, kind="BlogPost", origin=None):
+    return {"kind": kind, "url": url, "parent": None, "origin": origin}
+
+
+def test_buffer_flushes_by_count(tmp_path, clock):
+    storage = SQLiteStorage(str(tmp_path / "a.sqlite"))
+    buffer = WriteBehindBuffer(storage, max_items=2, max_interval=60, clock=clock)
+    buffer.add(make_item("/l/1/"))
+    assert list(storage.urls()) == []
+    buffer.add(make_item("/l/2/"))
+    assert sorted(storage.urls()) == ["/l/1/", "/l/2/"]
+    assert len(buffer) == 0
+
+
+def test_buffer_flushes_by_time(tmp_path, clock):
+    storage = SQLiteStorage(str(tmp_path / "a.sqlite"))
+    buffer = WriteBehindBuffer(storage, max_items=100, max_interval=5, clock=clock)
+    buffer.add(make_item("/l/1/"))
+    assert list(storage.urls()) == []
+    clock.now += 5
+    buffer.add(make_item("/l/2/"))
+    assert sorted(storage.urls()) == ["/l/1/", "/l/2/"]
+
+
+def test_sqlite_roundtrip(tmp_path):
+    path = str(tmp_path / "a.sqlite")
+    buffer = WriteBehindBuffer(open_storage(path))
+    buffer.add(make_item("/l/1/"))
+    buffer.add(make_item("https://a.d-cd.net/1.jpg", kind="Photo", origin="/l/1/"))
+    buffer.add(make_item("/l/1/"))
+    buffer.close()
+
+    storage = open_storage(path)
+    assert len(list(storage.iter_items())) == 2
+    assert [item.url for item in storage.iter_items(kinds=["Photo"])] == [
+        "https://a.d-cd.net/1.jpg"
+    ]
+    storage.close()
+
+
+def test_shelve_roundtrip(tmp_path):
+    path = str(tmp_path / "a.db")
+    buffer = WriteBehindBuffer(open_storage(path, backend="shelve"))
+    buffer.add(make_item("/l/1/"))
+    buffer.close()
+
+    storage = open_storage(path, backend="shelve")
+    assert list(storage.urls()) == ["/l/1/"]
+    storage.close()
+
+
+class SlowStorage:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.written = []
+        self.closed = False
+        self.release = threading.Event()
+
+    def put_many(self, items):
+        self.release.wait(5)
+        if self.fail:
+            raise OSError("disk is full")
+        self.written.extend(items)
+
+    def close(self):
+        self.closed = True
+
+
+def run_buffer(storage, coroutine, clock):
+    async def run():
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            buffer = AsyncWriteBehindBuffer(
+                storage, executor, max_items=1, max_pending=1, clock=clock
+            )
+            return await coroutine(buffer)
+
+    return asyncio.run(run())
+
+
+def test_async_buffer_waits_for_full_queue(clock):
+    storage = SlowStorage()
+
+    async def add_items(buffer):
+        assert await buffer.add(make_item("/l/1/")) == 0.0
+        assert len(buffer) == 1
+        asyncio.get_running_loop().call_later(0.05, storage.release.set)
+        stalled = await buffer.add(make_item("/l/2/"))
+        await buffer.close()
+        return stalled
+
+    assert run_buffer(storage, add_items, clock) > 0.0
+    assert [item["url"] for item in storage.written] == ["/l/1/", "/l/2/"]
+    assert storage.closed
+
+
+def test_async_buffer_raises_failed_write(clock):
+    storage = SlowStorage(fail=True)
+    storage.release.set()
+
+    async def add_items(buffer):
+        await buffer.add(make_item("/l/1/"))
+        await buffer.close()
+
+    with pytest.raises(OSError):
+        run_buffer(storage, add_items, clock)
+    assert storage.closed
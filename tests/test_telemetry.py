@@ -0,0 +1,100 @@
+import json
+
+from scrapy.http import HtmlResponse, Request
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.middlewares import ScrapmetalSpiderMiddleware
+from r2d2.scrapmetal.pipelines import TimedItemPipelineManager
+from r2d2.scrapmetal.telemetry import (
+    Telemetry,
+    append_jsonl,
+    write_prometheus,
+)
+
+
+def parse_logbook(response):
+    yield {"kind": "CarLogbook", "url": response.url}
+    yield Request("https://www.drive2.ru/l/1/", callback=parse_blog_post)
+    yield Request("https://www.drive2.ru/l/2/", callback=parse_blog_post)
+
+
+def parse_blog_post(response):
+    return ()
+
+
+class TagPipeline:
+    def process_item(self, item, spider):
+        item["tag"] = "test"
+        return item
+
+
+class AsyncTagPipeline:
+    async def process_item(self, item, spider):
+        item["tag"] += "-async"
+        return item
+
+
+def test_snapshot_rates(clock):
+    telemetry = Telemetry(clock=clock)
+    telemetry.items["BlogPost"] += 10
+    clock.now += 5
+    snapshot = telemetry.snapshot()
+    assert snapshot["items"] == 10
+    assert snapshot["items_per_second"] == 2.0
+    telemetry.items["Photo"] += 1
+    clock.now += 1
+    snapshot = telemetry.snapshot()
+    assert snapshot["items"] == 11
+    assert snapshot["items_per_second"] == 1.0
+    assert snapshot["elapsed"] == 6.0
+
+
+def test_spider_output_is_counted(tmp_path):
+    middleware = ScrapmetalSpiderMiddleware()
+    middleware.telemetry = Telemetry()
+    request = Request("https://www.drive2.ru/r/a/b/1/logbook/", callback=parse_logbook)
+    response = HtmlResponse(request.url, body=b"<html></html>", request=request)
+    results = list(
+        middleware.process_spider_output(response, parse_logbook(response), None)
+    )
+    assert len(results) == 3
+
+    snapshot = middleware.telemetry.snapshot()
+    assert snapshot["callbacks"]["parse_logbook"]["count"] == 1
+    assert snapshot["items_by_kind"] == {"CarLogbook": 1}
+    assert snapshot["requests_by_callback"] == {"parse_blog_post": 2}
+
+    jsonl = tmp_path / "telemetry.jsonl"
+    append_jsonl(snapshot, jsonl)
+    append_jsonl(snapshot, jsonl)
+    lines = jsonl.read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])["items"] == 1
+
+    prom = tmp_path / "scrapmetal.prom"
+    write_prometheus(snapshot, prom)
+    text = prom.read_text()
+    assert 'scrapmetal_items_by_kind_total{kind="CarLogbook"} 1' in text
+    assert 'scrapmetal_callback_count_total{callback="parse_logbook"} 1' in text
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_pipelines_are_timed(tmp_path):
+    crawler = get_crawler(
+        settings_dict={
+            "SCRAPMETAL_TELEMETRY_ENABLED": True,
+            "SCRAPMETAL_TELEMETRY_PATH": str(tmp_path / "telemetry.jsonl"),
+            "ITEM_PIPELINES": {
+                "tests.test_telemetry.TagPipeline": 1,
+                "tests.test_telemetry.AsyncTagPipeline": 2,
+            },
+        }
+    )
+    middleware = ScrapmetalSpiderMiddleware.from_crawler(crawler)
+    manager = TimedItemPipelineManager.from_crawler(crawler)
+    results = []
+    manager.process_item({}, None).addCallback(results.append)
+    assert results == [{"tag": "test-async"}]
+    pipelines = middleware.telemetry.snapshot()["pipelines"]
+    assert pipelines["TagPipeline"]["count"] == 1
+    assert pipelines["AsyncTagPipeline"]["count"] == 1
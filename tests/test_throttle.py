@@ -0,0 +1,136 @@
+import time
+import urllib.parse
+
+import scrapy
+from scrapy.crawler import CrawlerRunner
+from twisted.web import resource, server
+
+from r2d2.scrapmetal import settings as project_settings
+from r2d2.scrapmetal.throttle import SlotController, SlotProfile
+
+# The same local server plays both hosts, in different downloader slots.
+PAGE_HOST = "127.0.0.1"
+CDN_HOST = "localhost"
+# Delays of the profiles in settings.py, scaled down for a test.
+SCALE = 0.01
+
+
+def make_controller(**kwargs):
+    profile = {
+        "delay": 1.0,
+        "min_delay": 0.0,
+        "max_delay": 30.0,
+        "concurrency": 2,
+        "max_concurrency": 4,
+        "grow_after": 3,
+    }
+    profile.update(kwargs)
+    return SlotController(SlotProfile(**profile))
+
+
+def test_grows_concurrency_on_success():
+    controller = make_controller()
+    for i in range(6):
+        controller.on_response(latency=0.2, status=200, size=100, now=i)
+    assert controller.concurrency == 4
+    assert controller.delay < 1.0
+    assert controller.responses == 6
+    assert controller.bytes_received == 600
+
+
+def test_backs_off_when_throttled():
+    controller = make_controller(concurrency=4)
+    controller.on_response(latency=0.2, status=429, size=0, now=1, retry_after=5)
+    assert controller.concurrency == 2
+    assert controller.delay == 5
+    assert controller.throttled == 1
+
+
+def test_respects_delay_bounds():
+    controller = make_controller(min_delay=2.0, max_delay=3.0)
+    controller.on_response(latency=0.1, status=200, size=0, now=1)
+    assert controller.delay == 2.0
+    for i in range(5):
+        controller.on_response(latency=0.1, status=503, size=0, now=i + 2)
+    assert controller.delay == 3.0
+    assert controller.concurrency == 1
+
+
+class AnyPage(resource.Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        return b"<html><body>" + request.path + b"</body></html>"
+
+
+class ThrottledSpider(scrapy.Spider):
+    name = "throttled"
+
+    def start_requests(self):
+        for i in range(5):
+            yield scrapy.Request(f"http://{PAGE_HOST}:{self.port}/page/{i}/")
+        for i in range(20):
+            yield scrapy.Request(f"http://{CDN_HOST}:{self.port}/img/{i}.jpg")
+
+    def parse(self, response):
+        host = urllib.parse.urlsplit(response.url).hostname
+        self.received.setdefault(host, []).append(time.monotonic())
+
+
+def scaled_profiles():
+    """Profiles of settings.py for the local hosts, with shorter delays."""
+    hosts = {"www.drive2.ru": PAGE_HOST, "a.d-cd.net": CDN_HOST}
+    return {
+        hosts[host]: {
+            key: value * SCALE if key.endswith("delay") else value
+            for key, value in profile.items()
+        }
+        for host, profile in project_settings.SCRAPMETAL_THROTTLE_SLOTS.items()
+    }
+
+
+def crawl(wait, throttle):
+    from twisted.internet import reactor
+
+    port = reactor.listenTCP(0, server.Site(AnyPage()), interface="127.0.0.1")
+    runner = CrawlerRunner(
+        {
+            "LOG_LEVEL": "WARNING",
+            "ROBOTSTXT_OBEY": False,
+            "TELNETCONSOLE_ENABLED": False,
+            "REQUEST_FINGERPRINTER_IMPLEMENTATION": "2.7",
+            "RANDOMIZE_DOWNLOAD_DELAY": False,
+            "DOWNLOAD_DELAY": project_settings.DOWNLOAD_DELAY * SCALE,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": 1,
+            "EXTENSIONS": {"r2d2.scrapmetal.throttle.AdaptiveThrottle": 500},
+            "SCRAPMETAL_THROTTLE_ENABLED": throttle,
+            "SCRAPMETAL_THROTTLE_SLOTS": scaled_profiles(),
+        }
+    )
+    crawler = runner.create_crawler(ThrottledSpider)
+    received = {}
+    started = time.monotonic()
+    try:
+        wait(
+            runner.crawl(crawler, port=port.getHost().port, received=received),
+            timeout=30,
+        )
+    finally:
+        port.stopListening()
+    received = {host: [t - started for t in times] for host, times in received.items()}
+    return received, crawler.stats
+
+
+def test_profiles_speed_up_photos_only(wait):
+    fixed, _ = crawl(wait, throttle=False)
+    adaptive, stats = crawl(wait, throttle=True)
+    assert len(adaptive[PAGE_HOST]) == 5
+    assert len(adaptive[CDN_HOST]) == 20
+    assert adaptive[CDN_HOST][-1] < fixed[CDN_HOST][-1] / 2
+    # Pages still come one at a time, no faster than the minimal delay.
+    min_delay = project_settings.SCRAPMETAL_THROTTLE_SLOTS["www.drive2.ru"]
+    min_delay = min_delay["min_delay"] * SCALE
+    assert stats.get_value(f"scrapmetal/throttle/{PAGE_HOST}/concurrency") == 1
+    assert stats.get_value(f"scrapmetal/throttle/{PAGE_HOST}/delay") >= min_delay
+    pages = adaptive[PAGE_HOST]
+    assert pages[-1] - pages[0] >= (len(pages) - 1) * min_delay * 0.9
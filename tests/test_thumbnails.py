@@ -0,0 +1,48 @@
+import pytest
+from scrapy.utils.test import get_crawler
+
+from r2d2.scrapmetal.thumbnails import (
+    ThumbnailPipeline,
+    make_variant,
+    variant_path,
+)
+
+Image = pytest.importorskip("PIL.Image")
+
+PATH = "objects/ab/cd/abcdef.jpg"
+
+
+def test_variant_is_resized_without_exif(tmp_path):
+    source = tmp_path / "source.jpg"
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotated 90 degrees clockwise.
+    Image.new("RGB", (400, 200), "red").save(source, exif=exif.tobytes())
+    target = tmp_path / "thumbnails" / "variant.jpg"
+
+    bytes_in, bytes_out, _ = make_variant(str(source), str(target), 100, 80)
+
+    assert bytes_in == source.stat().st_size
+    assert bytes_out == target.stat().st_size
+    with Image.open(target) as variant:
+        assert variant.size == (50, 100)
+        assert not variant.getexif()
+
+
+def test_existing_variant_is_skipped(tmp_path):
+    crawler = get_crawler(
+        settings_dict={
+            "FILES_STORE": str(tmp_path),
+            "SCRAPMETAL_THUMBNAILS_ENABLED": True,
+            "SCRAPMETAL_THUMBNAILS_SIZE": 100,
+        }
+    )
+    pipeline = ThumbnailPipeline.from_crawler(crawler)
+    thumbnail = variant_path(PATH, 100, 85)
+    assert thumbnail == "thumbnails/100q85/ab/cd/abcdef.jpg"
+    (tmp_path / thumbnail).parent.mkdir(parents=True)
+    (tmp_path / thumbnail).write_bytes(b"jpeg")
+
+    item = {"kind": "Photo", "files": [{"path": PATH}]}
+    assert pipeline.process_item(item, None) is item
+    assert item["files"][0]["thumbnail"] == thumbnail
+    assert crawler.stats.get_value("scrapmetal/thumbnails/skipped") == 1